@@ -0,0 +1,161 @@
+# -*- coding: latin-1 -*-
+
+"""A local fake of Wikimedia Commons, for benchmarks."""
+
+import json
+import time
+import random
+import urllib
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+
+CHUNK_SIZE = 16 * 1024
+
+MSG_DOES_NOT_EXIST = 'The source file %s does not exist'
+
+MSG_BIGGER_THAN_SOURCE = 'Image was not scaled, is the requested width bigger than the source?'
+
+
+class FakeCommonsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """Answer Special:FilePath, upload and categorymembers API requests.
+
+    Files whose name contains `Missing` do not exist, and files whose
+    name contains `Small` are narrower than any thumbnail.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # Headers are written one by one: do not wait for the client to ACK them.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        """Answer the request, after the latency of the server."""
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        (path, _, query) = self.path.partition('?')
+        params = dict(urlparse.parse_qsl(query))
+        if server.error_rate and random.random() < server.error_rate:
+            return self.send_body(503, 'Service Unavailable', {'Retry-After': '0'})
+        if path == '/w/index.php' and params.get('title') == 'Special:FilePath':
+            return self.redirect_to_file(params.get('file', ''), params.get('width'))
+        if path.startswith('/upload/'):
+            return self.send_file()
+        if path == '/w/api.php' and params.get('list') == 'categorymembers':
+            return self.send_category_members(params)
+        self.send_body(404, 'Not found')
+
+    def redirect_to_file(self, file_name, width):
+        """Redirect to the upload URL of the file, or send the API error."""
+        if 'Missing' in file_name:
+            return self.send_body(404, MSG_DOES_NOT_EXIST % file_name)
+        quoted_name = urllib.quote(file_name)
+        if width is None:
+            location = '/upload/%s' % quoted_name
+        elif 'Small' in file_name:
+            return self.send_body(500, MSG_BIGGER_THAN_SOURCE)
+        else:
+            location = '/upload/thumb/%s/%spx-%s' % (quoted_name, width, quoted_name)
+        self.send_body(302, '', {'Location': location})
+
+    def send_file(self):
+        """Send the contents of a file, at the bandwidth of the server."""
+        size = self.server.file_size
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(size))
+        self.send_header('ETag', '"%s"' % size)
+        self.end_headers()
+        chunk = 'x' * CHUNK_SIZE
+        while size > 0:
+            data = chunk[:size]
+            self.wfile.write(data)
+            size -= len(data)
+            if self.server.bandwidth:
+                time.sleep(float(len(data)) / self.server.bandwidth)
+
+    def send_category_members(self, params):
+        """Send a page of the members of a synthetic category.
+
+        Category:Root holds `category_size` files, split evenly into
+        `subcategories` subcategories Category:Sub <n>.
+        """
+        server = self.server
+        title = params.get('cmtitle', '')
+        start = int(params.get('cmcontinue', 0))
+        limit = params.get('cmlimit', '')
+        limit = int(limit) if limit.isdigit() else 500
+        if title == 'Category:Root':
+            members = [{'ns': 14, 'title': 'Category:Sub %s' % index}
+                       for index in range(server.subcategories)]
+            count = 0
+        else:
+            members = []
+            count = server.category_size // max(1, server.subcategories)
+        prefix = title.replace('Category:', '').replace(' ', '_')
+        members.extend({'ns': 6, 'title': 'File:%s_%07d.jpg' % (prefix, index)}
+                       for index in range(count))
+        data = {'query': {'categorymembers': members[start:start + limit]}}
+        if start + limit < len(members):
+            data['continue'] = {'cmcontinue': str(start + limit),
+                                'continue': '-||'}
+        self.send_body(200, json.dumps(data), {'Content-Type': 'application/json'})
+
+    def send_body(self, status, body, headers=None):
+        """Send a response with the given status, body and headers."""
+        self.send_response(status)
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Do not log anything."""
+        pass
+
+
+class FakeCommonsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """A threaded fake Commons server, with configurable performance.
+
+    The latency is in seconds per request, the bandwidth in bytes per
+    second per connection (0 for unlimited), and the error rate is the
+    fraction of requests answered with a 503.
+    """
+
+    daemon_threads = True
+
+    request_queue_size = 128
+
+    def __init__(self, latency=0.0, bandwidth=0, error_rate=0.0,
+                 file_size=32 * 1024, category_size=1000, subcategories=10):
+        """Initialise the server on a free local port."""
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           FakeCommonsHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.file_size = file_size
+        self.category_size = category_size
+        self.subcategories = subcategories
+
+    @property
+    def base_url(self):
+        """Return the URL of the server."""
+        return 'http://127.0.0.1:%s' % self.server_address[1]
+
+    def start(self):
+        """Serve requests in a background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop serving requests."""
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Benchmark the download, manifest and category paths against a fake Commons.
+
+Each benchmark runs in its own process, so that its peak RSS is its own.
+"""
+
+import os
+import sys
+import json
+import time
+import urllib
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fakecommons import FakeCommonsServer
+from commonsdownloader import commonsdownloader, manifest, category
+from commonsdownloader.httpclient import ConnectionPool
+from commonsdownloader.diskwriter import DiskWriter
+
+
+COMMONS_URLS = ('http://commons.wikimedia.org', 'https://commons.wikimedia.org')
+
+BENCHMARKS = ('download', 'manifest', 'category')
+
+
+def generate_file_list(path, count, widths=(100,), missing_ratio=0.0):
+    """Write a synthetic list of count files, at each of the widths."""
+    missing_every = int(1 / missing_ratio) if missing_ratio else 0
+    with open(path, 'w') as f:
+        for index in range(count):
+            prefix = 'Missing' if missing_every and index % missing_every == 0 else 'File'
+            f.write('%s_%07d.jpg,%s\n' % (prefix, index,
+                                          ','.join(str(width) for width in widths)))
+
+
+class TimedResponse(object):
+
+    """A response recording the latency of its file once fully read."""
+
+    def __init__(self, response, started, latencies):
+        """Wrap the response."""
+        self._response = response
+        self._started = started
+        self._latencies = latencies
+        self._done = False
+        self.status = response.status
+        self.headers = response.headers
+
+    def __getattr__(self, name):
+        """Delegate to the wrapped response."""
+        return getattr(self._response, name)
+
+    def read(self, amt=None):
+        """Read from the response, recording the latency at the end."""
+        data = self._response.read(amt)
+        if (not data or amt is None) and not self._done:
+            self._done = True
+            self._latencies.append(time.time() - self._started)
+        return data
+
+
+class BenchmarkTransport(object):
+
+    """A transport sending the requests for Commons to the fake server.
+
+    It records the latency of each file, from the request to the end of
+    its body, and the number of bytes received.
+    """
+
+    def __init__(self, base_url, max_per_host):
+        """Initialise the transport."""
+        self.base_url = base_url
+        self.pool = ConnectionPool(max_per_host=max_per_host)
+        self.latencies = []
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def urlopen(self, url, headers=None):
+        """Return the response of the fake server to the given URL."""
+        for commons_url in COMMONS_URLS:
+            if url.startswith(commons_url):
+                url = self.base_url + url[len(commons_url):]
+        started = time.time()
+        response = self.pool.urlopen(url, headers=headers)
+        with self._lock:
+            self.bytes += int(response.getheader('content-length', 0))
+        return TimedResponse(response, started, self.latencies)
+
+
+class FakeSite(object):
+
+    """A MediaWiki site querying the API of the fake server."""
+
+    def __init__(self, base_url):
+        """Initialise the site."""
+        self.base_url = base_url
+        self.pool = ConnectionPool()
+
+    def api(self, action, **params):
+        """Return the result of an API query."""
+        params['action'] = action
+        params['format'] = 'json'
+        url = self.base_url + '/w/api.php?' + urllib.urlencode(sorted(params.items()))
+        return json.load(self.pool.urlopen(url))
+
+
+def percentile(values, fraction):
+    """Return the given percentile of the values, or None."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def get_peak_rss():
+    """Return the peak resident memory of the process, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, and macOS bytes.
+    return peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+
+def benchmark_download(args, count, jobs, tmpdir):
+    """Download a synthetic list through the fake server."""
+    server = FakeCommonsServer(latency=args.latency, bandwidth=args.bandwidth,
+                               error_rate=args.error_rate, file_size=args.file_size)
+    server.start()
+    list_path = os.path.join(tmpdir, 'list.txt')
+    generate_file_list(list_path, count, widths=args.widths,
+                       missing_ratio=args.missing_ratio)
+    output_path = os.path.join(tmpdir, 'output')
+    os.mkdir(output_path)
+    transport = BenchmarkTransport(server.base_url, max_per_host=max(jobs, 8))
+    writer = DiskWriter(threads=args.write_behind) if args.write_behind else None
+    started = time.time()
+    with open(list_path) as file_list:
+        commonsdownloader.download_from_file_list(
+            file_list, output_path, jobs=jobs, transport=transport,
+            manifest_backend=args.manifest_backend, max_attempts=args.max_attempts,
+            width_in_name=len(args.widths) > 1, writer=writer)
+    if writer:
+        writer.close()
+    duration = time.time() - started
+    server.stop()
+    return {'files': len(transport.latencies), 'bytes': transport.bytes,
+            'duration': duration, 'latencies': transport.latencies}
+
+
+def benchmark_manifest(args, count, jobs, tmpdir):
+    """Record count files in a manifest, then look each of them up."""
+    files = [('File_%07d.jpg' % index, 100) for index in range(count)]
+    local_manifest = manifest.open_manifest(tmpdir, backend=args.manifest_backend)
+    latencies = []
+    started = time.time()
+    for (file_name, width) in files:
+        operation_started = time.time()
+        local_manifest.add(file_name, width, path=file_name, size=0)
+        latencies.append(time.time() - operation_started)
+    local_manifest.close()
+    local_manifest = manifest.open_manifest(tmpdir, backend=args.manifest_backend)
+    skipped = sum(1 for _ in commonsdownloader.get_files_not_in_manifest(
+        iter(files), local_manifest))
+    local_manifest.close()
+    return {'files': count, 'bytes': 0, 'duration': time.time() - started,
+            'latencies': latencies, 'not_in_manifest': skipped}
+
+
+def benchmark_category(args, count, jobs, tmpdir):
+    """List a synthetic category of count files, across its subcategories."""
+    server = FakeCommonsServer(latency=args.latency, category_size=count,
+                               subcategories=args.subcategories)
+    server.start()
+    site = FakeSite(server.base_url)
+    latencies = []
+    started = time.time()
+    last = started
+    for _ in category.crawl_category(site, 'Root', depth=1):
+        now = time.time()
+        latencies.append(now - last)
+        last = now
+    duration = time.time() - started
+    server.stop()
+    return {'files': len(latencies), 'bytes': 0, 'duration': duration,
+            'latencies': latencies}
+
+
+def run_benchmark(name, args, count, jobs, results):
+    """Run the named benchmark in this process, and put its results."""
+    logging.basicConfig(level=logging.CRITICAL)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        result = globals()['benchmark_' + name](args, count, jobs, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    latencies = result.pop('latencies')
+    duration = result['duration'] or 1e-9
+    result.update({'benchmark': name, 'count': count, 'jobs': jobs,
+                   'files_per_second': result['files'] / duration,
+                   'bytes_per_second': result['bytes'] / duration,
+                   'p50': percentile(latencies, 0.50),
+                   'p99': percentile(latencies, 0.99),
+                   'peak_rss_mib': get_peak_rss()})
+    results.put(result)
+
+
+def format_result(result):
+    """Return a line of the report for the given result."""
+    def milliseconds(value):
+        return '%9.2f' % (value * 1000) if value is not None else '%9s' % '-'
+    return '%-9s %8s %5s %10.1f %12.0f %s %s %9.1f' % (
+        result['benchmark'], result['count'], result['jobs'],
+        result['files_per_second'], result['bytes_per_second'],
+        milliseconds(result['p50']), milliseconds(result['p99']),
+        result['peak_rss_mib'])
+
+
+def parse_list(value):
+    """Return the list of integers of a comma-separated string."""
+    return [int(item) for item in value.split(',')]
+
+
+def main():
+    """Main method, entry point of the script."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='The benchmarks to run, among %s (default: all)'
+                        % ', '.join(BENCHMARKS))
+    parser.add_argument('--counts', type=parse_list, default=[1000],
+                        help='Numbers of files, such as 1000,100000,1000000 (default: 1000)')
+    parser.add_argument('--jobs', type=parse_list, default=[1, 8],
+                        help='Concurrency settings to compare, such as 1,8,32 (default: 1,8)')
+    parser.add_argument('--widths', type=parse_list, default=[100],
+                        help='Widths of each file to download (default: 100)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Latency of the fake server, in seconds (default: 0)')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='Bandwidth per connection, in bytes per second (default: unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests failing with a 503 (default: 0)')
+    parser.add_argument('--missing-ratio', type=float, default=0.0,
+                        help='Fraction of files which do not exist (default: 0)')
+    parser.add_argument('--file-size', type=int, default=32 * 1024,
+                        help='Size of the files, in bytes (default: 32768)')
+    parser.add_argument('--subcategories', type=int, default=10,
+                        help='Number of subcategories of the category (default: 10)')
+    parser.add_argument('--manifest-backend', default=manifest.DEFAULT_BACKEND,
+                        choices=sorted(manifest.MANIFEST_BACKENDS))
+    parser.add_argument('--max-attempts', type=int, default=5)
+    parser.add_argument('--write-behind', type=int, default=0, metavar='THREADS',
+                        help='Write files on THREADS writer threads (default: 0, on the downloading threads)')
+    parser.add_argument('--json', action='store_true',
+                        help='Output the results as JSON lines')
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark %s' % name)
+    if not args.json:
+        print '%-9s %8s %5s %10s %12s %9s %9s %9s' % (
+            'benchmark', 'count', 'jobs', 'files/s', 'bytes/s',
+            'p50 (ms)', 'p99 (ms)', 'RSS (MiB)')
+    for name in args.benchmarks or BENCHMARKS:
+        for count in args.counts:
+            for jobs in (args.jobs if name == 'download' else [1]):
+                results = multiprocessing.Queue()
+                process = multiprocessing.Process(target=run_benchmark,
+                                                  args=(name, args, count, jobs,
+                                                        results))
+                process.start()
+                result = results.get()
+                process.join()
+                if args.json:
+                    print json.dumps(result)
+                else:
+                    print format_result(result)
+                sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
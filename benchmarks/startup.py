@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Measure the startup time of the command line, and the import time per module.
+
+Each measure runs in a fresh interpreter, as the command line does, once
+the modules are compiled, as they are when installed. The time to import
+each module is measured by wrapping __import__, both including and
+excluding the modules it imports itself.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+ENTRY_POINT = 'commonsdownloader.commonsdownloader'
+
+IMPORT_TIMER = r'''
+import sys, time, json, __builtin__
+sys.path.insert(0, %(root)r)
+original_import = __builtin__.__import__
+timings = {}
+stack = []
+
+def timed_import(name, *args, **kwargs):
+    known = set(sys.modules)
+    stack.append(0.0)
+    started = time.time()
+    try:
+        return original_import(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - started
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        loaded = [module for module in set(sys.modules) - known
+                  if sys.modules[module] is not None]
+        # Modules of the package are imported by their relative name.
+        for module in loaded:
+            if module == name or module.endswith('.' + name):
+                timings[module] = [elapsed, elapsed - nested]
+                break
+
+__builtin__.__import__ = timed_import
+started = time.time()
+import %(module)s
+total = time.time() - started
+__builtin__.__import__ = original_import
+sys.stdout.write(json.dumps({'total': total, 'modules': timings}))
+'''
+
+
+def median(values, key=None):
+    """Return the median of the values."""
+    values = sorted(values, key=key)
+    return values[len(values) // 2]
+
+
+def get_environment():
+    """Return the environment of the commands, writing the compiled modules."""
+    environment = dict(os.environ)
+    environment.pop('PYTHONDONTWRITEBYTECODE', None)
+    return environment
+
+
+def time_command(command, repeat):
+    """Return the median wall time of running the command, in seconds.
+
+    The command is run once beforehand, so that the modules are compiled.
+    """
+    durations = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat + 1):
+            started = time.time()
+            subprocess.check_call(command, stdout=devnull, stderr=devnull,
+                                  env=get_environment())
+            durations.append(time.time() - started)
+    return median(durations[1:])
+
+
+def time_imports(module, repeat):
+    """Return the median total import time of the module, and the time per module.
+
+    The time per module is that of the run of median total.
+    """
+    code = IMPORT_TIMER % {'root': ROOT, 'module': module}
+    runs = [json.loads(subprocess.check_output([sys.executable, '-c', code],
+                                               env=get_environment()))
+            for _ in range(repeat + 1)][1:]
+    return median(runs, key=lambda run: run['total'])
+
+
+def main():
+    """Measure the startup times, and check them against the budget."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='How many times each command is run (default: 10)')
+    parser.add_argument('--top', type=int, default=15,
+                        help='How many of the slowest modules are listed (default: 15)')
+    parser.add_argument('--budget', type=float, metavar='MS',
+                        help='Exit with an error if importing the entry point takes longer')
+    parser.add_argument('--json', action='store_true',
+                        help='Output the results as JSON')
+    args = parser.parse_args()
+
+    env_code = 'import sys; sys.path.insert(0, %r); ' % ROOT
+    commands = [
+        ('interpreter', [sys.executable, '-c', 'pass']),
+        ('import', [sys.executable, '-c', env_code + 'import %s' % ENTRY_POINT]),
+        ('help', [sys.executable, '-c', env_code +
+                  'sys.argv = ["download_from_Wikimedia_Commons", "--help"]; '
+                  'from %s import main; main()' % ENTRY_POINT]),
+    ]
+    results = {'commands': dict((name, time_command(command, args.repeat))
+                                for (name, command) in commands)}
+    imports = time_imports(ENTRY_POINT, args.repeat)
+    results['import_total'] = imports['total']
+    results['modules'] = sorted(((module, timings[0], timings[1])
+                                 for (module, timings) in imports['modules'].items()),
+                                key=lambda item: -item[2])[:args.top]
+    if args.json:
+        print json.dumps(results, indent=2)
+    else:
+        for (name, _) in commands:
+            print '%-12s %8.1f ms' % (name, 1000 * results['commands'][name])
+        print
+        print 'Import of %s: %.1f ms' % (ENTRY_POINT, 1000 * results['import_total'])
+        print '%-45s %10s %10s' % ('module', 'cumulated', 'self')
+        for (module, cumulated, own) in results['modules']:
+            print '%-45s %7.1f ms %7.1f ms' % (module, 1000 * cumulated, 1000 * own)
+    if args.budget is not None and 1000 * results['import_total'] > args.budget:
+        sys.stderr.write('Importing %s took %.1f ms, over the budget of %.1f ms\n'
+                         % (ENTRY_POINT, 1000 * results['import_total'], args.budget))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
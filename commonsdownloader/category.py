@@ -0,0 +1,122 @@
+# -=- encoding: latin-1 -=-
+
+"""Enumerate the files of a category, descending into its subcategories."""
+
+import logging
+from collections import deque
+
+
+FILE_NAMESPACE = 6
+
+CATEGORY_NAMESPACE = 14
+
+DEFAULT_DEPTH = 0
+
+
+def get_page_name(title):
+    """Return the page name of the given title, without its namespace."""
+    return title.split(':', 1)[-1].encode('utf-8')
+
+
+def normalize_category_name(category_name):
+    """Return the category name, with spaces rather than underscores."""
+    return category_name.strip().replace('_', ' ')
+
+
+def list_category_pages(site, category_name, continuation=None):
+    """Yield the members of a category page by page, with their continuation.
+
+    Each page is yielded as the continuation parameters it was requested
+    with, None for the first one, and its list of (namespace, title). The
+    listing starts from the given continuation, if any.
+    """
+    params = {'list': 'categorymembers',
+              'cmtitle': 'Category:%s' % category_name,
+              'cmtype': 'file|subcat',
+              'cmprop': 'title',
+              'cmlimit': 'max',
+              'continue': ''}
+    if continuation:
+        params.update(continuation)
+    while True:
+        result = site.api('query', **params)
+        yield (continuation, [(member['ns'], member['title'])
+                              for member in result['query']['categorymembers']])
+        if 'continue' not in result:
+            return
+        continuation = result['continue']
+        params.update(continuation)
+
+
+def list_category_members(site, category_name):
+    """Yield the (namespace, title) of the files and subcategories of a category.
+
+    The members are listed page by page, following the continuation
+    tokens of the API.
+    """
+    for (_, members) in list_category_pages(site, category_name):
+        for member in members:
+            yield member
+
+
+def _encode_name(name):
+    """Return a name restored from a JSON position, as a UTF-8 string."""
+    return name.encode('utf-8') if isinstance(name, unicode) else name
+
+
+def walk_category(site, category_name, depth=DEFAULT_DEPTH, position=None):
+    """Yield the file names of a category and of its subcategories, positioned.
+
+    Each file name is yielded with the position of the crawl after it,
+    which can be stored as JSON, and from which the crawl can be resumed
+    by giving it as `position`. A position is the state of the crawl at
+    the start of an API page, and the number of members of the page
+    processed. Files already yielded before a resumption may be yielded
+    again if they belong to several categories.
+    """
+    if position is None:
+        category_name = normalize_category_name(category_name)
+        state = {'categories': [[category_name, 0]],
+                 'seen': [category_name],
+                 'continue': None}
+        skip = 0
+    else:
+        (state, skip) = position
+    categories = deque((_encode_name(name), level)
+                       for (name, level) in state['categories'])
+    seen_categories = set(_encode_name(name) for name in state['seen'])
+    continuation = state['continue']
+    seen_files = set()
+    while categories:
+        (current_category, level) = categories[0]
+        logging.debug("Listing category %s", current_category)
+        for (page_continuation, members) in list_category_pages(
+                site, current_category, continuation):
+            page_state = {'categories': [[name, category_level] for
+                                         (name, category_level) in categories],
+                          'seen': sorted(seen_categories),
+                          'continue': page_continuation}
+            for (index, (namespace, title)) in enumerate(members):
+                page_name = get_page_name(title)
+                if namespace == FILE_NAMESPACE:
+                    if index >= skip and page_name not in seen_files:
+                        seen_files.add(page_name)
+                        yield (page_name, (page_state, index + 1))
+                elif namespace == CATEGORY_NAMESPACE and level < depth:
+                    if page_name not in seen_categories:
+                        seen_categories.add(page_name)
+                        categories.append((page_name, level + 1))
+            skip = 0
+        continuation = None
+        categories.popleft()
+
+
+def crawl_category(site, category_name, depth=DEFAULT_DEPTH):
+    """Yield the file names of a category, and of its subcategories.
+
+    Subcategories are crawled breadth-first, down to `depth` levels.
+    Each file and each category is only yielded or crawled once, even
+    when several subcategories overlap or form a cycle.
+    """
+    for (page_name, _) in walk_category(site, category_name, depth=depth):
+        yield page_name
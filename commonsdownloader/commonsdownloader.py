@@ -9,45 +9,205 @@ reload(sys)
 sys.setdefaultencoding("utf-8")
 
 import os
+import json
 import logging
 import argparse
-from thumbnaildownload import download_file, DownloadException
-from itertools import izip_longest
+from thumbnaildownload import (fetch_file, fetch_resolved_file,
+                               DownloadException, TransientDownloadException,
+                               FileNotModifiedException, name_widths,
+                               is_width_in_name, DEFAULT_BUFFER_SIZE)
+from imageinfo import resolve_files
+from manifest import open_manifest, MANIFEST_BACKENDS, DEFAULT_BACKEND
+from workerpool import run_with_retries, prefetch, DEFAULT_JOBS
+from ratelimit import (AdaptiveConcurrency, TokenBucket, backoff_delay,
+                       DEFAULT_MAX_ATTEMPTS)
+from category import crawl_category, walk_category, DEFAULT_DEPTH
+from httpclient import ConnectionPool, DEFAULT_MAX_PER_HOST
+from filelist import open_file_list, parse_shard, filter_shard
+from prescan import PreScan, PRESCAN_THRESHOLD
+from scheduler import (Scheduler, read_priorities, parse_size,
+                       DEFAULT_LARGE_SIZE)
+from layout import (get_output_directory, migrate_layout, LAYOUTS,
+                    DEFAULT_LAYOUT)
+from coordinator import (LeaseStore, work, DEFAULT_BATCH_SIZE,
+                         DEFAULT_LEASE_DURATION)
+from server import (DownloadServer, submit, DEFAULT_CONCURRENT_JOBS,
+                    DEFAULT_PRIORITY)
+from diskwriter import DiskWriter, FSYNC_POLICIES, DEFAULT_FSYNC
+from titlecache import (TitleCache, DEFAULT_TTL, DEFAULT_NEGATIVE_TTL,
+                        DEFAULT_MAX_ENTRIES, DAY)
+from metrics import (Metrics, MetricsReporter, NULL_METRICS, EXPORT_FORMATS,
+                     DEFAULT_INTERVAL)
+from itertools import izip_longest, islice, chain
+
+
+def get_category_files_from_api(category_name, depth=DEFAULT_DEPTH):
+    """Yield the file names of a category by querying the MediaWiki API.
+
+    Subcategories are crawled down to `depth` levels, and the listing
+    runs ahead of the consumer in a background thread.
+    """
+    import mwclient
+    site = mwclient.Site('commons.wikimedia.org')
+    return prefetch(crawl_category(site, category_name, depth=depth))
 
 
-def get_category_files_from_api(category_name):
-    """Yield the file names of a category by querying the MediaWiki API."""
+def get_positioned_category_files_from_api(category_name, depth=DEFAULT_DEPTH,
+                                           position=None):
+    """Yield the file names of a category, with the position of the crawl.
+
+    The crawl is resumed from the given position, if any. Files are
+    yielded as the records of expand_positions, without widths.
+    """
     import mwclient
     site = mwclient.Site('commons.wikimedia.org')
-    category = site.Categories[category_name]
-    return (x.page_title.encode('utf-8')
-            for x in category.members(namespace=6))
+    return prefetch((page_name, None, page_position) for (page_name, page_position)
+                    in walk_category(site, category_name, depth=depth,
+                                     position=position))
 
 
-def download_from_category(category_name, output_path, width):
-    """Download files of a given category."""
-    file_names = get_category_files_from_api(category_name)
-    files_to_download = izip_longest(file_names, [], fillvalue=width)
-    download_files_if_not_in_manifest(files_to_download, output_path)
+def get_renditions(file_names, widths):
+    """Yield each of the file names with each of the widths.
 
+    The renditions of a file follow each other, so that they are resolved
+    together and downloaded at the same time.
+    """
+    for file_name in file_names:
+        for width in widths:
+            yield (file_name, width)
 
-def get_files_from_textfile(textfile_handler):
-    """Yield the file names and widths by parsing a text file handler."""
-    for line in textfile_handler:
-        line = line.rstrip()
+
+def parse_widths(value):
+    """Return the list of widths of a comma-separated string."""
+    try:
+        return [int(width) for width in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid list of widths: %s" % value)
+
+
+def download_from_category(category_name, output_path, width,
+                           depth=DEFAULT_DEPTH, widths=None, journal=None,
+                           **options):
+    """Download files of a given category, at the given width or widths.
+
+    With a Journal, the crawl of the category is resumed from its cursor.
+    """
+    if journal:
+        from journal import expand_positions
+        records = get_positioned_category_files_from_api(
+            category_name, depth=depth, position=journal.position)
+        files_to_download = expand_positions(records, widths or [width],
+                                             cursor=journal.cursor)
+    else:
+        file_names = get_category_files_from_api(category_name, depth=depth)
+        files_to_download = get_renditions(file_names, widths or [width])
+    download_files_if_not_in_manifest(files_to_download, output_path,
+                                      journal=journal, **options)
+
+
+def parse_file_line(line):
+    """Return the file name and the list of widths of a file list line.
+
+    Lines are formatted as `filename,width[,width...]`; a line without any
+    width is a file at full size.
+    """
+    parts = line.split(',')
+    widths = []
+    while len(parts) > 1:
         try:
-            (image_name, width) = line.rsplit(',', 1)
-            width = int(width)
+            widths.insert(0, int(parts[-1]))
         except ValueError:
-            image_name = line
-            width = None
-        yield (image_name, width)
+            break
+        parts.pop()
+    return (','.join(parts), widths)
+
+
+def get_files_from_textfile(textfile_handler, default_widths=None):
+    """Yield the file names and widths by parsing a text file handler.
+
+    Files listed without a width are yielded with each of default_widths,
+    if given, and at full size otherwise. The widths of a line with
+    several widths are NamedWidth, so that its renditions are named
+    after their width.
+    """
+    for line in textfile_handler:
+        (image_name, widths) = parse_file_line(line.rstrip())
+        for width in name_widths(widths or default_widths or [None]):
+            yield (image_name, width)
+
+
+def get_positioned_files_from_textfile(textfile_handler, offset=0):
+    """Yield the file name, widths and byte offset after each line of a list.
+
+    The list is read from the given offset, which compressed lists reach
+    by decompressing up to it. Lines are yielded as the records of
+    expand_positions.
+    """
+    if offset:
+        textfile_handler.seek(offset)
+    for line in textfile_handler:
+        offset += len(line)
+        (image_name, widths) = parse_file_line(line.rstrip())
+        yield (image_name, widths, offset)
+
+
+def count_files_in_textfile(textfile_handler, default_widths=None):
+    """Return the number of files to download of a text file, and rewind it.
+
+    Return None for the standard input and compressed lists, which are
+    only read once as a stream.
+    """
+    if not isinstance(textfile_handler, file) or textfile_handler is sys.stdin:
+        return None
+    count = sum(1 for _ in get_files_from_textfile(textfile_handler,
+                                                   default_widths=default_widths))
+    textfile_handler.seek(0)
+    return count
+
+
+def open_file_list_argument(path):
+    """Open the file list given on the command line, for argparse."""
+    try:
+        return open_file_list(path)
+    except IOError, e:
+        raise argparse.ArgumentTypeError("Could not open %s: %s" % (path, e))
 
 
-def download_from_file_list(file_list, output_path):
-    """Download files from a given textfile list."""
-    files_to_download = get_files_from_textfile(file_list)
-    download_files_if_not_in_manifest(files_to_download, output_path)
+def parse_shard_argument(value):
+    """Parse the shard given on the command line, for argparse."""
+    try:
+        return parse_shard(value)
+    except ValueError, e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_size_argument(value):
+    """Parse a size in bytes given on the command line, for argparse."""
+    try:
+        return parse_size(value)
+    except ValueError, e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def download_from_file_list(file_list, output_path, widths=None, journal=None,
+                            **options):
+    """Download files from a given textfile list, read as a stream.
+
+    The files of the lines with several widths are named after their
+    width, so that the renditions of a file do not overwrite each other.
+    With a Journal, the list is read from its cursor.
+    """
+    if journal:
+        from journal import expand_positions
+        records = get_positioned_files_from_textfile(
+            file_list, offset=journal.position or 0)
+        files_to_download = expand_positions(records, default_widths=widths,
+                                             cursor=journal.cursor)
+    else:
+        files_to_download = get_files_from_textfile(file_list,
+                                                    default_widths=widths)
+    download_files_if_not_in_manifest(files_to_download, output_path,
+                                      journal=journal, **options)
 
 
 def get_files_from_arguments(files, width):
@@ -55,10 +215,10 @@ def get_files_from_arguments(files, width):
     return izip_longest(files, [], fillvalue=width)
 
 
-def download_from_files(files, output_path, width):
-    """Download files from a given file list."""
-    files_to_download = get_files_from_arguments(files, width)
-    download_files_if_not_in_manifest(files_to_download, output_path)
+def download_from_files(files, output_path, width, widths=None, **options):
+    """Download files from a given file list, at the given width or widths."""
+    files_to_download = get_renditions(files, widths or [width])
+    download_files_if_not_in_manifest(files_to_download, output_path, **options)
 
 
 def get_local_manifest_path(output_path):
@@ -85,24 +245,365 @@ def is_file_in_manifest(file_name, width, manifest):
 
 
 def write_file_to_manifest(file_name, width, manifest_fh):
-    """Write the given file in manifest."""
+    """Write the given file in manifest.
+
+    The line is flushed right away, so that a crash does not lose it.
+    """
     manifest_fh.write("%s,%s\n" % (file_name, str(width)))
+    manifest_fh.flush()
     logging.debug("Wrote file %s to manifest", file_name)
 
 
-def download_files_if_not_in_manifest(files_iterator, output_path):
-    """Download the given files to the given path, unless in manifest."""
-    local_manifest = read_local_manifest(output_path)
-    with open(get_local_manifest_path(output_path), 'a') as manifest_fh:
-        for (file_name, width) in files_iterator:
-            if is_file_in_manifest(file_name, width, local_manifest):
-                logging.info('Skipping file %s', file_name)
-                continue
-            try:
-                download_file(file_name, output_path, width=width)
-                write_file_to_manifest(file_name, width, manifest_fh)
-            except DownloadException, e:
-                logging.error("Could not download %s: %s", file_name, e.message)
+def get_files_not_in_manifest(files_iterator, manifest, metrics=NULL_METRICS,
+                              on_skip=None):
+    """Yield the file names and widths which are not in manifest.
+
+    on_skip(file_name, width), if given, is called for each file skipped.
+    """
+    for (file_name, width) in files_iterator:
+        with metrics.timer('manifest'):
+            in_manifest = (file_name, width) in manifest
+        if in_manifest:
+            logging.info('Skipping file %s', file_name)
+            metrics.increment('skipped')
+            if on_skip:
+                on_skip(file_name, width)
+            continue
+        yield (file_name, width)
+
+
+def get_files_not_downloaded(files_iterator, manifest, output_path,
+                              width_in_name=False, layout=DEFAULT_LAYOUT,
+                              metrics=NULL_METRICS, on_skip=None,
+                              threshold=PRESCAN_THRESHOLD):
+    """Yield the file names and widths which are not downloaded yet.
+
+    The first `threshold` files are looked up in manifest one by one, so
+    that small jobs start right away. Files past them are filtered by a
+    PreScan of the manifest and the output folder, which then pays off.
+    on_skip(file_name, width), if given, is called for each file skipped.
+    """
+    files_iterator = iter(files_iterator)
+    for item in get_files_not_in_manifest(islice(files_iterator, threshold),
+                                          manifest, metrics=metrics,
+                                          on_skip=on_skip):
+        yield item
+    rest = list(islice(files_iterator, 1))
+    if not rest:
+        return
+    with metrics.timer('manifest'):
+        scan = PreScan(manifest, output_path, width_in_name=width_in_name,
+                       layout=layout)
+    for item in scan.filter(chain(rest, files_iterator), metrics=metrics,
+                            on_skip=on_skip):
+        yield item
+
+
+def get_retry_delay(exception, attempt):
+    """Return the delay before retrying a download which failed, or None."""
+    if isinstance(exception, TransientDownloadException):
+        return backoff_delay(attempt, retry_after=exception.retry_after)
+    return None
+
+
+def count_retries(get_retry_delay, metrics, max_attempts):
+    """Wrap get_retry_delay, counting the downloads retried."""
+    def get_counted_retry_delay(exception, attempt):
+        delay = get_retry_delay(exception, attempt)
+        if delay is not None and attempt + 1 < max_attempts:
+            metrics.increment('retried')
+        return delay
+    return get_counted_retry_delay
+
+
+def download_files_if_not_in_manifest(files_iterator, output_path,
+                                      jobs=DEFAULT_JOBS, prefetch=False,
+                                      manifest_backend=DEFAULT_BACKEND,
+                                      rate=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                                      store=None, refresh=False,
+                                      width_in_name=False, shard=None,
+                                      thumbnailer=None, metrics=None,
+                                      layout=DEFAULT_LAYOUT, title_cache=None,
+                                      on_result=None, journal=None,
+                                      manifest=None, prescan=True,
+                                      scheduler=None, **download_options):
+    """Download the given files to the given path, unless in manifest.
+
+    Up to `jobs` files are downloaded at the same time, fewer while the
+    server throttles us, and at most `rate` files per second if given.
+    Transient failures are retried at the end of the job, up to
+    `max_attempts` times. With `prefetch`, files are first resolved in
+    batches through the imageinfo API, or from the TitleCache if given.
+    With an ObjectStore, files already in the store are linked rather than
+    downloaded. Files in manifest are skipped, and past the first
+    PRESCAN_THRESHOLD files, those already in the output folder as well,
+    in bulk after a scan of both; without `prescan`, all files are
+    looked up in manifest one by one, which suits batches of an open
+    manifest. An open `manifest` of the output folder can be given, which is
+    then left open, rather than opening it. With `refresh`, files in
+    manifest are fetched again with a conditional request, and only
+    rewritten if they changed since. With `width_in_name`, the output
+    file names are prefixed with the width, so that several renditions of
+    a file can be downloaded to the same folder, as are those of files
+    at a NamedWidth. With a (K, N) `shard`,
+    only the files of the K-th out of N shards are downloaded. With a
+    LocalThumbnailer, thumbnails of files already downloaded at full size
+    are rendered locally rather than downloaded, those whose rendering
+    fails being reported as failed. With the `hashed` layout,
+    files are written to subfolders named after the MD5 of their name,
+    like the uploads of Commons. The files processed and the time spent
+    in each stage are recorded in `metrics`, if given.
+    `on_result(file_name, width, status, downloaded, error)`, if given, is
+    called once each file is done, from the worker threads, with the
+    status among downloaded, linked, rendered, not_modified, skipped and
+    failed, the DownloadedFile, and the error message of failures.
+    With a Journal, files_iterator yields the positioned files of
+    expand_positions, and the progress of the job is checkpointed to the
+    journal, once the manifest is flushed to disk. Files which failed are
+    not done, so that the job is resumed from them.
+    With a Scheduler, files are started by priority and size rather than
+    in the order of files_iterator, and the bytes in flight are capped.
+    The other options are passed on to download_file.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    if thumbnailer:
+        from localthumbnail import can_render
+    own_manifest = manifest is None
+    if own_manifest:
+        manifest = open_manifest(output_path, backend=manifest_backend)
+    concurrency = AdaptiveConcurrency(jobs)
+    bucket = TokenBucket(rate) if rate else None
+
+    def record(file_name, width, downloaded):
+        with metrics.timer('manifest'):
+            manifest.add(file_name, width,
+                         path=os.path.relpath(downloaded.path, output_path),
+                         size=downloaded.size, checksum=downloaded.sha1,
+                         etag=downloaded.etag,
+                         last_modified=downloaded.last_modified)
+
+    def report(file_name, width, status, downloaded=None, error=None):
+        metrics.increment(status)
+        if on_result:
+            on_result(file_name, width, status, downloaded, error)
+        if journal and status != 'failed':
+            journal.complete(file_name, width)
+
+    def report_skipped(file_name, width):
+        if on_result:
+            on_result(file_name, width, 'skipped', None, None)
+        if journal:
+            journal.complete(file_name, width)
+
+    def sync():
+        writer = download_options.get('writer')
+        if writer:
+            writer.sync_batch()
+        with metrics.timer('manifest'):
+            manifest.sync()
+
+    def give_up(arguments, exception):
+        (file_name, width) = arguments[:2]
+        report(file_name, width, 'failed', error=str(exception))
+
+    def record_rendered(file_name, width, downloaded):
+        record(file_name, width, downloaded)
+        report(file_name, width, 'rendered', downloaded)
+
+    def download_and_record(file_name, width, file_info=None):
+        downloaded = None
+        in_name = is_width_in_name(width, width_in_name)
+        known = refresh and (file_name, width) in manifest
+        directory = get_output_directory(output_path, file_name, layout)
+        if thumbnailer and width is not None and not known:
+            source_path = manifest.get_path(file_name, None)
+            if source_path and can_render(source_path):
+                thumbnailer.submit(file_name, width, source_path, directory,
+                                   lambda downloaded: record_rendered(
+                                       file_name, width, downloaded),
+                                   width_in_name=in_name,
+                                   error_callback=lambda error: report(
+                                       file_name, width, 'failed', error=error))
+                return
+        if store and not known:
+            downloaded = store.link_file(file_name, width, directory,
+                                         file_info=file_info,
+                                         width_in_name=in_name)
+            if downloaded is not None:
+                record(file_name, width, downloaded)
+                report(file_name, width, 'linked', downloaded)
+                return
+        validators = manifest.get_validators(file_name, width) if known else None
+        downloaded = fetch(file_name, width, file_info, validators, directory,
+                           in_name)
+        if downloaded is not None:
+            record(file_name, width, downloaded)
+            report(file_name, width, 'downloaded', downloaded)
+
+    def download_scheduled(file_name, width, file_info=None):
+        try:
+            download_and_record(file_name, width, file_info)
+        finally:
+            scheduler.done(file_name, width)
+
+    def fetch(file_name, width, file_info, validators, directory, in_name):
+        concurrency.acquire()
+        if bucket:
+            bucket.acquire()
+        throttled = False
+        retry_after = None
+        try:
+            if prefetch:
+                downloaded = fetch_resolved_file(file_name, file_info,
+                                                 directory, width=width,
+                                                 validators=validators,
+                                                 width_in_name=in_name,
+                                                 metrics=metrics,
+                                                 **download_options)
+            else:
+                downloaded = fetch_file(file_name, directory, width=width,
+                                        validators=validators,
+                                        width_in_name=in_name,
+                                        metrics=metrics,
+                                        **download_options)
+        except TransientDownloadException, e:
+            throttled = True
+            retry_after = e.retry_after
+            raise
+        except FileNotModifiedException:
+            logging.info("File %s not modified", file_name)
+            report(file_name, width, 'not_modified')
+            return
+        except DownloadException, e:
+            logging.error("Could not download %s: %s", file_name, e.message)
+            report(file_name, width, 'failed', error=e.message)
+            return
+        finally:
+            concurrency.release(throttled=throttled, retry_after=retry_after)
+        if store:
+            store.add(file_name, width, downloaded, width_in_name=in_name)
+        return downloaded
+
+    if journal:
+        files_iterator = journal.track(files_iterator, shard=shard, sync=sync)
+    elif shard:
+        files_iterator = filter_shard(files_iterator, shard)
+    try:
+        if refresh:
+            files_to_download = files_iterator
+        elif not prescan:
+            files_to_download = get_files_not_in_manifest(
+                files_iterator, manifest, metrics=metrics, on_skip=report_skipped)
+        else:
+            files_to_download = get_files_not_downloaded(
+                files_iterator, manifest, output_path,
+                width_in_name=width_in_name, layout=layout, metrics=metrics,
+                on_skip=report_skipped)
+        if prefetch:
+            files_to_download = resolve_files(
+                files_to_download, transport=download_options.get('transport'),
+                metrics=metrics, cache=title_cache)
+        if scheduler:
+            files_to_download = scheduler.schedule(files_to_download)
+        run_with_retries(download_scheduled if scheduler else download_and_record,
+                         files_to_download,
+                         count_retries(get_retry_delay, metrics, max_attempts),
+                         jobs=jobs, max_attempts=max_attempts, give_up=give_up)
+    finally:
+        if thumbnailer:
+            thumbnailer.wait()
+        if journal:
+            journal.checkpoint()
+        if own_manifest:
+            manifest.close()
+
+
+def serve_jobs(socket_path=None, spool_path=None,
+               concurrent_jobs=DEFAULT_CONCURRENT_JOBS, **options):
+    """Download the jobs sent on the Unix socket or dropped in the spool folder.
+
+    The jobs are run by a DownloadServer, on a Downloader session with the
+    given options, until interrupted.
+    """
+    from downloader import Downloader
+    downloader = Downloader(**options)
+    server = DownloadServer(downloader, concurrent_jobs=concurrent_jobs)
+    try:
+        if socket_path:
+            server.serve_socket(socket_path)
+        if spool_path:
+            server.serve_spool(spool_path)
+        server.wait()
+    except KeyboardInterrupt:
+        logging.info("Stopping the server")
+    finally:
+        server.close()
+        downloader.close()
+
+
+def submit_job(socket_path, output_path, files=None, list_path=None,
+               widths=None, priority=DEFAULT_PRIORITY, refresh=False):
+    """Submit a job to the server on the Unix socket, writing its results out.
+
+    The results are written to the standard output as JSON lines, and
+    the summary of the job is returned.
+    """
+    job = {'output': os.path.abspath(output_path),
+           'widths': widths,
+           'priority': priority,
+           'refresh': refresh}
+    if list_path:
+        job['list'] = os.path.abspath(list_path)
+    else:
+        job['files'] = files
+    for message in submit(socket_path, job):
+        sys.stdout.write(json.dumps(message) + '\n')
+    return message
+
+
+def split_job(store_path, files_iterator, batch_size=DEFAULT_BATCH_SIZE):
+    """Split the files into batches in the lease store, for workers to lease.
+
+    Raise ValueError if the store already holds a job.
+    """
+    store = LeaseStore(store_path)
+    try:
+        if not store.is_empty():
+            raise ValueError('The lease store %s already holds a job' % store_path)
+        return store.add_batches(files_iterator, batch_size=batch_size)
+    finally:
+        store.close()
+
+
+def download_leased_files(store_path, output_path,
+                          lease_duration=DEFAULT_LEASE_DURATION, **options):
+    """Download the batches leased from the lease store, until the job is done.
+
+    The manifest of the output folder is opened once for all the batches,
+    whose files are looked up in it one by one rather than after a scan
+    of the output folder. The options are passed on to
+    download_files_if_not_in_manifest.
+    """
+    store = LeaseStore(store_path)
+    manifest = open_manifest(output_path,
+                             backend=options.get('manifest_backend', DEFAULT_BACKEND))
+    try:
+        work(store, lambda files: download_files_if_not_in_manifest(
+            files, output_path, manifest=manifest, prescan=False, **options),
+            duration=lease_duration)
+    finally:
+        manifest.close()
+        store.close()
+
+
+def migrate_output_folder(output_path, layout):
+    """Move the files of the output folder to the given layout."""
+    manifest = open_manifest(output_path, backend='sqlite')
+    try:
+        migrate_layout(manifest, output_path, layout)
+    finally:
+        manifest.close()
 
 
 class Folder(argparse.Action):
@@ -127,8 +628,8 @@ def main():
     source_group = parser.add_mutually_exclusive_group()
     source_group.add_argument("-l", "--list", metavar="LIST",
                               dest="file_list",
-                              type=argparse.FileType('r'),
-                              help='A list of files <filename,width>')
+                              type=open_file_list_argument,
+                              help='A list of files <filename,width>, possibly compressed (.gz, .bz2, .xz), or - for the standard input')
     source_group.add_argument("-c", "--category", metavar="CATEGORY",
                               dest="category_name",
                               type=str,
@@ -141,11 +642,180 @@ def main():
                         action=Folder,
                         default=os.getcwd(),
                         help='The directory to download the files to')
+    parser.add_argument("-d", "--depth",
+                        dest="depth",
+                        type=int,
+                        default=DEFAULT_DEPTH,
+                        help='With --category, how many levels of subcategories to descend into (default: 0)')
     parser.add_argument("-w", "--width",
                         dest="width",
                         type=int,
                         default=100,
                         help='The width of the thumbnail (default: 100)')
+    parser.add_argument("--widths", metavar="WIDTHS",
+                        dest="widths",
+                        type=parse_widths,
+                        help='Several widths to download each file at, such as 120,320,800 (implies --width-in-name)')
+    parser.add_argument("--width-in-name",
+                        dest="width_in_name",
+                        action="store_true",
+                        help='Prefix the downloaded file names with their width, as <width>px-<name>')
+    parser.add_argument("--shard", metavar="K/N",
+                        dest="shard",
+                        type=parse_shard_argument,
+                        help='Only download the K-th of N shards of the files, split on their names')
+    parser.add_argument("-j", "--jobs",
+                        dest="jobs",
+                        type=int,
+                        default=DEFAULT_JOBS,
+                        help='The number of files to download at the same time (default: 1)')
+    parser.add_argument("--rate",
+                        dest="rate",
+                        type=float,
+                        help='The maximum number of files to download per second')
+    parser.add_argument("--max-attempts",
+                        dest="max_attempts",
+                        type=int,
+                        default=DEFAULT_MAX_ATTEMPTS,
+                        help='How many times to try downloading a file when the server is unavailable (default: %s)' % DEFAULT_MAX_ATTEMPTS)
+    parser.add_argument("--store", metavar="FOLDER",
+                        dest="store_path",
+                        help='A folder where downloaded files are shared across jobs, and linked from')
+    parser.add_argument("--connections-per-host",
+                        dest="connections_per_host",
+                        type=int,
+                        default=DEFAULT_MAX_PER_HOST,
+                        help='The maximum number of requests in flight to a host (default: %s)' % DEFAULT_MAX_PER_HOST)
+    parser.add_argument("--buffer-size",
+                        dest="buffer_size",
+                        type=int,
+                        default=DEFAULT_BUFFER_SIZE,
+                        help='The size in bytes of the chunks written to disk (default: %s)' % DEFAULT_BUFFER_SIZE)
+    parser.add_argument("--write-behind", metavar="THREADS",
+                        dest="write_threads",
+                        type=int,
+                        nargs='?',
+                        const=1,
+                        help='Write files to disk on THREADS threads of their own, while downloading the next chunks (default: 1)')
+    parser.add_argument("--fsync",
+                        dest="fsync",
+                        choices=FSYNC_POLICIES,
+                        default=DEFAULT_FSYNC,
+                        help='When files are flushed to disk: never, before each file is renamed, or in batches (default: %s, implies --write-behind)' % DEFAULT_FSYNC)
+    parser.add_argument("--prefetch",
+                        dest="prefetch",
+                        action="store_true",
+                        help='Resolve files in batches through the API before downloading them')
+    parser.add_argument("--title-cache", metavar="PATH",
+                        dest="title_cache_path",
+                        help='A file caching how titles resolve across runs, including missing files (implies --prefetch)')
+    parser.add_argument("--title-cache-ttl", metavar="DAYS",
+                        dest="title_cache_ttl",
+                        type=float,
+                        default=DEFAULT_TTL / DAY,
+                        help='How long titles are kept in cache, in days (default: %s)' % (DEFAULT_TTL / DAY))
+    parser.add_argument("--title-cache-size",
+                        dest="title_cache_size",
+                        type=int,
+                        default=DEFAULT_MAX_ENTRIES,
+                        help='How many titles are kept in cache, the least recently used being dropped (default: %s)' % DEFAULT_MAX_ENTRIES)
+    parser.add_argument("--render-locally", metavar="PROCESSES",
+                        dest="render_processes",
+                        type=int,
+                        nargs='?',
+                        const=0,
+                        help='Render the thumbnails of files already downloaded at full size locally, on PROCESSES processes (default: one per core)')
+    parser.add_argument("--schedule",
+                        dest="schedule",
+                        action="store_true",
+                        help='Start the files of higher priority first, then the smallest, with large files downloaded apart, one at a time (implies --prefetch)')
+    parser.add_argument("--priorities", metavar="LIST",
+                        dest="priorities_list",
+                        type=open_file_list_argument,
+                        help='A list of <filename,priority>, files of higher priority being started first, others having priority 0 (implies --schedule)')
+    parser.add_argument("--max-in-flight", metavar="SIZE",
+                        dest="max_in_flight",
+                        type=parse_size_argument,
+                        help='Cap the estimated bytes of the files downloading at the same time, such as 500M, large files aside (implies --schedule)')
+    parser.add_argument("--large-size", metavar="SIZE",
+                        dest="large_size",
+                        type=parse_size_argument,
+                        default=DEFAULT_LARGE_SIZE,
+                        help='With --schedule, the size from which files are large, and downloaded apart (default: %sM)' % (DEFAULT_LARGE_SIZE // 1024 ** 2))
+    parser.add_argument("--refresh",
+                        dest="refresh",
+                        action="store_true",
+                        help='Revalidate the files already downloaded, fetching again those which changed')
+    parser.add_argument("--resume",
+                        dest="resume",
+                        action="store_true",
+                        help='Resume the job of the list or category from where it stopped, rather than starting it afresh')
+    parser.add_argument("--manifest-backend",
+                        dest="manifest_backend",
+                        choices=sorted(MANIFEST_BACKENDS),
+                        default=DEFAULT_BACKEND,
+                        help='How the downloaded files are recorded (default: %s)' % DEFAULT_BACKEND)
+    parser.add_argument("--layout",
+                        dest="layout",
+                        choices=LAYOUTS,
+                        default=DEFAULT_LAYOUT,
+                        help='How files are laid out in the output folder: all in it, or hashed into subfolders like the uploads of Commons (default: %s)' % DEFAULT_LAYOUT)
+    parser.add_argument("--migrate-layout", metavar="LAYOUT",
+                        dest="migrate_layout",
+                        choices=LAYOUTS,
+                        help='Move the files already downloaded to the given layout, and exit')
+    parser.add_argument("--serve", metavar="SOCKET",
+                        dest="serve_socket",
+                        help='Run as a server, downloading the jobs sent on the Unix socket SOCKET')
+    parser.add_argument("--spool", metavar="FOLDER",
+                        dest="spool_path",
+                        help='Run as a server, downloading the jobs dropped in FOLDER as JSON files')
+    parser.add_argument("--concurrent-jobs",
+                        dest="concurrent_jobs",
+                        type=int,
+                        default=DEFAULT_CONCURRENT_JOBS,
+                        help='With --serve or --spool, how many jobs are run at the same time (default: %s)' % DEFAULT_CONCURRENT_JOBS)
+    parser.add_argument("--submit", metavar="SOCKET",
+                        dest="submit_socket",
+                        help='Send the files or the list as a job to the server on the Unix socket SOCKET, rather than downloading them')
+    parser.add_argument("--priority",
+                        dest="priority",
+                        type=int,
+                        default=DEFAULT_PRIORITY,
+                        help='With --submit, the priority of the job, jobs of higher priority being run first (default: %s)' % DEFAULT_PRIORITY)
+    parser.add_argument("--coordinate", metavar="STORE",
+                        dest="coordinate_store",
+                        help='Split the files, list or category into batches in the lease store STORE, for workers to download, rather than downloading them')
+    parser.add_argument("--work", metavar="STORE",
+                        dest="work_store",
+                        help='Download the batches leased from the lease store STORE, until the job is done')
+    parser.add_argument("--batch-size",
+                        dest="batch_size",
+                        type=int,
+                        default=DEFAULT_BATCH_SIZE,
+                        help='With --coordinate, the number of files per batch (default: %s)' % DEFAULT_BATCH_SIZE)
+    parser.add_argument("--lease-duration", metavar="SECONDS",
+                        dest="lease_duration",
+                        type=float,
+                        default=DEFAULT_LEASE_DURATION,
+                        help='With --work, how long batches are leased for, the leases being renewed while downloading (default: %s)' % DEFAULT_LEASE_DURATION)
+    parser.add_argument("--progress",
+                        dest="progress",
+                        action="store_true",
+                        help='Display the progress, throughput and ETA on the standard error')
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        dest="metrics_path",
+                        help='Export the counters and stage timings to PATH while downloading')
+    parser.add_argument("--metrics-format",
+                        dest="metrics_format",
+                        choices=EXPORT_FORMATS,
+                        default='json',
+                        help='How the metrics are exported: appended as JSON lines, or as a Prometheus textfile (default: json)')
+    parser.add_argument("--metrics-interval",
+                        dest="metrics_interval",
+                        type=float,
+                        default=DEFAULT_INTERVAL,
+                        help='How often the progress and metrics are reported, in seconds (default: %s)' % DEFAULT_INTERVAL)
     verbosity_group = parser.add_mutually_exclusive_group()
     verbosity_group.add_argument("-v",
                                  action="count",
@@ -165,14 +835,154 @@ def main():
     logging.basicConfig(level=logging_level)
     logging.info("Starting")
 
-    if args.file_list:
-        download_from_file_list(args.file_list, args.output_path)
-    elif args.category_name:
-        download_from_category(args.category_name, args.output_path, args.width)
-    elif args.files:
-        download_from_files(args.files, args.output_path, args.width)
-    else:
-        parser.print_help()
+    if args.migrate_layout:
+        migrate_output_folder(args.output_path, args.migrate_layout)
+        return
+
+    if args.coordinate_store:
+        if args.file_list:
+            files = get_files_from_textfile(args.file_list,
+                                            default_widths=args.widths)
+        elif args.category_name:
+            files = get_renditions(get_category_files_from_api(args.category_name,
+                                                               depth=args.depth),
+                                   args.widths or [args.width])
+        else:
+            files = get_renditions(args.files, args.widths or [args.width])
+        try:
+            split_job(args.coordinate_store, files, batch_size=args.batch_size)
+        except ValueError, e:
+            parser.error(str(e))
+        return
+
+    if args.submit_socket:
+        if args.file_list is sys.stdin or not (args.files or args.file_list):
+            parser.error("--submit requires files or a list, other than the standard input")
+        if args.file_list:
+            (list_path, widths) = (args.file_list.name, args.widths)
+        else:
+            (list_path, widths) = (None, args.widths or [args.width])
+        summary = submit_job(args.submit_socket, args.output_path,
+                             files=args.files, list_path=list_path,
+                             widths=widths,
+                             priority=args.priority, refresh=args.refresh)
+        if summary.get('error'):
+            sys.exit(1)
+        return
+
+    journal = None
+    if args.category_name or (args.file_list and args.file_list is not sys.stdin):
+        list_path = getattr(args.file_list, 'name', None)
+        description = {'list': list_path and os.path.abspath(list_path),
+                       'category': args.category_name,
+                       'depth': args.depth,
+                       'widths': args.widths or [args.width],
+                       'shard': args.shard}
+        try:
+            from journal import Journal, get_journal_path
+            journal = Journal(get_journal_path(args.output_path, args.shard),
+                              description, resume=args.resume)
+        except ValueError, e:
+            parser.error(str(e))
+        if journal.finished:
+            logging.info("The job is already finished")
+            journal.close()
+            return
+    elif args.resume:
+        parser.error("--resume requires a list, other than the standard input, or a category")
+
+    schedule = args.schedule or bool(args.priorities_list or args.max_in_flight)
+    metrics = Metrics()
+    transport = ConnectionPool(max_per_host=args.connections_per_host,
+                               metrics=metrics)
+    options = {'jobs': args.jobs,
+               'transport': transport,
+               'buffer_size': args.buffer_size,
+               'prefetch': args.prefetch or bool(args.title_cache_path) or schedule,
+               'manifest_backend': args.manifest_backend,
+               'rate': args.rate,
+               'max_attempts': args.max_attempts,
+               'refresh': args.refresh,
+               'width_in_name': args.width_in_name or bool(args.widths),
+               'shard': args.shard,
+               'layout': args.layout,
+               'metrics': metrics}
+    if schedule:
+        priorities = None
+        if args.priorities_list:
+            try:
+                priorities = read_priorities(args.priorities_list)
+            except ValueError, e:
+                parser.error(str(e))
+        options['scheduler'] = Scheduler(max_bytes=args.max_in_flight,
+                                         large_size=args.large_size,
+                                         priorities=priorities)
+    if args.store_path:
+        from objectstore import ObjectStore
+        options['store'] = ObjectStore(args.store_path)
+    if args.render_processes is not None:
+        from localthumbnail import LocalThumbnailer
+        options['thumbnailer'] = LocalThumbnailer(args.render_processes or None)
+    if args.title_cache_path:
+        ttl = args.title_cache_ttl * DAY
+        options['title_cache'] = TitleCache(args.title_cache_path, ttl=ttl,
+                                            negative_ttl=min(ttl, DEFAULT_NEGATIVE_TTL),
+                                            max_entries=args.title_cache_size)
+    if args.write_threads or args.fsync != DEFAULT_FSYNC:
+        options['writer'] = DiskWriter(threads=args.write_threads or 1,
+                                       fsync=args.fsync)
+    reporter = None
+    if args.progress or args.metrics_path:
+        total = None
+        if args.file_list:
+            total = count_files_in_textfile(args.file_list,
+                                            default_widths=args.widths)
+        elif args.files:
+            total = len(args.files) * len(args.widths or [args.width])
+        if args.shard or (journal and journal.cursor):
+            total = None
+        reporter = MetricsReporter(metrics, interval=args.metrics_interval,
+                                   total=total,
+                                   stream=sys.stderr if args.progress else None,
+                                   path=args.metrics_path,
+                                   export_format=args.metrics_format)
+        reporter.start()
+    try:
+        if args.serve_socket or args.spool_path:
+            serve_options = dict((name, value) for (name, value) in options.items()
+                                 if name not in ('refresh', 'shard'))
+            serve_jobs(args.serve_socket, args.spool_path,
+                       concurrent_jobs=args.concurrent_jobs, width=args.width,
+                       **serve_options)
+        elif args.work_store:
+            download_leased_files(args.work_store, args.output_path,
+                                  lease_duration=args.lease_duration, **options)
+        elif args.file_list:
+            download_from_file_list(args.file_list, args.output_path,
+                                    widths=args.widths, journal=journal,
+                                    **options)
+        elif args.category_name:
+            download_from_category(args.category_name, args.output_path, args.width,
+                                   depth=args.depth, widths=args.widths,
+                                   journal=journal, **options)
+        elif args.files:
+            download_from_files(args.files, args.output_path, args.width,
+                                widths=args.widths, **options)
+        else:
+            parser.print_help()
+    finally:
+        if 'writer' in options:
+            options['writer'].close()
+        if 'title_cache' in options:
+            options['title_cache'].close()
+        if 'thumbnailer' in options:
+            options['thumbnailer'].close()
+        if 'store' in options:
+            options['store'].close()
+        if journal:
+            journal.close()
+        if reporter:
+            reporter.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,278 @@
+# -=- encoding: latin-1 -=-
+
+"""Share a job across machines, as batches of files leased to workers."""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from imageinfo import iterate_batches
+from thumbnaildownload import NamedWidth
+
+
+DEFAULT_BATCH_SIZE = 100
+
+DEFAULT_LEASE_DURATION = 300.0
+
+POLL_INTERVAL = 5.0
+
+PENDING = 'pending'
+
+LEASED = 'leased'
+
+DONE = 'done'
+
+
+def get_owner():
+    """Return the name of this worker, unique across machines."""
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def _encode_files(files):
+    """Return the file names and widths of a batch as JSON.
+
+    A NamedWidth is stored with a third, true, item.
+    """
+    return json.dumps([[file_name, width] +
+                       ([True] if isinstance(width, NamedWidth) else [])
+                       for (file_name, width) in files])
+
+
+def _decode_files(data):
+    """Return the file names and widths of a batch, stored as JSON."""
+    return [(item[0].encode('utf-8'),
+             NamedWidth(item[1]) if item[2:] else item[1])
+            for item in json.loads(data)]
+
+
+class LeaseStore(object):
+
+    """The batches of a job and their leases, stored in SQLite.
+
+    The store is a file shared by the coordinator and the workers, such as
+    on a network filesystem. A batch is pending until a worker leases it
+    for some time, which the worker renews while downloading it, and then
+    done. Leases which were not renewed in time, such as those of a worker
+    which died, expire and are leased again to another worker. Leases are
+    taken in an exclusive transaction, so that a batch is only leased to
+    one worker at a time.
+    """
+
+    def __init__(self, path, timeout=60):
+        """Open the store at the given path, creating it if needed."""
+        self.path = path
+        self._lock = threading.Lock()
+        # Rollback journal rather than WAL, which needs shared memory and
+        # does not work on network filesystems.
+        self._connection = sqlite3.connect(path, timeout=timeout,
+                                           isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.text_factory = str
+        self._execute('CREATE TABLE IF NOT EXISTS batches ('
+                      'id INTEGER PRIMARY KEY, '
+                      'files TEXT NOT NULL, '
+                      'state TEXT NOT NULL, '
+                      'owner TEXT, '
+                      'expires REAL, '
+                      'leases INTEGER NOT NULL DEFAULT 0)')
+        self._execute('CREATE INDEX IF NOT EXISTS batches_state '
+                      'ON batches (state, expires)')
+        self._execute('CREATE TABLE IF NOT EXISTS job '
+                      '(key TEXT PRIMARY KEY, value TEXT)')
+
+    def _execute(self, query, parameters=()):
+        """Run a statement in a transaction of its own, returning its rowcount."""
+        with self._lock:
+            return self._connection.execute(query, parameters).rowcount
+
+    def _query(self, query, parameters=()):
+        """Run a query, and return its rows."""
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    def add_batches(self, files_iterator, batch_size=DEFAULT_BATCH_SIZE):
+        """Split the file names and widths into batches, and store them.
+
+        Batches are stored as they are split, so that workers can start
+        on them while the input is still read. The input is marked as
+        complete once split whole. Return the number of batches added.
+        """
+        count = 0
+        for batch in iterate_batches(files_iterator, batch_size):
+            self._execute('INSERT INTO batches (files, state) VALUES (?, ?)',
+                          (_encode_files(batch), PENDING))
+            count += 1
+        self._execute('INSERT OR REPLACE INTO job (key, value) VALUES (?, ?)',
+                      ('complete', '1'))
+        logging.info('Split the job into %s batches', count)
+        return count
+
+    def _is_complete(self):
+        """Whether the input of the job was split whole."""
+        return bool(self._query('SELECT value FROM job WHERE key = ?',
+                                ('complete',)))
+
+    def is_empty(self):
+        """Whether the store holds no job yet."""
+        return not self._query('SELECT id FROM batches LIMIT 1') \
+            and not self._is_complete()
+
+    def lease(self, owner, duration=DEFAULT_LEASE_DURATION):
+        """Lease the next pending or expired batch to the owner.
+
+        Return the id and the file names and widths of the batch, or None
+        if no batch is available.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._connection.execute(
+                    'SELECT id, files, state FROM batches '
+                    'WHERE state = ? OR (state = ? AND expires < ?) '
+                    'ORDER BY id LIMIT 1', (PENDING, LEASED, now)).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        'UPDATE batches SET state = ?, owner = ?, expires = ?, '
+                        'leases = leases + 1 WHERE id = ?',
+                        (LEASED, owner, now + duration, row[0]))
+                self._connection.execute('COMMIT')
+            except Exception:
+                self._connection.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        (batch_id, files, state) = row
+        if state == LEASED:
+            logging.warning('Taking over the expired lease of batch %s', batch_id)
+        return (batch_id, _decode_files(files))
+
+    def renew(self, batch_id, owner, duration=DEFAULT_LEASE_DURATION):
+        """Extend the lease of the batch, returning False if it was lost."""
+        return self._execute(
+            'UPDATE batches SET expires = ? '
+            'WHERE id = ? AND owner = ? AND state = ?',
+            (time.time() + duration, batch_id, owner, LEASED)) == 1
+
+    def complete(self, batch_id, owner):
+        """Mark the leased batch as done, returning False if it was lost."""
+        return self._execute(
+            'UPDATE batches SET state = ?, expires = NULL '
+            'WHERE id = ? AND owner = ? AND state = ?',
+            (DONE, batch_id, owner, LEASED)) == 1
+
+    def release(self, batch_id, owner):
+        """Give the leased batch back, for another worker to lease it."""
+        self._execute(
+            'UPDATE batches SET state = ?, owner = NULL, expires = NULL '
+            'WHERE id = ? AND owner = ? AND state = ?',
+            (PENDING, batch_id, owner, LEASED))
+
+    def get_progress(self):
+        """Return the number of batches in each state."""
+        progress = dict((state, 0) for state in (PENDING, LEASED, DONE))
+        progress.update(self._query(
+            'SELECT state, COUNT(*) FROM batches GROUP BY state'))
+        return progress
+
+    def is_finished(self):
+        """Whether the input was split whole, and all its batches are done."""
+        return self._is_complete() and \
+            not self._query('SELECT id FROM batches WHERE state != ? LIMIT 1',
+                            (DONE,))
+
+    def close(self):
+        """Close the store."""
+        with self._lock:
+            self._connection.close()
+
+
+class LeaseRenewer(object):
+
+    """Renew a lease from a background thread, while its batch is downloaded.
+
+    The lease is renewed every third of its duration. Once it is lost,
+    the files of the batch yielded by `guard` stop, so that files which
+    another worker leased meanwhile are not downloaded twice.
+    """
+
+    def __init__(self, store, batch_id, owner, duration=DEFAULT_LEASE_DURATION):
+        """Initialise the renewer."""
+        self.store = store
+        self.batch_id = batch_id
+        self.owner = owner
+        self.duration = duration
+        self.lost = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start renewing the lease."""
+        def run():
+            while not self._stopped.wait(self.duration / 3):
+                try:
+                    renewed = self.store.renew(self.batch_id, self.owner,
+                                               self.duration)
+                except sqlite3.Error, e:
+                    logging.warning('Could not renew the lease of batch %s: %s',
+                                    self.batch_id, e)
+                    continue
+                if not renewed:
+                    logging.warning('Lost the lease of batch %s', self.batch_id)
+                    self.lost.set()
+                    return
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def guard(self, files):
+        """Yield the files, until the lease is lost."""
+        for item in files:
+            if self.lost.is_set():
+                return
+            yield item
+
+    def stop(self):
+        """Stop renewing the lease."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def work(store, download_batch, owner=None, duration=DEFAULT_LEASE_DURATION,
+         poll_interval=POLL_INTERVAL):
+    """Lease batches of the store and download them, until the job is finished.
+
+    download_batch(files) downloads an iterator of file names and widths.
+    While no batch is available, the store is polled every poll_interval
+    seconds, until the batches leased by other workers are done, or
+    expire and are leased to this one. A batch whose download raised is
+    given back to the store. Return the number of batches done.
+    """
+    owner = owner or get_owner()
+    done = 0
+    while True:
+        lease = store.lease(owner, duration)
+        if lease is None:
+            if store.is_finished():
+                break
+            time.sleep(poll_interval)
+            continue
+        (batch_id, files) = lease
+        logging.info('Leased batch %s of %s files', batch_id, len(files))
+        renewer = LeaseRenewer(store, batch_id, owner, duration)
+        renewer.start()
+        try:
+            download_batch(renewer.guard(files))
+        except (Exception, KeyboardInterrupt):
+            renewer.stop()
+            store.release(batch_id, owner)
+            raise
+        renewer.stop()
+        if not renewer.lost.is_set() and store.complete(batch_id, owner):
+            done += 1
+    logging.info('Done %s batches, the job is finished', done)
+    return done
@@ -0,0 +1,236 @@
+# -=- encoding: latin-1 -=-
+
+"""Write downloaded files to disk on threads of their own."""
+
+import os
+import Queue
+import logging
+import threading
+from partialfile import replace_file
+
+
+NEVER = 'never'
+
+PER_FILE = 'file'
+
+BATCHED = 'batch'
+
+FSYNC_POLICIES = (NEVER, PER_FILE, BATCHED)
+
+DEFAULT_FSYNC = NEVER
+
+DEFAULT_QUEUE_SIZE = 256
+
+DEFAULT_FSYNC_BATCH = 100
+
+DEFAULT_WRITE_SIZE = 1024 * 1024
+
+
+def fsync_path(path):
+    """Flush the file at the given path to disk."""
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DirectFile(object):
+
+    """A file written on the calling thread, with the interface of WriterFile."""
+
+    def __init__(self, path, append=False):
+        """Open the file, truncating it unless appending."""
+        self.path = path
+        self._file = open(path, 'ab' if append else 'wb')
+
+    def write(self, data):
+        """Write the data to the file."""
+        self._file.write(data)
+
+    def call(self, function, *args):
+        """Flush the data written so far, then call function."""
+        self._file.flush()
+        function(*args)
+
+    def close(self, rename_to=None):
+        """Close the file, and rename it if asked."""
+        self._file.close()
+        if rename_to:
+            replace_file(self.path, rename_to)
+
+    def abort(self):
+        """Close the file, leaving it as it is."""
+        self._file.close()
+
+
+class WriterFile(object):
+
+    """A file whose writes are queued to a thread of the DiskWriter.
+
+    Writes return as soon as they are queued, and block while the queue
+    is full. An error raised on the writer thread is raised again by the
+    next call, so that the download is stopped early.
+    """
+
+    def __init__(self, writer, queue, path, append=False):
+        """Queue the opening of the file."""
+        self.writer = writer
+        self.path = path
+        self.error = None
+        self._file = None
+        self._queue = queue
+        self._put(self._open, append)
+
+    def _put(self, function, *args):
+        """Queue a call to function on the writer thread."""
+        if self.error is not None:
+            raise self.error
+        self._queue.put((self, function, args))
+
+    def _wait(self, function, *args):
+        """Queue a call to function, and wait until it is done."""
+        done = threading.Event()
+        self._put(function, *args + (done,))
+        done.wait()
+        if self.error is not None:
+            raise self.error
+
+    def _open(self, append):
+        """Open the file, on the writer thread."""
+        self._file = open(self.path, 'ab' if append else 'wb',
+                          self.writer.write_size)
+
+    def _close(self, rename_to, done):
+        """Close and rename the file, on the writer thread."""
+        try:
+            if self._file is not None:
+                self._file.flush()
+                if rename_to and self.writer.fsync == PER_FILE:
+                    os.fsync(self._file.fileno())
+                self._file.close()
+            if rename_to and self.error is None:
+                replace_file(self.path, rename_to)
+                if self.writer.fsync == BATCHED:
+                    self.writer.add_to_batch(rename_to)
+        finally:
+            done.set()
+
+    def _call(self, function, args):
+        """Flush the file and call function, on the writer thread."""
+        self._file.flush()
+        function(*args)
+
+    def write(self, data):
+        """Queue the writing of the data."""
+        self._put(self._file_write, data)
+
+    def _file_write(self, data):
+        """Write the data, on the writer thread."""
+        self._file.write(data)
+
+    def call(self, function, *args):
+        """Queue a call to function, once the data queued so far is written."""
+        self._put(self._call, function, args)
+
+    def close(self, rename_to=None):
+        """Wait until the file is written and closed, and renamed if asked.
+
+        With the per-file fsync policy, the file is flushed to disk before
+        being renamed.
+        """
+        self._wait(self._close, rename_to)
+
+    def abort(self):
+        """Wait until the file is closed, leaving it as it is."""
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class DiskWriter(object):
+
+    """Threads writing files to disk, fed by bounded queues.
+
+    Each file is written by one of the threads, in the order of its
+    writes. Downloads are only slowed down when queue_size chunks are
+    waiting to be written, so that the network and the disk overlap.
+    Files are written with a buffer of write_size bytes, so that the disk
+    receives large writes. They are flushed to disk according to the fsync
+    policy: never, before each file is renamed, or in batches of
+    fsync_batch files renamed.
+    """
+
+    def __init__(self, threads=1, queue_size=DEFAULT_QUEUE_SIZE,
+                 fsync=DEFAULT_FSYNC, fsync_batch=DEFAULT_FSYNC_BATCH,
+                 write_size=DEFAULT_WRITE_SIZE):
+        """Start the writer threads."""
+        self.fsync = fsync
+        self.fsync_batch = fsync_batch
+        self.write_size = write_size
+        self._lock = threading.Lock()
+        self._batch = []
+        self._count = 0
+        self._queues = [Queue.Queue(maxsize=queue_size) for _ in range(threads)]
+        self._threads = []
+        for queue in self._queues:
+            thread = threading.Thread(target=self._run, args=(queue,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def open(self, path, append=False):
+        """Return a WriterFile writing to the given path."""
+        with self._lock:
+            queue = self._queues[self._count % len(self._queues)]
+            self._count += 1
+        return WriterFile(self, queue, path, append)
+
+    def _run(self, queue):
+        """Run the queued calls until stopped."""
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            (writer_file, function, args) = item
+            if writer_file.error is None or function == writer_file._close:
+                try:
+                    function(*args)
+                except Exception, e:
+                    logging.error("Could not write %s: %s", writer_file.path, e)
+                    if writer_file.error is None:
+                        writer_file.error = e
+
+    def add_to_batch(self, path):
+        """Add a renamed file to the batch to flush to disk."""
+        with self._lock:
+            self._batch.append(path)
+            full = len(self._batch) >= self.fsync_batch
+        if full:
+            self.sync_batch()
+
+    def sync_batch(self):
+        """Flush the files of the current batch to disk."""
+        with self._lock:
+            (batch, self._batch) = (self._batch, [])
+        for path in batch:
+            try:
+                fsync_path(path)
+            except OSError, e:
+                logging.warning("Could not flush %s to disk: %s", path, e)
+
+    def close(self):
+        """Wait until everything queued is written, and stop the threads."""
+        for queue in self._queues:
+            queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.sync_batch()
+
+
+def open_output_file(path, append=False, writer=None):
+    """Return the file to write a download to, through the writer if given."""
+    if writer is None:
+        return DirectFile(path, append)
+    return writer.open(path, append)
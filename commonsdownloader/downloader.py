@@ -0,0 +1,165 @@
+# -=- encoding: latin-1 -=-
+
+"""A download session, for use of the package as a library."""
+
+import os
+import sys
+import Queue
+import threading
+from collections import namedtuple
+from commonsdownloader import (download_files_if_not_in_manifest,
+                               DEFAULT_MAX_ATTEMPTS)
+from thumbnaildownload import DEFAULT_WIDTH, DEFAULT_BUFFER_SIZE
+from httpclient import ConnectionPool, DEFAULT_MAX_PER_HOST
+from manifest import open_manifest, DEFAULT_BACKEND
+from workerpool import DEFAULT_JOBS
+from layout import DEFAULT_LAYOUT
+from metrics import Metrics
+
+
+DownloadResult = namedtuple('DownloadResult', ['file_name', 'width', 'status',
+                                               'downloaded', 'error'])
+
+
+class Downloader(object):
+
+    """A session downloading files from Commons, reusable across calls.
+
+    The transport, the title cache, the disk writer, the manifests of the
+    output folders and the other settings are kept for the life of the
+    session, so that connections and caches are shared by its successive
+    downloads, which may run at the same time. Any object with
+    the interface of httpclient.Transport can be given as transport,
+    otherwise the session opens a ConnectionPool of its own. The
+    resources created by the session are released once it is closed,
+    while those given to it are left to the caller.
+    """
+
+    def __init__(self, transport=None, jobs=DEFAULT_JOBS, rate=None,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 manifest_backend=DEFAULT_BACKEND, prefetch=False, store=None,
+                 title_cache=None, writer=None, thumbnailer=None, metrics=None,
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 max_per_host=DEFAULT_MAX_PER_HOST, layout=DEFAULT_LAYOUT,
+                 width_in_name=False, scheduler=None, width=DEFAULT_WIDTH):
+        """Initialise the session."""
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._owns_transport = transport is None
+        if transport is None:
+            transport = ConnectionPool(max_per_host=max_per_host,
+                                       metrics=self.metrics)
+        self.transport = transport
+        self.width = width
+        self._manifests = {}
+        self._lock = threading.Lock()
+        self.options = {'jobs': jobs,
+                        'rate': rate,
+                        'max_attempts': max_attempts,
+                        'manifest_backend': manifest_backend,
+                        'prefetch': prefetch or title_cache is not None,
+                        'store': store,
+                        'title_cache': title_cache,
+                        'writer': writer,
+                        'thumbnailer': thumbnailer,
+                        'buffer_size': buffer_size,
+                        'layout': layout,
+                        'width_in_name': width_in_name,
+                        'scheduler': scheduler}
+
+    def _make_files_iterator(self, files):
+        """Yield (file name, width) of names, or of (name, width) tuples."""
+        for item in files:
+            if isinstance(item, basestring):
+                yield (item, self.width)
+            else:
+                yield tuple(item)
+
+    def get_manifest(self, output_path):
+        """Return the manifest of the output folder, opening it once."""
+        output_path = os.path.abspath(output_path)
+        with self._lock:
+            if output_path not in self._manifests:
+                self._manifests[output_path] = open_manifest(
+                    output_path, backend=self.options['manifest_backend'])
+            return self._manifests[output_path]
+
+    def download_many(self, files, output_path, refresh=False, shard=None,
+                      prescan=True, width_in_name=False):
+        """Download the files to the given path, yielding a DownloadResult each.
+
+        The files are names, downloaded at the width of the session, or
+        (name, width) tuples, a width of None being the full size. They
+        are downloaded on worker threads while the results are consumed,
+        in the order they are done, files in manifest included, as skipped.
+        Without `prescan`, all files are looked up in manifest one by one,
+        rather than those past the first PRESCAN_THRESHOLD after a scan of
+        the output folder.
+        With `width_in_name`, the file names are prefixed with the width,
+        as for the whole session with its own `width_in_name`.
+        An error stopping the downloads is raised once the results so far
+        are yielded. The downloads go on if the results are not consumed.
+        """
+        results = Queue.Queue()
+        done = object()
+        errors = []
+        options = self._get_options()
+        if width_in_name:
+            options['width_in_name'] = True
+
+        def on_result(file_name, width, status, downloaded, error):
+            results.put(DownloadResult(file_name, width, status, downloaded,
+                                       error))
+
+        def run():
+            try:
+                download_files_if_not_in_manifest(
+                    self._make_files_iterator(files), output_path,
+                    refresh=refresh, shard=shard, metrics=self.metrics,
+                    transport=self.transport, on_result=on_result,
+                    manifest=self.get_manifest(output_path),
+                    prescan=prescan, **options)
+            except Exception:
+                errors.append(sys.exc_info())
+            finally:
+                results.put(done)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        while True:
+            result = results.get()
+            if result is done:
+                break
+            yield result
+        thread.join()
+        if errors:
+            (error_type, error, traceback) = errors[0]
+            raise error_type, error, traceback
+
+    def download(self, file, output_path, refresh=False):
+        """Download a name, or a (name, width) tuple, and return its DownloadResult."""
+        results = list(self.download_many([file], output_path, refresh=refresh,
+                                          prescan=False))
+        return results[0] if results else None
+
+    def _get_options(self):
+        """Return the options given to the session, leaving out the unset."""
+        return dict((name, value) for (name, value) in self.options.items()
+                    if value is not None)
+
+    def close(self):
+        """Close the manifests, and release the resources created by the session."""
+        with self._lock:
+            (manifests, self._manifests) = (self._manifests, {})
+        for manifest in manifests.values():
+            manifest.close()
+        if self._owns_transport:
+            self.transport.close()
+
+    def __enter__(self):
+        """Return the session, to be closed on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the session."""
+        self.close()
@@ -0,0 +1,78 @@
+# -=- encoding: latin-1 -=-
+
+"""Open file lists as streams, and split them into shards."""
+
+import io
+import sys
+import hashlib
+from thumbnaildownload import clean_up_filename
+
+
+STDIN = '-'
+
+
+def open_file_list(path):
+    """Return a file object reading the file list at the given path.
+
+    The list is read from the standard input for '-', and decompressed
+    on the fly for .gz, .bz2 and .xz files, so that it is never loaded
+    whole in memory. The decompression modules are only imported for the
+    lists which need them.
+    """
+    if path == STDIN:
+        return sys.stdin
+    if path.endswith('.gz'):
+        import gzip
+        return io.BufferedReader(gzip.open(path, 'rb'))
+    if path.endswith('.bz2'):
+        import bz2
+        return bz2.BZ2File(path, 'r')
+    if path.endswith('.xz'):
+        return _import_lzma().open(path, 'rb')
+    return open(path, 'r')
+
+
+def _import_lzma():
+    """Return the lzma module, raising IOError if it is not installed."""
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise IOError('Reading .xz files requires the lzma module '
+                          '(backports.lzma on Python 2)')
+    return lzma
+
+
+def parse_shard(value):
+    """Return the (index, count) of a `K/N` shard, K counting from 1."""
+    try:
+        (index, count) = [int(number) for number in value.split('/')]
+    except ValueError:
+        raise ValueError('Invalid shard %s, expected K/N' % value)
+    if not 1 <= index <= count:
+        raise ValueError('Invalid shard %s, K must be between 1 and N' % value)
+    return (index, count)
+
+
+def get_shard(file_name, count):
+    """Return the shard of the given file name, from 1 to count.
+
+    The shard only depends on the cleaned-up file name, so that every
+    node computes the same split, and all the widths of a file fall in
+    the same shard.
+    """
+    file_name = clean_up_filename(file_name)
+    if isinstance(file_name, unicode):
+        file_name = file_name.encode('utf-8')
+    digest = hashlib.md5(file_name).hexdigest()
+    return int(digest[:8], 16) % count + 1
+
+
+def filter_shard(files_iterator, shard):
+    """Yield the file names and widths belonging to the given shard."""
+    (index, count) = shard
+    for (file_name, width) in files_iterator:
+        if get_shard(file_name, count) == index:
+            yield (file_name, width)
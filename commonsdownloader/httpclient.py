@@ -0,0 +1,224 @@
+# -=- encoding: latin-1 -=-
+
+"""HTTP client reusing keep-alive connections across requests."""
+
+import socket
+import httplib
+import urllib2
+import urlparse
+import threading
+from StringIO import StringIO
+from metrics import NULL_METRICS
+
+
+DEFAULT_MAX_PER_HOST = 8
+
+DEFAULT_TIMEOUT = 60
+
+MAX_REDIRECTIONS = 5
+
+REDIRECTION_CODES = (301, 302, 303, 307, 308)
+
+
+class Transport(object):
+
+    """The interface of the transports the files are fetched through.
+
+    `urlopen` returns the response to a GET on the URL, following
+    redirections, and raises error statuses as urllib2.HTTPError and
+    network errors as urllib2.URLError. The response has a `status`, its
+    `headers` (with `getheader`), `read(amt)` and `close()`, and `geturl()`
+    for downloads to be resumable. Any object with the same methods, such
+    as a local fake, can be used as a transport.
+    """
+
+    def urlopen(self, url, headers=None):
+        """Return the response to a GET on the given URL."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the resources held by the transport."""
+        pass
+
+
+class ConnectionPool(Transport):
+
+    """A thread-safe pool of keep-alive HTTP connections.
+
+    Connections are kept per (scheme, host) and given back to the pool
+    once their response has been fully read. At most `max_per_host`
+    requests are in flight to a given host at the same time. The time
+    spent opening new connections is recorded in the given Metrics.
+    """
+
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST,
+                 timeout=DEFAULT_TIMEOUT, metrics=NULL_METRICS):
+        """Initialise the pool."""
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._idle_connections = {}
+        self._slots = {}
+
+    def urlopen(self, url, headers=None):
+        """Return the response to a GET on the given URL.
+
+        Redirections are followed; error statuses are raised as
+        urllib2.HTTPError, and network errors as urllib2.URLError.
+        """
+        headers = headers or {}
+        for _ in range(MAX_REDIRECTIONS + 1):
+            response = self._request(url, headers)
+            if response.status in REDIRECTION_CODES:
+                location = response.getheader('location')
+                response.read()
+                response.close()
+                url = urlparse.urljoin(url, location)
+            elif response.status >= 400:
+                body = response.read()
+                response.close()
+                raise urllib2.HTTPError(url, response.status, response.reason,
+                                        response.headers, StringIO(body))
+            else:
+                return response
+        raise urllib2.HTTPError(url, response.status, 'Too many redirections',
+                                response.headers, StringIO(''))
+
+    def close(self):
+        """Close all the idle connections of the pool."""
+        with self._lock:
+            idle_connections = self._idle_connections
+            self._idle_connections = {}
+        for connections in idle_connections.values():
+            for connection in connections:
+                connection.close()
+
+    def _request(self, url, headers):
+        """Send a GET request on a pooled connection and return the response."""
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        slots = self._get_slots(key)
+        slots.acquire()
+        try:
+            connection, reused = self._get_connection(key)
+            try:
+                response = self._send(connection, path, headers)
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                # The server may have closed an idle connection; retry once.
+                connection = self._new_connection(key)
+                response = self._send(connection, path, headers)
+        except (httplib.HTTPException, socket.error), e:
+            slots.release()
+            raise urllib2.URLError(e)
+        except Exception:
+            slots.release()
+            raise
+        return PooledResponse(self, key, connection, response, url)
+
+    def _send(self, connection, path, headers):
+        """Send the request on the given connection."""
+        connection.request('GET', path, headers=headers)
+        return connection.getresponse()
+
+    def _get_slots(self, key):
+        """Return the semaphore capping the requests to the given host."""
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[key]
+
+    def _get_connection(self, key):
+        """Return an idle connection if any, and whether it is reused."""
+        with self._lock:
+            idle_connections = self._idle_connections.get(key)
+            if idle_connections:
+                return idle_connections.pop(), True
+        return self._new_connection(key), False
+
+    def _new_connection(self, key):
+        """Return a new connection to the given host, once connected."""
+        (scheme, host) = key
+        if scheme == 'https':
+            connection = httplib.HTTPSConnection(host, timeout=self.timeout)
+        else:
+            connection = httplib.HTTPConnection(host, timeout=self.timeout)
+        with self.metrics.timer('connect'):
+            connection.connect()
+        return connection
+
+    def _release(self, key, connection, reusable):
+        """Give the connection back to the pool, or close it."""
+        if reusable:
+            with self._lock:
+                self._idle_connections.setdefault(key, []).append(connection)
+        else:
+            connection.close()
+        self._get_slots(key).release()
+
+
+class PooledResponse(object):
+
+    """A response whose connection goes back to its pool once read."""
+
+    def __init__(self, pool, key, connection, response, url):
+        """Initialise the response."""
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+        self.url = url
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._released = False
+
+    def geturl(self):
+        """Return the final URL of the response, after redirections."""
+        return self.url
+
+    def getheader(self, name, default=None):
+        """Return the value of the given header."""
+        return self._response.getheader(name, default)
+
+    def read(self, amt=None):
+        """Read the body of the response, or up to amt bytes of it."""
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    def close(self):
+        """Close the response, giving back the connection if possible."""
+        self._release()
+
+    def _release(self):
+        """Release the connection, keeping it alive if fully read."""
+        if self._released:
+            return
+        self._released = True
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._pool._release(self._key, self._connection, reusable)
+
+
+_default_pool = None
+
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    """Return the connection pool shared by default."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ConnectionPool()
+        return _default_pool
+
+
+def urlopen(url, headers=None):
+    """Open the given URL using the default connection pool."""
+    return get_default_pool().urlopen(url, headers=headers)
@@ -0,0 +1,237 @@
+# -=- encoding: latin-1 -=-
+
+"""Resolve file metadata in batches through the MediaWiki imageinfo API."""
+
+import re
+import json
+import time
+import urllib
+import urllib2
+import logging
+from collections import namedtuple
+import httpclient
+from thumbnaildownload import (DownloadException, TransientDownloadException,
+                               DEFAULT_HEADERS, clean_up_filename,
+                               get_exception_based_on_url_error)
+from ratelimit import backoff_delay, DEFAULT_MAX_ATTEMPTS
+from metrics import NULL_METRICS
+
+
+API_URL = "https://commons.wikimedia.org/w/api.php"
+
+BATCH_SIZE = 50
+
+IMAGEINFO_PROPERTIES = 'url|mime|thumbmime|size|sha1'
+
+VECTOR_MIME_TYPES = ('image/svg+xml',)
+
+MAXLAG = 5
+
+THUMB_WIDTH_PATTERN = re.compile(r'/([^/]*?)(\d+)px-([^/]+)$')
+
+
+class FileInfo(namedtuple('FileInfo', ['title', 'url', 'mime', 'width',
+                                       'height', 'size', 'sha1',
+                                       'thumb_url', 'thumb_mime'])):
+
+    """Metadata of a file, as returned by the imageinfo API."""
+
+    __slots__ = ()
+
+    def is_bigger_than_source(self, width):
+        """Whether the given width is too big to get a thumbnail of the file."""
+        if self.mime in VECTOR_MIME_TYPES:
+            return False
+        return not self.width or width >= self.width
+
+    def get_thumb_url(self, width):
+        """Return the URL of the thumbnail of the file at the given width.
+
+        Thumbnail URLs embed their width as `<width>px-<name>`, so that the
+        URL of one width is derived from the URL resolved for another.
+        """
+        match = THUMB_WIDTH_PATTERN.search(self.thumb_url)
+        if match is None:
+            return self.thumb_url
+        return '%s/%s%spx-%s' % (self.thumb_url[:match.start()], match.group(1),
+                                 width, match.group(3))
+
+    def get_url_and_mime(self, width):
+        """Return the URL and MIME type to download the file at given width.
+
+        The full size file is used when no width is given, or when the
+        width is bigger than the source.
+        """
+        if width is None or not self.thumb_url or self.is_bigger_than_source(width):
+            return self.url, self.mime
+        return self.get_thumb_url(width), self.thumb_mime or self.mime
+
+
+def make_file_title(file_name):
+    """Return the page title of the given file name."""
+    return 'File:' + clean_up_filename(file_name)
+
+
+def make_imageinfo_url(titles, width=None):
+    """Return the URL to query the imageinfo of the titles, at given width."""
+    params = [('action', 'query'),
+              ('format', 'json'),
+              ('prop', 'imageinfo'),
+              ('iiprop', IMAGEINFO_PROPERTIES),
+              ('redirects', '1'),
+              ('maxlag', str(MAXLAG)),
+              ('titles', '|'.join(titles))]
+    if width is not None:
+        params.append(('iiurlwidth', str(width)))
+    return API_URL + '?' + urllib.urlencode(params)
+
+
+def _encode(value):
+    """Return the given API value as a byte string."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def parse_imageinfo_response(data):
+    """Return the files info and the title mapping of an API response.
+
+    The first dictionary maps page titles to FileInfo, or to None for
+    missing files; the second maps requested titles to page titles.
+    """
+    if 'error' in data:
+        message = _encode(data['error'].get('info', data['error']))
+        if data['error'].get('code') == 'maxlag':
+            raise TransientDownloadException(message, retry_after=MAXLAG)
+        raise DownloadException(message)
+    query = data.get('query', {})
+    title_mapping = {}
+    for key in ('normalized', 'redirects'):
+        for item in query.get(key, []):
+            title_mapping[_encode(item['from'])] = _encode(item['to'])
+    files_info = {}
+    for page in query.get('pages', {}).values():
+        title = _encode(page['title'])
+        if 'missing' in page or 'invalid' in page or not page.get('imageinfo'):
+            files_info[title] = None
+            continue
+        info = page['imageinfo'][0]
+        files_info[title] = FileInfo(title=title,
+                                     url=_encode(info.get('url')),
+                                     mime=_encode(info.get('mime')),
+                                     width=info.get('width'),
+                                     height=info.get('height'),
+                                     size=info.get('size'),
+                                     sha1=_encode(info.get('sha1')),
+                                     thumb_url=_encode(info.get('thumburl')),
+                                     thumb_mime=_encode(info.get('thumbmime')))
+    return files_info, title_mapping
+
+
+def resolve_title(title, title_mapping):
+    """Return the page title the requested title resolves to."""
+    seen = set()
+    while title in title_mapping and title not in seen:
+        seen.add(title)
+        title = title_mapping[title]
+    return title
+
+
+def get_imageinfo_response(url, transport, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Return the parsed API response to the given URL, and its files info.
+
+    Transient errors, such as an overloaded server or a replication lag
+    above maxlag, are retried after an exponential backoff.
+    """
+    attempt = 0
+    while True:
+        try:
+            try:
+                data = json.load(transport.urlopen(url, headers=DEFAULT_HEADERS))
+            except urllib2.URLError, e:
+                raise get_exception_based_on_url_error(e, 'imageinfo')
+            return data, parse_imageinfo_response(data)
+        except TransientDownloadException, e:
+            attempt += 1
+            if attempt >= max_attempts:
+                raise
+            delay = backoff_delay(attempt, retry_after=e.retry_after)
+            logging.warning("Retrying API query in %.1f seconds: %s", delay, e)
+            time.sleep(delay)
+
+
+def query_imageinfo(titles, width=None, transport=None):
+    """Return a dictionary mapping each of the titles to its FileInfo."""
+    transport = transport or httpclient.get_default_pool()
+    url = make_imageinfo_url(titles, width)
+    files_info = {}
+    title_mapping = {}
+    while True:
+        logging.debug("Querying imageinfo of %s titles", len(titles))
+        (data, (batch_info, batch_mapping)) = get_imageinfo_response(url, transport)
+        title_mapping.update(batch_mapping)
+        for (title, info) in batch_info.items():
+            if info is not None or title not in files_info:
+                files_info[title] = info
+        if 'continue' not in data:
+            break
+        url = make_imageinfo_url(titles, width) + '&' + \
+            urllib.urlencode([(key, _encode(value))
+                              for (key, value) in data['continue'].items()])
+    return dict((title, files_info.get(resolve_title(title, title_mapping)))
+                for title in titles)
+
+
+def iterate_batches(files_iterator, batch_size=BATCH_SIZE):
+    """Yield lists of file names and widths, with up to batch_size titles each.
+
+    The several widths of a file count as a single title.
+    """
+    batch = []
+    titles = set()
+    for (file_name, width) in files_iterator:
+        title = make_file_title(file_name)
+        if title not in titles and len(titles) >= batch_size:
+            yield batch
+            batch = []
+            titles = set()
+        titles.add(title)
+        batch.append((file_name, width))
+    if batch:
+        yield batch
+
+
+def resolve_files(files_iterator, batch_size=BATCH_SIZE, transport=None,
+                  metrics=NULL_METRICS, cache=None):
+    """Yield the file names and widths, with their FileInfo.
+
+    Files are resolved lazily, one API request per batch of titles. Each
+    title is resolved once, at the smallest width requested in its batch,
+    whatever the number of widths it is requested at. The FileInfo is
+    None for missing files. With a TitleCache, only the titles which are
+    not in cache are requested, and their FileInfo then cached. The time
+    spent resolving files is recorded in the given Metrics.
+    """
+    for batch in iterate_batches(files_iterator, batch_size):
+        titles = sorted(set(make_file_title(file_name) for (file_name, _) in batch))
+        widths = [width for (_, width) in batch if width is not None]
+        width = min(widths) if widths else None
+        with metrics.timer('resolve'):
+            files_info = {}
+            if cache is not None:
+                files_info = cache.get_many(titles)
+                if width is not None:
+                    # Files cached at full size only have no thumbnail URL.
+                    files_info = dict((title, info)
+                                      for (title, info) in files_info.items()
+                                      if info is None or info.thumb_url or
+                                      info.is_bigger_than_source(width))
+            unknown_titles = [title for title in titles if title not in files_info]
+            if unknown_titles:
+                queried_info = query_imageinfo(unknown_titles, width,
+                                               transport=transport)
+                if cache is not None:
+                    cache.put_many(queried_info)
+                files_info.update(queried_info)
+        for (file_name, width) in batch:
+            yield (file_name, width, files_info.get(make_file_title(file_name)))
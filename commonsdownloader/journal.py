@@ -0,0 +1,263 @@
+# -=- encoding: latin-1 -=-
+
+"""A journal of the progress of a job, from which it can be resumed."""
+
+import os
+import json
+import time
+import heapq
+import sqlite3
+import logging
+import threading
+from filelist import get_shard
+from thumbnaildownload import name_widths
+from manifest import FULL_SIZE
+
+
+JOURNAL_NAME = '.journal.sqlite'
+
+DEFAULT_CHECKPOINT_INTERVAL = 10.0
+
+
+def get_journal_path(output_path, shard=None):
+    """Return the path of the journal of the job downloading to the folder.
+
+    Shards of a job have a journal each, so that they can share a folder.
+    """
+    name = JOURNAL_NAME
+    if shard:
+        name = '.journal.%s-of-%s.sqlite' % shard
+    return os.path.join(output_path, name)
+
+
+def expand_positions(records, default_widths=None, cursor=None):
+    """Yield the file name, width and cursor of each width of the records.
+
+    Records are the (file_name, widths, position) of a source, where the
+    source can be resumed after the record from its position. Files
+    without widths are yielded with each of default_widths, if given, and
+    at full size otherwise. The cursor after a file is the position of the
+    source to resume from, and the number of widths of the next record
+    to skip. The widths given by the cursor are skipped from the first
+    record. The widths of a record with several widths are NamedWidth, so
+    that its renditions are named after their width.
+    """
+    (position, skip) = cursor or (None, 0)
+    for (file_name, widths, record_position) in records:
+        widths = name_widths(widths or default_widths or [None])
+        for (index, width) in enumerate(widths):
+            if index < skip:
+                continue
+            if index + 1 < len(widths):
+                yield (file_name, width, (position, index + 1))
+            else:
+                yield (file_name, width, (record_position, 0))
+        position = record_position
+        skip = 0
+
+
+class Journal(object):
+
+    """The progress of a job, checkpointed to an SQLite file.
+
+    The journal records the description of the job, the cursor of its
+    input up to which every file is done, and the files done beyond it,
+    as downloads complete out of order. It is checkpointed every interval
+    seconds, and when the job stops, once the manifest and the files
+    written are flushed to disk, so that a checkpoint never records a
+    file as done which could be lost. Checkpoints only write the files
+    done since the last one, and drop those the cursor moved past, so
+    that their cost does not grow with the job while a file holds the
+    cursor back, such as one waiting to be retried. A job resumed from
+    its journal reads its input from the cursor, and skips the files
+    done beyond it.
+    """
+
+    def __init__(self, path, description, resume=False,
+                 interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """Open the journal of the job, resuming it or starting afresh.
+
+        Raise ValueError when resuming a journal of another job.
+        """
+        self.path = path
+        self.interval = interval
+        self.cursor = None
+        self.finished = False
+        self._description = json.dumps(description, sort_keys=True)
+        self._lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._resumed = set()
+        self._sequence = 0
+        self._done_sequence = -1
+        self._undone = {}
+        self._undone_heap = []
+        self._cursors = {}
+        self._keys = {}
+        self._new_done = []
+        self._exhausted = False
+        self._sync = None
+        self._last_checkpoint = time.time()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.text_factory = str
+        with self._connection:
+            self._connection.execute('PRAGMA synchronous=FULL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS job (key TEXT PRIMARY KEY, value TEXT)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS done ('
+                'file_name TEXT NOT NULL, '
+                'width INTEGER NOT NULL, '
+                'sequence INTEGER, '
+                'PRIMARY KEY (file_name, width))')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS done_sequence ON done (sequence)')
+        if resume:
+            self._load()
+        else:
+            self._reset()
+
+    def _get(self, key):
+        """Return the value stored in the job table, decoded, or None."""
+        row = self._connection.execute('SELECT value FROM job WHERE key = ?',
+                                       (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _load(self):
+        """Load the cursor and the files done of the job to resume."""
+        description = self._get('description')
+        if description is None:
+            logging.warning('No job to resume in %s, starting afresh', self.path)
+            self._reset()
+            return
+        if description != json.loads(self._description):
+            raise ValueError('The journal %s is of another job' % self.path)
+        self.cursor = self._get('cursor')
+        self.finished = bool(self._get('finished'))
+        # Sequences are those of the previous run: the files are kept until
+        # they are done again in this one.
+        with self._connection:
+            self._connection.execute('UPDATE done SET sequence = NULL')
+        self._resumed = set(
+            (file_name, None if width == FULL_SIZE else width)
+            for (file_name, width) in
+            self._connection.execute('SELECT file_name, width FROM done'))
+        logging.info('Resuming the job from %s, with %s files done beyond it',
+                     self.cursor, len(self._resumed))
+
+    def _reset(self):
+        """Start the journal of a new job."""
+        with self._connection:
+            self._connection.execute('DELETE FROM job')
+            self._connection.execute('DELETE FROM done')
+            self._connection.execute('INSERT INTO job (key, value) VALUES (?, ?)',
+                                     ('description', self._description))
+
+    @property
+    def position(self):
+        """The position of the input to resume from, or None."""
+        return self.cursor[0] if self.cursor else None
+
+    def track(self, positioned_files, shard=None, sync=None):
+        """Yield the file names and widths to download, tracking their cursors.
+
+        The positioned files are the (file_name, width, cursor) of
+        expand_positions. Files done before the job was resumed, and
+        files of other shards, are done right away. `sync`, if given, is
+        called before each checkpoint to flush the files recorded so far.
+        """
+        self._sync = sync
+        for (file_name, width, cursor) in positioned_files:
+            key = (file_name, width)
+            with self._lock:
+                sequence = self._sequence
+                self._sequence += 1
+                self._undone[sequence] = key
+                heapq.heappush(self._undone_heap, sequence)
+                self._cursors[sequence] = cursor
+                self._keys.setdefault(key, []).append(sequence)
+                resumed = key in self._resumed
+                self._resumed.discard(key)
+            if resumed:
+                self.complete(file_name, width)
+            elif shard and get_shard(file_name, shard[1]) != shard[0]:
+                self.complete(file_name, width)
+            else:
+                yield key
+        self._exhausted = True
+
+    def complete(self, file_name, width):
+        """Record that the file is done, checkpointing if it is time to."""
+        with self._lock:
+            sequences = self._keys.get((file_name, width))
+            if not sequences:
+                return
+            sequence = sequences.pop(0)
+            if not sequences:
+                del self._keys[(file_name, width)]
+            del self._undone[sequence]
+            self._new_done.append((file_name, width, sequence))
+            self._forget_cursor(sequence)
+            self._forget_cursor(sequence - 1)
+            while self._undone_heap and self._undone_heap[0] not in self._undone:
+                heapq.heappop(self._undone_heap)
+            first_undone = self._undone_heap[0] if self._undone_heap else self._sequence
+            if first_undone - 1 > self._done_sequence:
+                self._done_sequence = first_undone - 1
+                self.cursor = self._cursors[self._done_sequence]
+            due = time.time() - self._last_checkpoint >= self.interval
+        if due and self._checkpoint_lock.acquire(False):
+            try:
+                self._checkpoint()
+            finally:
+                self._checkpoint_lock.release()
+
+    def _forget_cursor(self, sequence):
+        """Drop the cursor after a file, unless the cursor may move to it.
+
+        The cursor only moves to files done followed by a file not done,
+        or to the last file.
+        """
+        if (sequence in self._cursors and sequence not in self._undone and
+                sequence + 1 < self._sequence and sequence + 1 not in self._undone):
+            del self._cursors[sequence]
+
+    def checkpoint(self):
+        """Flush the files recorded so far, and store the progress of the job."""
+        with self._checkpoint_lock:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        """Store the progress of the job, holding the checkpoint lock."""
+        with self._lock:
+            cursor = self.cursor
+            done_sequence = self._done_sequence
+            new_done = self._new_done
+            self._new_done = []
+            finished = self._exhausted and not self._undone
+            self._last_checkpoint = time.time()
+        try:
+            if self._sync:
+                self._sync()
+            with self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO done (file_name, width, sequence) '
+                    'VALUES (?, ?, ?)',
+                    ((file_name, FULL_SIZE if width is None else width, sequence)
+                     for (file_name, width, sequence) in new_done))
+                self._connection.execute('DELETE FROM done WHERE sequence <= ?',
+                                         (done_sequence,))
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO job (key, value) VALUES (?, ?)',
+                    [('cursor', json.dumps(cursor)),
+                     ('finished', json.dumps(finished))])
+        except Exception:
+            with self._lock:
+                self._new_done[:0] = new_done
+            raise
+        self.finished = finished
+        logging.debug('Checkpointed the job at %s', cursor)
+
+    def close(self):
+        """Close the journal."""
+        with self._checkpoint_lock:
+            self._connection.close()
@@ -0,0 +1,151 @@
+# -=- encoding: latin-1 -=-
+
+"""Layouts of the output folder, flat or hashed like the uploads of Commons."""
+
+import os
+import errno
+import hashlib
+import logging
+from thumbnaildownload import (clean_up_filename, make_thumbnail_name,
+                               make_rendition_name, get_extension,
+                               THUMBNAIL_EXTENSIONS)
+from partialfile import replace_file
+
+
+FLAT = 'flat'
+
+HASHED = 'hashed'
+
+LAYOUTS = (FLAT, HASHED)
+
+DEFAULT_LAYOUT = FLAT
+
+MIGRATION_BATCH_SIZE = 1000
+
+
+def get_hash_path(image_name):
+    """Return the directory of the file in the upload paths of Commons.
+
+    Commons stores File:Example.jpg under a/ab/Example.jpg, where ab are
+    the first two hexadecimal digits of the MD5 of Example.jpg.
+    """
+    digest = hashlib.md5(clean_up_filename(image_name)).hexdigest()
+    return os.path.join(digest[0], digest[:2])
+
+
+def get_relative_directory(image_name, layout=DEFAULT_LAYOUT):
+    """Return the directory of the file, relative to the output folder."""
+    if layout == HASHED:
+        return get_hash_path(image_name)
+    return ''
+
+
+def get_output_directory(output_path, image_name, layout=DEFAULT_LAYOUT):
+    """Return the directory the file is written to, creating it if needed."""
+    relative_directory = get_relative_directory(image_name, layout)
+    if not relative_directory:
+        return output_path
+    directory = os.path.join(output_path, relative_directory)
+    make_directory(directory)
+    return directory
+
+
+def make_directory(directory):
+    """Create the directory and its parents, unless they exist."""
+    try:
+        os.makedirs(directory)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def list_output_files(output_path, layout=DEFAULT_LAYOUT):
+    """Yield the paths of the files of the output folder, relative to it.
+
+    Only the directories of the layout are listed, each of them once.
+    Hidden files, such as the manifest and partial downloads, are left out.
+    """
+    directories = ['']
+    if layout == HASHED:
+        directories = [os.path.join(first, first + second)
+                       for first in '0123456789abcdef'
+                       for second in '0123456789abcdef']
+    for directory in directories:
+        try:
+            names = os.listdir(os.path.join(output_path, directory))
+        except OSError:
+            continue
+        for name in names:
+            if not name.startswith('.'):
+                yield os.path.join(directory, name)
+
+
+def get_candidate_names(file_name, width, width_in_name=False):
+    """Yield the names the file could have been downloaded as.
+
+    Thumbnails of some formats are served in another one, such as PNG for
+    SVG files, so that the name on disk also depends on the format.
+    """
+    image_name = clean_up_filename(file_name)
+    names = [image_name]
+    extension = get_extension(image_name)
+    if width is not None and extension in THUMBNAIL_EXTENSIONS:
+        names.append(make_thumbnail_name(image_name, THUMBNAIL_EXTENSIONS[extension]))
+    for name in names:
+        yield make_rendition_name(name, width) if width_in_name else name
+
+
+def get_candidate_paths(file_name, width, width_in_name=False,
+                        layout=DEFAULT_LAYOUT):
+    """Yield the paths the file could have been downloaded to, relative."""
+    directory = get_relative_directory(file_name, layout)
+    for name in get_candidate_names(file_name, width, width_in_name):
+        yield os.path.join(directory, name)
+
+
+def find_entry_path(output_path, file_name, width):
+    """Return the relative path of a manifest entry recorded without path.
+
+    Such entries were migrated from a text manifest, and are looked for
+    under each of the names and layouts they could have been written as.
+    """
+    for layout in LAYOUTS:
+        for width_in_name in (False, True):
+            for path in get_candidate_paths(file_name, width, width_in_name, layout):
+                if os.path.exists(os.path.join(output_path, path)):
+                    return path
+    return None
+
+
+def migrate_layout(manifest, output_path, layout):
+    """Move the files recorded in manifest to the given layout.
+
+    Files are renamed one by one, and their new path recorded in manifest
+    in batches, so that an interrupted migration can be run again. Files
+    missing from manifest are left where they are, as their Commons name
+    is unknown. Return the number of files moved.
+    """
+    moved = 0
+    updates = []
+    for (file_name, width, path) in manifest:
+        if not path:
+            path = find_entry_path(output_path, file_name, width)
+            if path is None:
+                continue
+        new_path = os.path.join(get_relative_directory(file_name, layout),
+                                os.path.basename(path))
+        if new_path != path:
+            source = os.path.join(output_path, path)
+            if not os.path.exists(source):
+                continue
+            destination = os.path.join(output_path, new_path)
+            make_directory(os.path.dirname(destination))
+            replace_file(source, destination)
+            moved += 1
+        updates.append((file_name, width, new_path))
+        if len(updates) >= MIGRATION_BATCH_SIZE:
+            manifest.update_paths(updates)
+            updates = []
+    manifest.update_paths(updates)
+    logging.info('Moved %s files to the %s layout', moved, layout)
+    return moved
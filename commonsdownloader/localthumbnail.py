@@ -0,0 +1,176 @@
+# -=- encoding: latin-1 -=-
+
+"""Render thumbnails locally from full size files already downloaded."""
+
+import os
+import shutil
+import logging
+import threading
+import multiprocessing
+from thumbnaildownload import (DownloadedFile, DEFAULT_BUFFER_SIZE,
+                               clean_up_filename, make_thumbnail_name,
+                               make_rendition_name, hash_file,
+                               get_extension, THUMBNAIL_EXTENSIONS)
+from partialfile import get_partial_file_path, replace_file, remove_if_exists
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import cairosvg
+except ImportError:
+    cairosvg = None
+
+
+RASTER_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'tif', 'tiff', 'webp', 'bmp')
+
+VECTOR_EXTENSIONS = ('svg',)
+
+PIL_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'gif': 'GIF', 'webp': 'WEBP',
+               'bmp': 'BMP'}
+
+
+def can_render(source_path):
+    """Whether a thumbnail of the given file can be rendered locally.
+
+    Raster images require Pillow, and SVG files cairosvg.
+    """
+    extension = get_extension(source_path)
+    if extension in RASTER_EXTENSIONS:
+        return Image is not None
+    if extension in VECTOR_EXTENSIONS:
+        return cairosvg is not None
+    return False
+
+
+def make_local_thumbnail_name(image_name, source_path, width, width_in_name=False):
+    """Return the name of the thumbnail rendered from the given source.
+
+    Like the thumbnails of Commons, SVG files are rendered as PNG and TIFF
+    files as JPEG; other files keep their format.
+    """
+    extension = get_extension(source_path)
+    extension = THUMBNAIL_EXTENSIONS.get(extension, extension)
+    output_file_name = make_thumbnail_name(clean_up_filename(image_name), extension)
+    if width_in_name:
+        output_file_name = make_rendition_name(output_file_name, width)
+    return output_file_name
+
+
+def render_image(source_path, output_file_path, width):
+    """Resize the raster image to the given width, keeping its aspect ratio.
+
+    Images narrower than the width are copied as they are, as Commons
+    serves the full size file for widths bigger than the source.
+    """
+    image = Image.open(source_path)
+    extension = get_extension(output_file_path)
+    if image.size[0] <= width and extension == get_extension(source_path):
+        shutil.copyfile(source_path, output_file_path)
+        return
+    if image.size[0] > width:
+        height = max(1, int(round(image.size[1] * float(width) / image.size[0])))
+        image = image.resize((width, height), Image.ANTIALIAS)
+    pil_format = PIL_FORMATS.get(extension, 'JPEG')
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(output_file_path, pil_format)
+
+
+def render_vector(source_path, output_file_path, width):
+    """Rasterize the SVG file to a PNG of the given width."""
+    cairosvg.svg2png(url=source_path, write_to=output_file_path,
+                     output_width=width)
+
+
+def render_thumbnail(source_path, output_file_path, width):
+    """Render the thumbnail of the source at the given width.
+
+    The thumbnail is written to a partial file renamed once complete.
+    Return the DownloadedFile, or the error message if it failed, as
+    exceptions are not passed back from the worker processes.
+    """
+    partial_file_path = get_partial_file_path(output_file_path)
+    try:
+        if get_extension(source_path) in VECTOR_EXTENSIONS:
+            render_vector(source_path, partial_file_path, width)
+        else:
+            render_image(source_path, partial_file_path, width)
+        size = os.path.getsize(partial_file_path)
+        sha1 = hash_file(partial_file_path, size, buffer_size=DEFAULT_BUFFER_SIZE)
+        replace_file(partial_file_path, output_file_path)
+        return DownloadedFile(output_file_path, size, sha1.hexdigest())
+    except Exception, e:
+        remove_if_exists(partial_file_path)
+        return 'Could not render %s: %s' % (source_path, e)
+
+
+def _render_thumbnail(arguments):
+    """Call render_thumbnail with a tuple of arguments, in a worker process."""
+    return render_thumbnail(*arguments)
+
+
+class LocalThumbnailer(object):
+
+    """Render thumbnails on a pool of processes, one per core by default.
+
+    Renderings are submitted without waiting for them, up to twice as
+    many as there are processes; the callback is then called with each
+    DownloadedFile from a thread of the pool.
+    """
+
+    def __init__(self, processes=None):
+        """Start the pool of processes."""
+        self.processes = processes or multiprocessing.cpu_count()
+        self._pool = multiprocessing.Pool(self.processes)
+        self._slots = threading.BoundedSemaphore(self.processes * 2)
+        self._condition = threading.Condition()
+        self._pending = 0
+
+    def submit(self, image_name, width, source_path, output_path,
+               callback, width_in_name=False, error_callback=None):
+        """Render the thumbnail of image_name from its full size source_path.
+
+        The callback is called with the DownloadedFile once rendered, and
+        error_callback, if given, with the error message if it failed.
+        """
+        output_file_name = make_local_thumbnail_name(image_name, source_path,
+                                                     width, width_in_name)
+        arguments = (source_path, os.path.join(output_path, output_file_name),
+                     width)
+        self._slots.acquire()
+        with self._condition:
+            self._pending += 1
+
+        def done(result):
+            try:
+                if isinstance(result, DownloadedFile):
+                    logging.info("Rendered %s locally", output_file_name)
+                    callback(result)
+                else:
+                    logging.error(result)
+                    if error_callback:
+                        error_callback(result)
+            except Exception, e:
+                logging.exception("Unexpected error after rendering: %s", e)
+            finally:
+                self._slots.release()
+                with self._condition:
+                    self._pending -= 1
+                    self._condition.notify_all()
+
+        self._pool.apply_async(_render_thumbnail, (arguments,), callback=done)
+
+    def wait(self):
+        """Wait until all the submitted renderings are done."""
+        with self._condition:
+            while self._pending:
+                self._condition.wait(1)
+
+    def close(self):
+        """Wait for the pending renderings, and stop the pool."""
+        self.wait()
+        self._pool.close()
+        self._pool.join()
@@ -0,0 +1,291 @@
+# -=- encoding: latin-1 -=-
+
+"""Manifests recording the files already downloaded in a folder."""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+
+TEXT_MANIFEST_NAME = '.manifest'
+
+SQLITE_MANIFEST_NAME = '.manifest.sqlite'
+
+MIGRATED_SUFFIX = '.migrated'
+
+FULL_SIZE = 0
+
+DEFAULT_BACKEND = 'sqlite'
+
+VALIDATOR_COLUMNS = ('etag', 'last_modified')
+
+ITERATION_BATCH_SIZE = 10000
+
+
+def parse_manifest_line(line):
+    """Return the file name and width of a text manifest line."""
+    line = line.rstrip('\r\n')
+    try:
+        (file_name, width) = line.rsplit(',', 1)
+    except ValueError:
+        return (line, None)
+    if width == 'None':
+        return (file_name, None)
+    try:
+        return (file_name, int(width))
+    except ValueError:
+        return (line, None)
+
+
+class TextManifest(object):
+
+    """The historical manifest, a text file of `file_name,width` lines.
+
+    The whole file is loaded in memory when opened.
+    """
+
+    def __init__(self, output_path):
+        """Load the manifest of the given folder."""
+        self.path = os.path.join(output_path, TEXT_MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._entries = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self._entries.update(parse_manifest_line(line) for line in f)
+            logging.debug('Retrieving %s elements from manifest', len(self._entries))
+        self._fh = open(self.path, 'a')
+
+    def __contains__(self, (file_name, width)):
+        """Whether the given file, in its given width, is in manifest."""
+        return (file_name, width) in self._entries
+
+    def __iter__(self):
+        """Yield the (file_name, width, path) of the entries, without path."""
+        for (file_name, width) in list(self._entries):
+            yield (file_name, width, None)
+
+    def get_validators(self, file_name, width):
+        """Return None, as the text manifest does not record validators."""
+        return None
+
+    def get_path(self, file_name, width):
+        """Return None, as the text manifest does not record paths."""
+        return None
+
+    def add(self, file_name, width, path=None, size=None, checksum=None,
+            etag=None, last_modified=None):
+        """Record the given file in manifest, flushing it right away."""
+        with self._lock:
+            self._fh.write("%s,%s\n" % (file_name, str(width)))
+            self._fh.flush()
+            self._entries.add((file_name, width))
+        logging.debug("Wrote file %s to manifest", file_name)
+
+    def add_many(self, entries):
+        """Record the (file_name, width, path, size) entries at once."""
+        with self._lock:
+            for (file_name, width, _, _) in entries:
+                self._fh.write("%s,%s\n" % (file_name, str(width)))
+                self._entries.add((file_name, width))
+            self._fh.flush()
+
+    def sync(self):
+        """Flush the manifest to disk."""
+        with self._lock:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def close(self):
+        """Close the manifest."""
+        self._fh.close()
+
+
+class SQLiteManifest(object):
+
+    """A manifest stored in an indexed SQLite database.
+
+    Entries are keyed on (file_name, width), and also record the relative
+    path, size, checksum and timestamp of the downloaded file, with the
+    validators (ETag and Last-Modified) of its response. Opening the
+    manifest does not load it: each lookup is a single index query.
+    An existing text manifest is migrated on first use.
+    """
+
+    def __init__(self, output_path):
+        """Open the manifest of the given folder, creating it if needed."""
+        self.output_path = output_path
+        self.path = os.path.join(output_path, SQLITE_MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.text_factory = str
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'file_name TEXT NOT NULL, '
+                'width INTEGER NOT NULL, '
+                'path TEXT, '
+                'size INTEGER, '
+                'checksum TEXT, '
+                'timestamp REAL, '
+                'etag TEXT, '
+                'last_modified TEXT, '
+                'PRIMARY KEY (file_name, width))')
+            self.add_missing_columns()
+        text_manifest_path = os.path.join(output_path, TEXT_MANIFEST_NAME)
+        if os.path.exists(text_manifest_path):
+            self.migrate_text_manifest(text_manifest_path)
+
+    def add_missing_columns(self):
+        """Add the validator columns to a manifest created before them."""
+        columns = set(row[1] for row in
+                      self._connection.execute('PRAGMA table_info(files)'))
+        for column in VALIDATOR_COLUMNS:
+            if column not in columns:
+                self._connection.execute('ALTER TABLE files ADD COLUMN %s TEXT'
+                                         % column)
+
+    def migrate_text_manifest(self, text_manifest_path):
+        """Import the entries of a text manifest, and set it aside."""
+        logging.info('Migrating manifest %s', text_manifest_path)
+        with open(text_manifest_path, 'r') as f:
+            rows = ((file_name, _to_column(width))
+                    for (file_name, width) in (parse_manifest_line(line)
+                                               for line in f))
+            with self._lock, self._connection:
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO files (file_name, width) VALUES (?, ?)',
+                    rows)
+        os.rename(text_manifest_path, text_manifest_path + MIGRATED_SUFFIX)
+
+    def __contains__(self, (file_name, width)):
+        """Whether the given file, in its given width, is in manifest."""
+        return self.get(file_name, width) is not None
+
+    def get(self, file_name, width):
+        """Return the (path, size, checksum, timestamp) of the entry, or None."""
+        with self._lock:
+            cursor = self._connection.execute(
+                'SELECT path, size, checksum, timestamp FROM files '
+                'WHERE file_name = ? AND width = ?',
+                (file_name, _to_column(width)))
+            return cursor.fetchone()
+
+    def __iter__(self):
+        """Yield the (file_name, width, path) of all the entries.
+
+        The entries are read with a single query, on a connection of their
+        own, so that additions meanwhile do not interrupt the iteration.
+        """
+        connection = sqlite3.connect(self.path)
+        connection.text_factory = str
+        try:
+            cursor = connection.execute('SELECT file_name, width, path FROM files')
+            while True:
+                rows = cursor.fetchmany(ITERATION_BATCH_SIZE)
+                if not rows:
+                    break
+                for (file_name, width, path) in rows:
+                    yield (file_name, _from_column(width), path)
+        finally:
+            connection.close()
+
+    def get_path(self, file_name, width):
+        """Return the path of the downloaded file, or None if not on disk."""
+        entry = self.get(file_name, width)
+        if entry is None or not entry[0]:
+            return None
+        path = os.path.join(self.output_path, entry[0])
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def get_validators(self, file_name, width):
+        """Return the (etag, last_modified) of the entry, or None.
+
+        None is also returned when the entry has no validator, or when
+        its file is no longer on disk, as it must then be fetched again.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT path, etag, last_modified FROM files '
+                'WHERE file_name = ? AND width = ?',
+                (file_name, _to_column(width))).fetchone()
+        if row is None:
+            return None
+        (path, etag, last_modified) = row
+        if not (etag or last_modified) or not path or \
+                not os.path.exists(os.path.join(self.output_path, path)):
+            return None
+        return (etag, last_modified)
+
+    def add(self, file_name, width, path=None, size=None, checksum=None,
+            etag=None, last_modified=None):
+        """Record the given file in manifest, committing it right away."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO files '
+                '(file_name, width, path, size, checksum, timestamp, '
+                'etag, last_modified) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (file_name, _to_column(width), path, size, checksum, time.time(),
+                 etag, last_modified))
+        logging.debug("Wrote file %s to manifest", file_name)
+
+    def add_many(self, entries):
+        """Record the (file_name, width, path, size) entries in one transaction."""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO files '
+                '(file_name, width, path, size, timestamp) '
+                'VALUES (?, ?, ?, ?, ?)',
+                ((file_name, _to_column(width), path, size, now)
+                 for (file_name, width, path, size) in entries))
+
+    def update_paths(self, entries):
+        """Record the new (file_name, width, path) of entries in one transaction."""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'UPDATE files SET path = ? WHERE file_name = ? AND width = ?',
+                ((path, file_name, _to_column(width))
+                 for (file_name, width, path) in entries))
+
+    def __len__(self):
+        """Return the number of entries in manifest."""
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def sync(self):
+        """Flush the manifest to disk, checkpointing its write-ahead log."""
+        with self._lock:
+            self._connection.execute('PRAGMA wal_checkpoint(FULL)')
+
+    def close(self):
+        """Close the manifest."""
+        with self._lock:
+            self._connection.close()
+
+
+def _to_column(width):
+    """Return the value stored in the width column for the given width."""
+    return FULL_SIZE if width is None else width
+
+
+def _from_column(value):
+    """Return the width of the given value of the width column."""
+    return None if value == FULL_SIZE else value
+
+
+MANIFEST_BACKENDS = {
+    'text': TextManifest,
+    'sqlite': SQLiteManifest,
+}
+
+
+def open_manifest(output_path, backend=DEFAULT_BACKEND):
+    """Return the manifest of the given folder, using the given backend."""
+    return MANIFEST_BACKENDS[backend](output_path)
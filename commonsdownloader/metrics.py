@@ -0,0 +1,229 @@
+# -=- encoding: latin-1 -=-
+
+"""Count the files processed, time each stage, and report the progress."""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+COUNTERS = ('downloaded', 'linked', 'rendered', 'not_modified', 'skipped',
+            'failed', 'retried', 'bytes')
+
+STAGES = ('resolve', 'connect', 'http', 'transfer', 'write', 'manifest')
+
+DONE_COUNTERS = ('downloaded', 'linked', 'rendered', 'not_modified',
+                 'skipped', 'failed')
+
+DEFAULT_INTERVAL = 5.0
+
+EXPORT_FORMATS = ('json', 'prometheus')
+
+PROMETHEUS_PREFIX = 'commonsdownloader'
+
+
+class Metrics(object):
+
+    """Thread-safe counters, and cumulated timers per stage.
+
+    The stages are the resolution of files through the API, the
+    connection to the server (including the DNS lookup), the HTTP request
+    up to the response headers, the transfer of the body, its writing to
+    disk, and the manifest lookups and updates.
+    """
+
+    def __init__(self):
+        """Initialise the counters and timers at zero."""
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = dict((name, 0) for name in COUNTERS)
+        self._stages = dict((stage, [0, 0.0, 0.0]) for stage in STAGES)
+
+    def increment(self, name, value=1):
+        """Add value to the given counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_time(self, stage, seconds, count=1):
+        """Add the duration of count operations of the given stage."""
+        with self._lock:
+            timer = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            timer[0] += count
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds / max(count, 1))
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the enclosed block as an operation of the given stage."""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.time() - started)
+
+    def snapshot(self):
+        """Return the current counters and timers, as a dictionary."""
+        with self._lock:
+            stages = dict((stage, {'count': count, 'seconds': seconds, 'max': maximum})
+                          for (stage, (count, seconds, maximum)) in self._stages.items())
+            return {'timestamp': time.time(),
+                    'elapsed': time.time() - self.started,
+                    'counters': dict(self._counters),
+                    'stages': stages}
+
+
+class NullMetrics(object):
+
+    """Metrics recording nothing, used when no instrumentation is asked."""
+
+    def increment(self, name, value=1):
+        """Do nothing."""
+        pass
+
+    def add_time(self, stage, seconds, count=1):
+        """Do nothing."""
+        pass
+
+    @contextmanager
+    def timer(self, stage):
+        """Do nothing."""
+        yield
+
+
+NULL_METRICS = NullMetrics()
+
+
+def format_size(size):
+    """Return a human-readable size in bytes."""
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if size < 1000:
+            return '%.1f %s' % (size, unit)
+        size /= 1000.0
+    return '%.1f TB' % size
+
+
+def format_duration(seconds):
+    """Return a duration as H:MM:SS."""
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def format_progress(snapshot, total=None):
+    """Return a line describing the progress, throughput and ETA."""
+    counters = snapshot['counters']
+    elapsed = max(snapshot['elapsed'], 1e-9)
+    done = sum(counters.get(name, 0) for name in DONE_COUNTERS)
+    rate = done / elapsed
+    line = '%s files' % done
+    if total:
+        line = '%s/%s files (%.1f%%)' % (done, total, 100.0 * done / total)
+    line += ', %.1f files/s, %s/s' % (rate, format_size(counters['bytes'] / elapsed))
+    line += ' - %s skipped, %s failed, %s retried' % (
+        counters['skipped'], counters['failed'], counters['retried'])
+    if total and rate and done < total:
+        line += ' - ETA %s' % format_duration((total - done) / rate)
+    return line
+
+
+def format_stages(snapshot):
+    """Return a line with the mean time spent per operation of each stage."""
+    parts = []
+    for stage in STAGES:
+        timer = snapshot['stages'].get(stage)
+        if timer and timer['count']:
+            parts.append('%s %.1f ms' % (stage, 1000 * timer['seconds'] / timer['count']))
+    return ', '.join(parts)
+
+
+def format_prometheus(snapshot):
+    """Return the snapshot in the Prometheus text exposition format."""
+    lines = ['# TYPE %s_files_total counter' % PROMETHEUS_PREFIX]
+    for name in COUNTERS:
+        if name != 'bytes':
+            lines.append('%s_files_total{status="%s"} %s'
+                         % (PROMETHEUS_PREFIX, name, snapshot['counters'].get(name, 0)))
+    lines.append('# TYPE %s_bytes_total counter' % PROMETHEUS_PREFIX)
+    lines.append('%s_bytes_total %s' % (PROMETHEUS_PREFIX, snapshot['counters']['bytes']))
+    for (suffix, key) in (('seconds_total', 'seconds'), ('operations_total', 'count')):
+        lines.append('# TYPE %s_stage_%s counter' % (PROMETHEUS_PREFIX, suffix))
+        for stage in STAGES:
+            value = snapshot['stages'].get(stage, {}).get(key, 0)
+            lines.append('%s_stage_%s{stage="%s"} %s'
+                         % (PROMETHEUS_PREFIX, suffix, stage, value))
+    lines.append('# TYPE %s_elapsed_seconds gauge' % PROMETHEUS_PREFIX)
+    lines.append('%s_elapsed_seconds %s' % (PROMETHEUS_PREFIX, snapshot['elapsed']))
+    return '\n'.join(lines) + '\n'
+
+
+def export_metrics(snapshot, path, export_format):
+    """Export the snapshot to the given file.
+
+    JSON snapshots are appended as lines, while the Prometheus textfile is
+    replaced atomically, as expected by the node exporter.
+    """
+    if export_format == 'json':
+        with open(path, 'a') as f:
+            f.write(json.dumps(snapshot) + '\n')
+    else:
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            f.write(format_prometheus(snapshot))
+        os.rename(temporary_path, path)
+
+
+class MetricsReporter(object):
+
+    """Report the metrics every interval seconds, from a background thread.
+
+    The progress is displayed on the stream, on a single line refreshed in
+    place if it is a terminal, and the metrics are exported to path if
+    given. A last report is made when stopped.
+    """
+
+    def __init__(self, metrics, interval=DEFAULT_INTERVAL, total=None,
+                 stream=None, path=None, export_format='json'):
+        """Initialise the reporter."""
+        self.metrics = metrics
+        self.interval = interval
+        self.total = total
+        self.stream = stream
+        self.path = path
+        self.export_format = export_format
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def report(self, final=False):
+        """Display the progress and export the metrics."""
+        snapshot = self.metrics.snapshot()
+        if self.stream is not None:
+            line = format_progress(snapshot, total=self.total)
+            if final:
+                line += '\n' + format_stages(snapshot) + '\n'
+            elif self.stream.isatty():
+                line = '\r\033[K' + line
+            else:
+                line += '\n'
+            self.stream.write(line)
+            self.stream.flush()
+        if self.path:
+            export_metrics(snapshot, self.path, self.export_format)
+
+    def start(self):
+        """Start reporting in a background thread."""
+        def run():
+            while not self._stopped.wait(self.interval):
+                self.report()
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop reporting, and make a last report."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.stream is not None and self.stream.isatty():
+            self.stream.write('\r\033[K')
+        self.report(final=True)
@@ -0,0 +1,149 @@
+# -=- encoding: latin-1 -=-
+
+"""A content-addressed store of downloaded files, shared across folders."""
+
+import os
+import errno
+import shutil
+import sqlite3
+import logging
+import threading
+from thumbnaildownload import (DownloadedFile, clean_up_filename,
+                               make_thumbnail_name, make_rendition_name)
+from partialfile import get_partial_file_path, replace_file, remove_if_exists
+from manifest import _to_column
+
+
+OBJECTS_DIRECTORY = 'objects'
+
+INDEX_NAME = 'index.sqlite'
+
+
+def link_or_copy(source, destination):
+    """Hardlink source to destination, copying it if links are not possible.
+
+    The destination is replaced atomically if it already exists.
+    """
+    partial_file_path = get_partial_file_path(destination)
+    remove_if_exists(partial_file_path)
+    try:
+        os.link(source, partial_file_path)
+    except (OSError, AttributeError):
+        # Across filesystems, or where hardlinks are not supported.
+        shutil.copyfile(source, partial_file_path)
+    replace_file(partial_file_path, destination)
+
+
+class ObjectStore(object):
+
+    """A store of files keyed by the SHA-1 of their contents.
+
+    Objects are kept under objects/<first two digits>/<SHA-1>, and an
+    SQLite index maps each (file name, width) to the SHA-1 of its contents
+    and to its output file name. Files are hardlinked from the store into
+    the output folders, so that a given contents is stored only once.
+    """
+
+    def __init__(self, root):
+        """Open the store at the given path, creating it if needed."""
+        self.root = root
+        try:
+            os.makedirs(os.path.join(root, OBJECTS_DIRECTORY))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(root, INDEX_NAME),
+                                           timeout=30, check_same_thread=False)
+        self._connection.text_factory = str
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'file_name TEXT NOT NULL, '
+                'width INTEGER NOT NULL, '
+                'sha1 TEXT NOT NULL, '
+                'output_file_name TEXT NOT NULL, '
+                'size INTEGER, '
+                'PRIMARY KEY (file_name, width))')
+
+    def get_object_path(self, sha1):
+        """Return the path of the object with the given SHA-1."""
+        return os.path.join(self.root, OBJECTS_DIRECTORY, sha1[:2], sha1)
+
+    def lookup(self, file_name, width):
+        """Return the (sha1, output_file_name, size) of a stored file, or None."""
+        with self._lock:
+            cursor = self._connection.execute(
+                'SELECT sha1, output_file_name, size FROM files '
+                'WHERE file_name = ? AND width = ?',
+                (clean_up_filename(file_name), _to_column(width)))
+            return cursor.fetchone()
+
+    def link_file(self, file_name, width, output_path, file_info=None,
+                  width_in_name=False):
+        """Link a stored copy of the file into output_path, without fetching it.
+
+        The file is looked up by name and width, or by the SHA-1 of its
+        full size contents given in its prefetched FileInfo. At full size,
+        a file stored with another SHA-1 than that of its FileInfo, such as
+        before a new version was uploaded, is not linked. With
+        width_in_name, the output file name is prefixed with the width.
+        Return the DownloadedFile, or None if the store has no copy of it.
+        """
+        entry = self.lookup(file_name, width)
+        if file_info is not None and file_info.sha1:
+            (url, mime) = file_info.get_url_and_mime(width)
+            if url == file_info.url:
+                if entry is not None and entry[0] != file_info.sha1:
+                    logging.info("%s changed since it was stored", file_name)
+                    entry = None
+                if entry is None:
+                    output_file_name = make_thumbnail_name(
+                        clean_up_filename(file_name), mime.split('/')[-1])
+                    entry = (file_info.sha1, output_file_name, file_info.size)
+        if entry is None:
+            return None
+        (sha1, output_file_name, size) = entry
+        object_path = self.get_object_path(sha1)
+        if not os.path.exists(object_path):
+            return None
+        if width_in_name:
+            output_file_name = make_rendition_name(output_file_name, width)
+        output_file_path = os.path.join(output_path, output_file_name)
+        link_or_copy(object_path, output_file_path)
+        logging.info("Linked %s from the store", output_file_name)
+        return DownloadedFile(output_file_path, size, sha1)
+
+    def add(self, file_name, width, downloaded, width_in_name=False):
+        """Add a downloaded file to the store.
+
+        If the store already holds the same contents, the downloaded file
+        is replaced by a link to it. The output file name is indexed
+        without the width prefix of width_in_name.
+        """
+        output_file_name = os.path.basename(downloaded.path)
+        if width_in_name:
+            output_file_name = output_file_name[len(make_rendition_name('', width)):]
+        object_path = self.get_object_path(downloaded.sha1)
+        if os.path.exists(object_path):
+            link_or_copy(object_path, downloaded.path)
+        else:
+            try:
+                os.makedirs(os.path.dirname(object_path))
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            link_or_copy(downloaded.path, object_path)
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO files '
+                '(file_name, width, sha1, output_file_name, size) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (clean_up_filename(file_name), _to_column(width),
+                 downloaded.sha1, output_file_name, downloaded.size))
+
+    def close(self):
+        """Close the store."""
+        with self._lock:
+            self._connection.close()
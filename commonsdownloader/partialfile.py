@@ -0,0 +1,70 @@
+# -=- encoding: latin-1 -=-
+
+"""Partial files of downloads in progress, and their resumption state."""
+
+import os
+import json
+import logging
+
+
+STATE_SUFFIX = '.download'
+
+
+def get_partial_file_path(output_file_path):
+    """Return the path where the given file is written while downloading."""
+    (directory, file_name) = os.path.split(output_file_path)
+    return os.path.join(directory, '.%s.part' % file_name)
+
+
+def replace_file(source, destination):
+    """Rename source to destination, overwriting destination."""
+    try:
+        os.rename(source, destination)
+    except OSError:
+        # Windows does not allow renaming over an existing file.
+        if not os.path.exists(destination):
+            raise
+        os.remove(destination)
+        os.rename(source, destination)
+
+
+def remove_if_exists(path):
+    """Remove the given file, if it exists."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def get_state_path(output_path, image_name, width):
+    """Return the path of the resumption state of the given download."""
+    return os.path.join(output_path,
+                        '.%s.%s%s' % (image_name, width or 'full', STATE_SUFFIX))
+
+
+def load_state(state_path):
+    """Return the resumption state stored at the given path, or None.
+
+    The state is a dictionary holding the URL of the download, the
+    validator (ETag or Last-Modified) of its response, the output file
+    name and the number of bytes safely written to the partial file.
+    """
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+        return dict((key, value.encode('utf-8') if isinstance(value, unicode) else value)
+                    for (key, value) in state.items())
+    except IOError:
+        return None
+    except ValueError:
+        logging.warning('Ignoring corrupted download state %s', state_path)
+        remove_if_exists(state_path)
+        return None
+
+
+def save_state(state_path, state):
+    """Store the resumption state, atomically replacing the previous one."""
+    temporary_path = state_path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(state, f)
+    replace_file(temporary_path, state_path)
@@ -0,0 +1,149 @@
+# -=- encoding: latin-1 -=-
+
+"""Skip the files already downloaded in bulk, before downloading any file."""
+
+import os
+import array
+import bisect
+import logging
+from layout import list_output_files, get_candidate_paths, DEFAULT_LAYOUT
+from thumbnaildownload import is_width_in_name
+from metrics import NULL_METRICS
+
+
+RECORD_BATCH_SIZE = 1000
+
+PRESCAN_THRESHOLD = 1000
+
+
+class KeySet(object):
+
+    """A compact set of keys, stored as a sorted array of their hashes.
+
+    It takes 8 bytes per key on 64-bit platforms, rather than the hundred
+    or so of a set of tuples. Two keys of the same hash cannot be told
+    apart, so that a key found in the set may have been added or not,
+    and is to be confirmed where a false hit costs more than a lookup.
+    """
+
+    def __init__(self, keys=()):
+        """Build the set from the given keys."""
+        self._hashes = array.array('l', sorted(hash(key) for key in keys))
+
+    def __contains__(self, key):
+        """Whether the key is in the set."""
+        key_hash = hash(key)
+        index = bisect.bisect_left(self._hashes, key_hash)
+        return index < len(self._hashes) and self._hashes[index] == key_hash
+
+    def __len__(self):
+        """Return the number of keys in the set."""
+        return len(self._hashes)
+
+
+class PreScan(object):
+
+    """The files already downloaded, from the manifest and the output folder.
+
+    The manifest is read with a single query, and each directory of the
+    output folder listed once, rather than looking each file up. Entries of manifest
+    whose file is no longer on disk are left out, so that they are
+    downloaded again, while files on disk missing from manifest, such as
+    after the loss of the manifest, are recorded in it and skipped. Unless
+    the width is in the file names, a file on disk recorded in manifest at
+    another width is not taken for the file at the width requested. Files
+    found by the scan are confirmed in manifest or on disk one by one, so
+    that a collision of hashes never skips a file not downloaded.
+    """
+
+    def __init__(self, manifest, output_path, width_in_name=False,
+                 layout=DEFAULT_LAYOUT):
+        """Scan the manifest and the output folder."""
+        self.manifest = manifest
+        self.output_path = output_path
+        self.width_in_name = width_in_name
+        self.layout = layout
+        self.on_disk = KeySet(list_output_files(output_path, layout))
+        downloaded = []
+        recorded_paths = []
+        for (file_name, width, path) in manifest:
+            if self.is_on_disk(path):
+                downloaded.append((file_name, width))
+            if path is not None:
+                recorded_paths.append(path)
+            elif not width_in_name:
+                recorded_paths.extend(get_candidate_paths(file_name, width,
+                                                          layout=layout))
+        self.downloaded = KeySet(downloaded)
+        self.recorded_paths = KeySet(recorded_paths)
+        logging.info('Found %s files in manifest and %s files on disk',
+                     len(self.downloaded), len(self.on_disk))
+
+    def is_on_disk(self, path):
+        """Whether the file at the path relative to the output folder exists.
+
+        Entries without a path, such as those of a text manifest, are
+        trusted to be on disk. Paths outside of the directories of the
+        layout are looked up one by one.
+        """
+        if path is None or path in self.on_disk:
+            return True
+        if os.path.dirname(path):
+            return os.path.exists(os.path.join(self.output_path, path))
+        return False
+
+    def find_on_disk(self, file_name, width):
+        """Return the path of the file on disk, relative, if any.
+
+        Without the width in the name, files recorded in manifest, which
+        are then at another width, are not returned.
+        """
+        width_in_name = is_width_in_name(width, self.width_in_name)
+        for path in get_candidate_paths(file_name, width, width_in_name,
+                                        self.layout):
+            if (path in self.on_disk and
+                    (width_in_name or path not in self.recorded_paths) and
+                    os.path.exists(os.path.join(self.output_path, path))):
+                return path
+        return None
+
+    def filter(self, files_iterator, metrics=NULL_METRICS, on_skip=None):
+        """Yield the file names and widths which are not downloaded yet.
+
+        on_skip(file_name, width), if given, is called for each file skipped.
+        """
+        skipped = 0
+        found = []
+        for (file_name, width) in files_iterator:
+            if ((file_name, width) in self.downloaded and
+                    (file_name, width) in self.manifest):
+                logging.debug('Skipping file %s', file_name)
+                skipped += 1
+                metrics.increment('skipped')
+                if on_skip:
+                    on_skip(file_name, width)
+                continue
+            path = self.find_on_disk(file_name, width)
+            if path is None:
+                yield (file_name, width)
+                continue
+            logging.debug('Found file %s on disk', file_name)
+            size = os.path.getsize(os.path.join(self.output_path, path))
+            found.append((file_name, width, path, size))
+            metrics.increment('skipped')
+            if on_skip:
+                on_skip(file_name, width)
+            if len(found) >= RECORD_BATCH_SIZE:
+                self.record(found, metrics)
+                skipped += len(found)
+                found = []
+        self.record(found, metrics)
+        skipped += len(found)
+        logging.info('Skipped %s files already downloaded', skipped)
+
+    def record(self, found, metrics=NULL_METRICS):
+        """Record the files found on disk in manifest."""
+        if found:
+            with metrics.timer('manifest'):
+                self.manifest.add_many(found)
+            logging.info('Recorded %s files found on disk in manifest', len(found))
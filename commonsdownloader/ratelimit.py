@@ -0,0 +1,116 @@
+# -=- encoding: latin-1 -=-
+
+"""Limit the rate and concurrency of requests, and schedule retries."""
+
+import time
+import random
+import threading
+
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+BASE_DELAY = 1.0
+
+MAX_DELAY = 300.0
+
+DECREASE_INTERVAL = 1.0
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds of a Retry-After header value, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    from email.utils import parsedate_tz, mktime_tz
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, mktime_tz(date) - time.time())
+
+
+def backoff_delay(attempt, retry_after=None, base=BASE_DELAY, maximum=MAX_DELAY):
+    """Return the delay before the given retry attempt.
+
+    The delay grows exponentially with the attempt, with some jitter, and
+    is never shorter than the Retry-After delay asked by the server.
+    """
+    delay = min(maximum, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+    return max(delay, retry_after or 0.0)
+
+
+class TokenBucket(object):
+
+    """A thread-safe token bucket, allowing `rate` acquisitions per second."""
+
+    def __init__(self, rate, capacity=None):
+        """Initialise a full bucket."""
+        self.rate = float(rate)
+        self.capacity = capacity or max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one to be available."""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency(object):
+
+    """Cap the number of tasks running at once, adapting the cap AIMD-style.
+
+    The cap grows by one every `limit` successful tasks, and is halved
+    when the server throttles us - at most once per DECREASE_INTERVAL, as
+    throttled tasks running at the same time report it together. New
+    tasks also wait for the Retry-After delay asked by the server.
+    """
+
+    def __init__(self, max_limit, min_limit=1):
+        """Initialise the cap at its maximum."""
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self._active = 0
+        self._resume_at = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait until a new task is allowed to run."""
+        with self._condition:
+            while True:
+                now = time.time()
+                if now < self._resume_at:
+                    self._condition.wait(self._resume_at - now)
+                elif self._active >= int(self.limit):
+                    self._condition.wait()
+                else:
+                    break
+            self._active += 1
+
+    def release(self, throttled=False, retry_after=None):
+        """Record the end of a task, and whether the server throttled it."""
+        with self._condition:
+            self._active -= 1
+            now = time.time()
+            if throttled:
+                if now - self._last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+                if retry_after:
+                    self._resume_at = max(self._resume_at, now + retry_after)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
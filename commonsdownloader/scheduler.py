@@ -0,0 +1,184 @@
+# -=- encoding: latin-1 -=-
+
+"""Start downloads by priority and size, capping the bytes in flight."""
+
+import bisect
+import threading
+from thumbnaildownload import clean_up_filename
+
+
+DEFAULT_WINDOW = 1000
+
+DEFAULT_LARGE_SIZE = 100 * 1024 * 1024
+
+DEFAULT_LARGE_JOBS = 1
+
+DEFAULT_PRIORITY = 0
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(value):
+    """Return the bytes of a size such as 500M, raising ValueError if invalid."""
+    multiplier = SIZE_UNITS.get(value[-1:].upper())
+    number = value[:-1] if multiplier else value
+    try:
+        size = int(float(number) * (multiplier or 1))
+    except ValueError:
+        raise ValueError('Invalid size %s, expected bytes, or K, M or G' % value)
+    if size <= 0:
+        raise ValueError('Invalid size %s, expected a positive size' % value)
+    return size
+
+
+def estimate_size(width, file_info):
+    """Return the estimated bytes of the file at the given width, or None.
+
+    Full sizes, including the thumbnails bigger than their source which
+    are downloaded at full size, have the size of the file. The size of a
+    thumbnail is that of the file, scaled down to the pixels it keeps.
+    """
+    if file_info is None or not file_info.size:
+        return None
+    if width is None or file_info.is_bigger_than_source(width):
+        return file_info.size
+    if not file_info.width:
+        return None
+    return int(file_info.size * min(1.0, float(width) / file_info.width) ** 2)
+
+
+def read_priorities(textfile_handler):
+    """Return the priorities of a list of `filename,priority` lines, by file name.
+
+    Raise ValueError on a line without a priority.
+    """
+    priorities = {}
+    for line in textfile_handler:
+        line = line.rstrip()
+        if not line:
+            continue
+        (file_name, _, priority) = line.rpartition(',')
+        try:
+            priorities[clean_up_filename(file_name)] = int(priority)
+        except ValueError:
+            raise ValueError('Invalid priority line: %s' % line)
+    return priorities
+
+
+class Scheduler(object):
+
+    """Choose which files of a job start next, by priority and size.
+
+    Files are read `window` at a time ahead of the downloads. Among them,
+    files of higher priority start first, then those of the oldest window,
+    and within a window the smallest first, so that a few large files do
+    not hold many small ones back, nor wait behind more than a window of
+    them. Files of `large_size` bytes or more run in a lane of their own,
+    `large_jobs` at a time, so that they never take all the workers. The
+    other files start as long as the bytes in flight stay under
+    `max_bytes`, if given, one file always being let through. Sizes are
+    estimated from the FileInfo of the files, if prefetched; files of
+    unknown size are neither reordered by size nor counted.
+
+    A scheduler can be shared by several jobs, which then share the cap.
+    """
+
+    def __init__(self, max_bytes=None, large_size=DEFAULT_LARGE_SIZE,
+                 large_jobs=DEFAULT_LARGE_JOBS, window=DEFAULT_WINDOW,
+                 priorities=None):
+        """Initialise the scheduler, with the priorities of the files by name."""
+        self.max_bytes = max_bytes
+        self.large_size = large_size
+        self.large_jobs = large_jobs
+        self.window = window
+        self.priorities = priorities or {}
+        self._condition = threading.Condition()
+        self._in_flight = {}
+        self._bytes = 0
+        self._large = 0
+
+    def get_priority(self, file_name):
+        """Return the priority of the file."""
+        return self.priorities.get(clean_up_filename(file_name), DEFAULT_PRIORITY)
+
+    def _get_size(self, item):
+        """Return the estimated size of a scheduled file, or None."""
+        return estimate_size(item[1], item[2] if len(item) > 2 else None)
+
+    def _is_large(self, size):
+        """Whether a file of the given size runs in the lane of large files."""
+        return size is not None and size >= self.large_size
+
+    def _can_start(self, size):
+        """Whether a file of the given size can start now."""
+        if self._is_large(size):
+            return self._large < self.large_jobs
+        return (self.max_bytes is None or not size or not self._bytes or
+                self._bytes + size <= self.max_bytes)
+
+    def _start(self, item, size):
+        """Record the file as in flight."""
+        self._in_flight.setdefault(item[:2], []).append(size)
+        if self._is_large(size):
+            self._large += 1
+        elif size:
+            self._bytes += size
+
+    def schedule(self, files_iterator):
+        """Yield the files of the iterator in the order they should start.
+
+        The files are (file_name, width) or (file_name, width, file_info)
+        tuples, as resolved by imageinfo.resolve_files. Files which cannot
+        start yet are held back until others are `done`.
+        """
+        pending = []
+        sequence = 0
+        files_iterator = iter(files_iterator)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self.window:
+                try:
+                    item = next(files_iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                size = self._get_size(item)
+                key = (-self.get_priority(item[0]), sequence // self.window,
+                       size or 0, sequence)
+                bisect.insort(pending, (key, size, item))
+                sequence += 1
+            if not pending:
+                return
+            with self._condition:
+                while True:
+                    index = next((index for (index, (_, size, _)) in enumerate(pending)
+                                  if self._can_start(size)), None)
+                    if index is not None:
+                        break
+                    self._condition.wait()
+                (_, size, item) = pending.pop(index)
+                self._start(item, size)
+            yield item
+
+    def done(self, file_name, width):
+        """Record that the download of the file is over.
+
+        Files retried are no longer counted once their first attempt failed.
+        """
+        with self._condition:
+            sizes = self._in_flight.get((file_name, width))
+            if not sizes:
+                return
+            size = sizes.pop()
+            if not sizes:
+                del self._in_flight[(file_name, width)]
+            if self._is_large(size):
+                self._large -= 1
+            elif size:
+                self._bytes -= size
+            self._condition.notify_all()
+
+    def get_bytes_in_flight(self):
+        """Return the estimated bytes of the files in flight, out of the large lane."""
+        with self._condition:
+            return self._bytes
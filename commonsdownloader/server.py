@@ -0,0 +1,385 @@
+# -=- encoding: latin-1 -=-
+
+"""Serve download jobs from a Unix socket or a spool folder, in a warm process."""
+
+import os
+import json
+import Queue
+import socket
+import logging
+import threading
+import itertools
+import SocketServer
+from collections import Counter
+from partialfile import replace_file
+
+
+DEFAULT_CONCURRENT_JOBS = 4
+
+DEFAULT_PRIORITY = 0
+
+SPOOL_INTERVAL = 1.0
+
+JOB_SUFFIX = '.json'
+
+RUNNING_SUFFIX = '.running'
+
+RESULT_SUFFIX = '.result'
+
+
+class Job(object):
+
+    """A download job, submitted to a DownloadServer.
+
+    A job downloads a list of files, names or [name, width] pairs, or the
+    files of a file list, to an output folder, which has its own manifest.
+    Jobs of higher priority are started first. on_result(result) is
+    called with each result of the job, as a dictionary, and
+    on_finish(summary) once the job is done, with its summary. The files
+    of a job at several widths are named after their width, as are those
+    of the lines of its list with several widths.
+    """
+
+    def __init__(self, output_path, files=None, list_path=None, widths=None,
+                 priority=DEFAULT_PRIORITY, refresh=False, job_id=None,
+                 on_result=None, on_finish=None):
+        """Initialise the job."""
+        self.output_path = output_path
+        self.files = files
+        self.list_path = list_path
+        self.widths = widths
+        self.priority = priority
+        self.refresh = refresh
+        self.id = job_id
+        self.on_result = on_result
+        self.on_finish = on_finish
+        self.summary = None
+        self.width_in_name = len(widths or []) > 1 or _has_several_widths(files or [])
+
+    @classmethod
+    def from_json(cls, data, **kwargs):
+        """Return the job of a JSON object, raising ValueError if invalid.
+
+        The object has an `output` folder, and either `files` or a `list`
+        path, with optionally the `widths` of the files listed without
+        width, a `priority`, `refresh` and an `id`.
+        """
+        job = json.loads(data)
+        if not isinstance(job, dict) or not isinstance(job.get('output'), basestring):
+            raise ValueError('A job needs an output folder')
+        files = job.get('files')
+        list_path = job.get('list')
+        if not isinstance(files, list) and not isinstance(list_path, basestring):
+            raise ValueError('A job needs files or a list')
+        widths = job.get('widths')
+        if widths is not None and not (isinstance(widths, list) and
+                                       all(_is_width(width) for width in widths)):
+            raise ValueError('Invalid widths: %s' % widths)
+        priority = job.get('priority', DEFAULT_PRIORITY)
+        if not isinstance(priority, (int, long)) or isinstance(priority, bool):
+            raise ValueError('Invalid priority: %s' % priority)
+        if files is not None:
+            expanded = []
+            for item in files:
+                if isinstance(item, basestring):
+                    if widths:
+                        expanded.extend((_encode(item), width) for width in widths)
+                    else:
+                        expanded.append(_encode(item))
+                elif (isinstance(item, list) and len(item) == 2 and
+                      isinstance(item[0], basestring) and _is_width(item[1])):
+                    expanded.append((_encode(item[0]), item[1]))
+                else:
+                    raise ValueError('Invalid file: %s' % (item,))
+            files = expanded
+        return cls(_encode(job['output']), files=files,
+                   list_path=list_path and _encode(list_path),
+                   widths=widths, priority=priority,
+                   refresh=bool(job.get('refresh')), job_id=job.get('id'),
+                   **kwargs)
+
+    def get_files(self):
+        """Return the files of the job, reading its list if any.
+
+        The list is read as a generator, which closes it once exhausted
+        or closed.
+        """
+        if self.list_path is None:
+            return self.files
+        return self._read_list()
+
+    def _read_list(self):
+        """Yield the files of the list of the job, closing it after."""
+        from commonsdownloader import get_files_from_textfile
+        from filelist import open_file_list
+        file_list = open_file_list(self.list_path)
+        try:
+            for item in get_files_from_textfile(file_list,
+                                                default_widths=self.widths):
+                yield item
+        finally:
+            file_list.close()
+
+    def finish(self, counts, error=None):
+        """Set the summary of the job, and report it."""
+        self.summary = {'id': self.id, 'done': True, 'counts': dict(counts)}
+        if error is not None:
+            self.summary['error'] = error
+        if self.on_finish:
+            self.on_finish(self.summary)
+
+
+def _has_several_widths(files):
+    """Whether the files, names or (name, width) pairs, are at several widths."""
+    # Names are at the width of the session, which no pair width equals.
+    return len(set(() if isinstance(item, basestring) else item[1]
+                   for item in files)) > 1
+
+
+def _is_width(value):
+    """Whether a value of a JSON job is a width, None being the full size."""
+    return value is None or (isinstance(value, (int, long)) and
+                             not isinstance(value, bool) and value > 0)
+
+
+def _encode(value):
+    """Return a string of a JSON job as UTF-8."""
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def format_result(result):
+    """Return a DownloadResult as a dictionary, to be sent as JSON."""
+    return {'file': result.file_name,
+            'width': result.width,
+            'status': result.status,
+            'path': result.downloaded.path if result.downloaded else None,
+            'error': result.error}
+
+
+class DownloadServer(object):
+
+    """Run download jobs concurrently, on a Downloader kept warm.
+
+    The connections, caches and manifests of the Downloader are shared
+    by the jobs, so that a job of a few files only costs the requests
+    of its files. Up to `concurrent_jobs` jobs run at the same time, the
+    others waiting by priority, then in order of submission. Jobs look
+    their first PRESCAN_THRESHOLD files up in manifest one by one, so
+    that small jobs do not scan their output folder.
+    """
+
+    def __init__(self, downloader, concurrent_jobs=DEFAULT_CONCURRENT_JOBS):
+        """Start the threads running the jobs."""
+        self.downloader = downloader
+        self._jobs = Queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._listeners = []
+        self._stopped = threading.Event()
+        self._threads = []
+        for _ in range(concurrent_jobs):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job):
+        """Queue the job, and return it."""
+        logging.info('Queuing job %s to %s', job.id, job.output_path)
+        self._jobs.put((-job.priority, next(self._sequence), job))
+        return job
+
+    def _run(self):
+        """Run the queued jobs until stopped."""
+        while True:
+            (_, _, job) = self._jobs.get()
+            if job is None:
+                break
+            self.run_job(job)
+
+    def run_job(self, job):
+        """Run the job, reporting its results."""
+        counts = Counter()
+        error = None
+        files = None
+        try:
+            files = job.get_files()
+            for result in self.downloader.download_many(
+                    files, job.output_path, refresh=job.refresh,
+                    width_in_name=job.width_in_name):
+                counts[result.status] += 1
+                if job.on_result:
+                    job.on_result(format_result(result))
+        except Exception, e:
+            logging.exception('Job %s failed: %s', job.id, e)
+            error = str(e)
+        finally:
+            if files is not None and files is not job.files:
+                files.close()
+        logging.info('Finished job %s: %s', job.id, dict(counts))
+        job.finish(counts, error)
+
+    def serve_socket(self, path):
+        """Accept jobs on a Unix socket at the given path, in a thread.
+
+        Each line received is a JSON job, answered with a JSON line per
+        file done, and a last line summing up the job.
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        listener = UnixJobServer(path, self)
+        thread = threading.Thread(target=listener.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self._listeners.append((listener, thread))
+        logging.info('Accepting jobs on %s', path)
+
+    def serve_spool(self, path, interval=SPOOL_INTERVAL):
+        """Run the jobs dropped in the spool folder, in a thread.
+
+        Jobs are JSON files named *.json, which are renamed to
+        *.json.running while they run, and replaced by a *.json.result
+        file summing up the job and listing its results. Job files should
+        be written under another name and renamed, so that they are only
+        picked up once complete. Jobs left running by a previous server
+        are run again.
+        """
+        for name in os.listdir(path):
+            if name.endswith(JOB_SUFFIX + RUNNING_SUFFIX):
+                job_path = os.path.join(path, name[:-len(RUNNING_SUFFIX)])
+                os.rename(job_path + RUNNING_SUFFIX, job_path)
+        thread = threading.Thread(target=self._watch_spool, args=(path, interval))
+        thread.daemon = True
+        thread.start()
+        self._listeners.append((None, thread))
+        logging.info('Watching for jobs in %s', path)
+
+    def _watch_spool(self, path, interval):
+        """Submit the jobs of the spool folder until stopped."""
+        while not self._stopped.is_set():
+            try:
+                names = sorted(os.listdir(path))
+            except OSError, e:
+                logging.error('Could not list the spool folder %s: %s', path, e)
+                names = []
+            for name in names:
+                if name.endswith(JOB_SUFFIX) and not name.startswith('.'):
+                    try:
+                        self._submit_spooled(os.path.join(path, name))
+                    except Exception, e:
+                        logging.exception('Could not submit job %s: %s', name, e)
+            self._stopped.wait(interval)
+
+    def _submit_spooled(self, job_path):
+        """Claim the job file and submit it, writing its results once done."""
+        running_path = job_path + RUNNING_SUFFIX
+        try:
+            os.rename(job_path, running_path)
+        except OSError:
+            return
+        results = []
+
+        def finish(summary):
+            write_spool_result(job_path, dict(summary, results=results))
+            os.remove(running_path)
+        try:
+            with open(running_path) as f:
+                job = Job.from_json(f.read(), on_result=results.append,
+                                    on_finish=finish)
+        except ValueError, e:
+            logging.error('Invalid job %s: %s', job_path, e)
+            finish({'done': True, 'error': str(e)})
+            return
+        if job.id is None:
+            job.id = os.path.basename(job_path)
+        self.submit(job)
+
+    def wait(self):
+        """Wait until stopped, such as by a KeyboardInterrupt."""
+        while not self._stopped.is_set():
+            self._stopped.wait(3600)
+
+    def close(self):
+        """Stop accepting jobs, and wait for the jobs queued to finish."""
+        self._stopped.set()
+        for (listener, thread) in self._listeners:
+            if listener is not None:
+                listener.shutdown()
+                listener.server_close()
+                if os.path.exists(listener.server_address):
+                    os.remove(listener.server_address)
+            thread.join()
+        for _ in self._threads:
+            self._jobs.put((float('inf'), None, None))
+        for thread in self._threads:
+            thread.join()
+
+
+def write_spool_result(job_path, summary):
+    """Write the results of a spooled job next to it, atomically."""
+    result_path = job_path + RESULT_SUFFIX
+    temporary_path = os.path.join(os.path.dirname(job_path),
+                                  '.%s.tmp' % os.path.basename(result_path))
+    with open(temporary_path, 'w') as f:
+        json.dump(summary, f)
+    replace_file(temporary_path, result_path)
+
+
+class JobRequestHandler(SocketServer.StreamRequestHandler):
+
+    """Handle the jobs sent on a connection to the Unix socket."""
+
+    def handle(self):
+        """Run each job received, sending back its results as they come."""
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            messages = Queue.Queue()
+            try:
+                job = Job.from_json(line, on_result=messages.put,
+                                    on_finish=messages.put)
+            except ValueError, e:
+                self.send({'done': True, 'error': str(e)})
+                continue
+            self.server.download_server.submit(job)
+            while True:
+                message = messages.get()
+                self.send(message)
+                if message.get('done'):
+                    break
+
+    def send(self, message):
+        """Send a message as a JSON line."""
+        self.wfile.write(json.dumps(message) + '\n')
+        self.wfile.flush()
+
+
+class UnixJobServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    """A Unix socket server handling each connection in a thread."""
+
+    daemon_threads = True
+
+    def __init__(self, path, download_server):
+        """Listen on the socket at the given path."""
+        self.download_server = download_server
+        SocketServer.UnixStreamServer.__init__(self, path, JobRequestHandler)
+
+
+def submit(path, job):
+    """Submit a job to the server on the Unix socket at path.
+
+    The job is a dictionary, as described in Job.from_json. Yield the
+    results of the job as dictionaries, and finally its summary.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+        connection.sendall(json.dumps(job) + '\n')
+        stream = connection.makefile('r')
+        for line in iter(stream.readline, ''):
+            message = json.loads(line)
+            yield message
+            if message.get('done'):
+                break
+    finally:
+        connection.close()
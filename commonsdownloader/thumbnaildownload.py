@@ -4,12 +4,38 @@
 
 import os
 import re
+import time
+import socket
+import hashlib
+import httplib
 import urllib2
 import logging
+import httpclient
+from collections import namedtuple
+from ratelimit import parse_retry_after
+from metrics import NULL_METRICS
+from diskwriter import open_output_file
+from partialfile import (get_partial_file_path, remove_if_exists,
+                         get_state_path, load_state, save_state)
 
 
 DEFAULT_WIDTH = 100
 
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+DEFAULT_HEADERS = {'User-Agent': 'CommonsDownloader (https://github.com/Commonists/CommonsDownloader)'}
+
+STATE_INTERVAL = 1024 * 1024
+
+TRANSIENT_HTTP_CODES = (429, 500, 502, 503, 504)
+
+THUMBNAIL_EXTENSIONS = {'svg': 'png', 'tif': 'jpg', 'tiff': 'jpg'}
+
+
+DownloadedFile = namedtuple('DownloadedFile', ['path', 'size', 'sha1',
+                                               'etag', 'last_modified'])
+DownloadedFile.__new__.__defaults__ = (None, None)
+
 
 class DownloadException(Exception):
 
@@ -32,6 +58,23 @@ class RequestedWidthBiggerThanSourceException(DownloadException):
     pass
 
 
+class TransientDownloadException(DownloadException):
+
+    """Exception raised when a download failed, but may succeed later."""
+
+    def __init__(self, message, retry_after=None):
+        """Initialise the exception, with the delay asked by the server."""
+        DownloadException.__init__(self, message)
+        self.retry_after = retry_after
+
+
+class FileNotModifiedException(DownloadException):
+
+    """Exception raised when a file did not change since its last download."""
+
+    pass
+
+
 class CouldNotWriteFileOnDiskException(DownloadException):
 
     """Exception raised when the file could not be written on disk."""
@@ -62,40 +105,148 @@ def clean_extension(extension):
     return extension_converter.get(extension, extension)
 
 
+def get_extension(file_path):
+    """Return the lowercase extension of the given path, without the dot."""
+    return os.path.splitext(file_path)[1][1:].lower()
+
+
 def make_thumbnail_name(image_name, extension):
     """Return name of the downloaded thumbnail, based on the extension."""
     file_name, _ = os.path.splitext(image_name)
     return file_name + '.' + clean_extension(extension)
 
 
-def get_thumbnail_of_file(image_name, width):
-    """Return the file contents of the thumbnail of the given file."""
-    hdr = {'User-Agent': 'Python urllib2'}
+def make_rendition_name(file_name, width):
+    """Return the name of the file at given width, as `<width>px-<name>`."""
+    if width is None:
+        return file_name
+    return '%spx-%s' % (width, file_name)
+
+
+class NamedWidth(int):
+
+    """A width the files are named after, as `<width>px-<name>`.
+
+    The widths of a file listed at several widths are named, so that its
+    renditions do not overwrite each other, while files listed at a
+    single width keep their name. It is pickled as a plain width.
+    """
+
+    def __reduce__(self):
+        """Pickle the width as an int."""
+        return (int, (int(self),))
+
+
+def is_width_in_name(width, width_in_name=False):
+    """Whether the files at the given width are named after it."""
+    return width_in_name or isinstance(width, NamedWidth)
+
+
+def name_widths(widths):
+    """Return the widths a file is listed at, as NamedWidth if several."""
+    if len(widths) > 1:
+        return [width if width is None else NamedWidth(width) for width in widths]
+    return widths
+
+
+def open_url(url, transport=None, headers=None):
+    """Return the response to the given URL, through the given transport.
+
+    The transport defaults to the shared keep-alive connection pool.
+    """
+    transport = transport or httpclient.get_default_pool()
+    all_headers = dict(DEFAULT_HEADERS)
+    all_headers.update(headers or {})
+    logging.debug("Retrieving %s", url)
+    return transport.urlopen(url, headers=all_headers)
+
+
+def get_response_header(response, name):
+    """Return the given header of the response, or None."""
+    headers = getattr(response, 'headers', None)
+    if headers is None:
+        return None
+    return headers.getheader(name)
+
+
+def make_conditional_headers(validators):
+    """Return the headers making a request conditional on the validators.
+
+    The validators are the (ETag, Last-Modified) pair of the previous
+    download of the file, either of which may be None.
+    """
+    (etag, last_modified) = validators or (None, None)
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def check_modified(response, image_name):
+    """Raise FileNotModifiedException if the response is a 304."""
+    if getattr(response, 'status', 200) == 304:
+        response.read()
+        response.close()
+        raise FileNotModifiedException("File %s not modified" % image_name)
+
+
+def open_thumbnail_of_file(image_name, width, transport=None, headers=None):
+    """Return the response for the thumbnail of the given file, and its name."""
     url = make_thumb_url(image_name, width)
-    req = urllib2.Request(url, headers=hdr)
     try:
-        logging.debug("Retrieving %s", url)
-        opened = urllib2.urlopen(req)
+        opened = open_url(url, transport=transport, headers=headers)
+        check_modified(opened, image_name)
         extension = opened.headers.subtype
-        return opened.read(), make_thumbnail_name(image_name, extension)
-    except urllib2.HTTPError, e:
-        message = e.fp.read()
-        raise get_exception_based_on_api_message(message, image_name)
+        return opened, make_thumbnail_name(image_name, extension)
+    except urllib2.URLError, e:
+        raise get_exception_based_on_url_error(e, image_name)
 
 
-def get_full_size_file(image_name):
-    """Return the file contents of given file at full size."""
-    hdr = {'User-Agent': 'Python urllib2'}
+def open_full_size_file(image_name, transport=None, headers=None):
+    """Return the response for the given file at full size, and its name."""
     url = make_full_size_url(image_name)
-    req = urllib2.Request(url, headers=hdr)
     try:
-        logging.debug("Retrieving %s", url)
-        opened = urllib2.urlopen(req)
+        opened = open_url(url, transport=transport, headers=headers)
+        check_modified(opened, image_name)
         extension = opened.headers.subtype
-        return opened.read(), make_thumbnail_name(image_name, extension)
-    except urllib2.HTTPError, e:
-        message = e.fp.read()
-        raise get_exception_based_on_api_message(message, image_name)
+        return opened, make_thumbnail_name(image_name, extension)
+    except urllib2.URLError, e:
+        raise get_exception_based_on_url_error(e, image_name)
+
+
+def get_thumbnail_of_file(image_name, width, transport=None):
+    """Return the file contents of the thumbnail of the given file."""
+    opened, output_file_name = open_thumbnail_of_file(image_name, width,
+                                                      transport=transport)
+    return opened.read(), output_file_name
+
+
+def get_full_size_file(image_name, transport=None):
+    """Return the file contents of given file at full size."""
+    opened, output_file_name = open_full_size_file(image_name,
+                                                   transport=transport)
+    return opened.read(), output_file_name
+
+
+def get_exception_based_on_url_error(error, image_name=""):
+    """Return the exception matching the given HTTP or network error.
+
+    Server overload and network errors are transient; other HTTP errors
+    are matched on their API message.
+    """
+    if not isinstance(error, urllib2.HTTPError):
+        msg = "Network error when retrieving %s: %s" % (image_name, error.reason)
+        return TransientDownloadException(msg)
+    exception = get_exception_based_on_api_message(error.fp.read(), image_name)
+    if type(exception) is DownloadException and error.code in TRANSIENT_HTTP_CODES:
+        headers = error.info()
+        retry_after = parse_retry_after(headers.getheader('Retry-After')
+                                        if headers else None)
+        msg = "Server unavailable (HTTP %s) when retrieving %s" % (error.code, image_name)
+        return TransientDownloadException(msg, retry_after=retry_after)
+    return exception
 
 
 def get_exception_based_on_api_message(message, image_name=""):
@@ -116,21 +267,257 @@ def get_exception_based_on_api_message(message, image_name=""):
         return DownloadException(message)
 
 
-def download_file(image_name, output_path, width=DEFAULT_WIDTH):
-    """Download a given Wikimedia Commons file."""
+def make_download_state(response, output_file_path):
+    """Return the resumption state of the download of the response.
+
+    None is returned when the response has no validator, as the download
+    could then not be resumed safely.
+    """
+    validator = (get_response_header(response, 'etag') or
+                 get_response_header(response, 'last-modified'))
+    if validator is None or not hasattr(response, 'geturl'):
+        return None
+    return {'url': response.geturl(),
+            'validator': validator,
+            'output_file_name': os.path.basename(output_file_path),
+            'bytes': 0}
+
+
+def hash_file(file_path, size, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Return the SHA-1 object of the first size bytes of the file."""
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        while size > 0:
+            chunk = f.read(min(buffer_size, size))
+            if not chunk:
+                break
+            sha1.update(chunk)
+            size -= len(chunk)
+    return sha1
+
+
+def write_response_to_file(response, output_file_path,
+                           buffer_size=DEFAULT_BUFFER_SIZE, offset=0,
+                           state_path=None, state_interval=STATE_INTERVAL,
+                           metrics=NULL_METRICS, writer=None):
+    """Stream the body of the response to the given path.
+
+    The body is read in chunks of buffer_size bytes into a partial file,
+    which is renamed to output_file_path once complete. With an offset,
+    the body is appended to the first offset bytes of the partial file.
+    With a state_path, the resumption state is saved every state_interval
+    bytes, and the partial file is kept if the connection is lost.
+    With a DiskWriter, the body is written on its threads while the next
+    chunks are read. The time spent transferring and writing the body is
+    recorded in the given Metrics. Return the DownloadedFile, with the size
+    and SHA-1 of the contents, and the validators of the response.
+    """
+    partial_file_path = get_partial_file_path(output_file_path)
+    state = None
+    if state_path:
+        state = make_download_state(response, output_file_path)
+    if offset:
+        sha1 = hash_file(partial_file_path, offset, buffer_size=buffer_size)
+        with open(partial_file_path, 'r+b') as f:
+            f.truncate(offset)
+    else:
+        sha1 = hashlib.sha1()
+    size = saved_size = offset
+    if state is not None:
+        state['bytes'] = offset
+    transfer_time = write_time = 0.0
+    try:
+        f = open_output_file(partial_file_path, append=bool(offset), writer=writer)
+    except Exception:
+        response.close()
+        raise
+    try:
+        logging.debug("Writing as %s", output_file_path)
+        while True:
+            started = time.time()
+            try:
+                chunk = response.read(buffer_size)
+            except (socket.error, httplib.HTTPException), e:
+                raise TransientDownloadException('Connection lost: %s' % e)
+            read = time.time()
+            transfer_time += read - started
+            if not chunk:
+                break
+            f.write(chunk)
+            write_time += time.time() - read
+            sha1.update(chunk)
+            size += len(chunk)
+            if state is not None and size - saved_size >= state_interval:
+                state['bytes'] = saved_size = size
+                f.call(save_state, state_path, dict(state))
+        f.close(rename_to=output_file_path)
+        if state_path:
+            remove_if_exists(state_path)
+        metrics.add_time('transfer', transfer_time)
+        metrics.add_time('write', write_time)
+        metrics.increment('bytes', size - offset)
+        return DownloadedFile(output_file_path, size, sha1.hexdigest(),
+                              etag=get_response_header(response, 'etag'),
+                              last_modified=get_response_header(response,
+                                                                'last-modified'))
+    except DownloadException:
+        response.close()
+        f.abort()
+        if not saved_size:
+            remove_if_exists(partial_file_path)
+        raise
+    except Exception:
+        response.close()
+        f.abort()
+        remove_if_exists(partial_file_path)
+        if state_path:
+            remove_if_exists(state_path)
+        raise
+
+
+def open_resumed_download(state_path, output_path, transport=None):
+    """Return the response resuming a download, its file name and offset.
+
+    The rest of the file is requested with a Range conditioned on the
+    validator of the interrupted response; if the server sends the whole
+    file instead, the offset is 0. None is returned when there is no
+    download to resume.
+    """
+    state = load_state(state_path)
+    if state is None:
+        return None
+    output_file_name = state['output_file_name']
+    partial_file_path = get_partial_file_path(os.path.join(output_path,
+                                                           output_file_name))
+    offset = state['bytes']
+    if not os.path.exists(partial_file_path) or \
+            os.path.getsize(partial_file_path) < offset:
+        remove_if_exists(state_path)
+        return None
+    headers = {'Range': 'bytes=%s-' % offset, 'If-Range': state['validator']}
+    try:
+        opened = open_url(state['url'], transport=transport, headers=headers)
+    except urllib2.URLError, e:
+        exception = get_exception_based_on_url_error(e, output_file_name)
+        if isinstance(exception, TransientDownloadException):
+            raise exception
+        logging.warning("Could not resume download from %s: %s", state['url'], e)
+        remove_if_exists(state_path)
+        return None
+    content_range = get_response_header(opened, 'content-range') or ''
+    if getattr(opened, 'status', 200) == 206 and \
+            content_range.startswith('bytes %s-' % offset):
+        logging.info("Resuming download of %s from byte %s",
+                     output_file_name, offset)
+        return opened, output_file_name, offset
+    logging.info("Server ignored the range - downloading %s from scratch",
+                 output_file_name)
+    return opened, output_file_name, 0
+
+
+def fetch_resolved_file(image_name, file_info, output_path,
+                        width=DEFAULT_WIDTH, transport=None,
+                        buffer_size=DEFAULT_BUFFER_SIZE, validators=None,
+                        width_in_name=False, metrics=NULL_METRICS,
+                        writer=None):
+    """Download a Wikimedia Commons file, from its prefetched FileInfo.
+
+    The file is fetched straight from the URL of its thumbnail, or from
+    the URL of the full size file if the width is bigger than the source.
+    With width_in_name, the output file name is prefixed with the width.
+    With the validators of a previous download, the request is conditional
+    and FileNotModifiedException is raised if the file did not change.
+    The time spent in each stage is recorded in the given Metrics. With a
+    DiskWriter, the file is written on its threads. Return the DownloadedFile.
+    """
     image_name = clean_up_filename(image_name)
-    logging.info("Downloading %s with width %s", image_name, width)
+    if file_info is None:
+        raise FileDoesNotExistException("File %s does not exist" % image_name)
+    state_path = get_state_path(output_path, image_name, width)
+    with metrics.timer('http'):
+        resumed = open_resumed_download(state_path, output_path,
+                                        transport=transport)
+    if resumed:
+        (opened, output_file_name, offset) = resumed
+    else:
+        (url, mime) = file_info.get_url_and_mime(width)
+        if url == file_info.url and width is not None:
+            logging.info("Downloading %s at full size, as width %s is bigger than source",
+                         image_name, width)
+        else:
+            logging.info("Downloading %s with width %s", image_name, width)
+        try:
+            with metrics.timer('http'):
+                opened = open_url(url, transport=transport,
+                                  headers=make_conditional_headers(validators))
+        except urllib2.URLError, e:
+            raise get_exception_based_on_url_error(e, image_name)
+        check_modified(opened, image_name)
+        output_file_name = make_thumbnail_name(image_name, mime.split('/')[-1])
+        if width_in_name:
+            output_file_name = make_rendition_name(output_file_name, width)
+        offset = 0
+    output_file_path = os.path.join(output_path, output_file_name)
     try:
-        contents, output_file_name = get_thumbnail_of_file(image_name, width)
-    except RequestedWidthBiggerThanSourceException:
-        logging.warning("Requested width is bigger than source - downloading full size")
-        contents, output_file_name = get_full_size_file(image_name)
+        return write_response_to_file(opened, output_file_path,
+                                      buffer_size=buffer_size, offset=offset,
+                                      state_path=state_path, metrics=metrics,
+                                      writer=writer)
+    except IOError, e:
+        msg = 'Could not write file %s on disk to %s: %s' % \
+              (image_name, output_path, e.message)
+        logging.error(msg)
+        raise CouldNotWriteFileOnDiskException(msg)
+
+
+def download_resolved_file(image_name, file_info, output_path,
+                           width=DEFAULT_WIDTH, **options):
+    """Download a file from its prefetched FileInfo, and return its path."""
+    return fetch_resolved_file(image_name, file_info, output_path,
+                               width=width, **options).path
+
+
+def fetch_file(image_name, output_path, width=DEFAULT_WIDTH, transport=None,
+               buffer_size=DEFAULT_BUFFER_SIZE, validators=None,
+               width_in_name=False, metrics=NULL_METRICS, writer=None):
+    """Download a given Wikimedia Commons file, and return the DownloadedFile.
+
+    With width_in_name, the output file name is prefixed with the width.
+    With the validators of a previous download, the request is conditional
+    and FileNotModifiedException is raised if the file did not change.
+    The time spent in each stage is recorded in the given Metrics. With a
+    DiskWriter, the file is written on its threads.
+    """
+    image_name = clean_up_filename(image_name)
+    state_path = get_state_path(output_path, image_name, width)
+    with metrics.timer('http'):
+        resumed = open_resumed_download(state_path, output_path,
+                                        transport=transport)
+    if resumed:
+        (opened, output_file_name, offset) = resumed
+    else:
+        logging.info("Downloading %s with width %s", image_name, width)
+        headers = make_conditional_headers(validators)
+        try:
+            with metrics.timer('http'):
+                opened, output_file_name = open_thumbnail_of_file(
+                    image_name, width, transport=transport, headers=headers)
+        except RequestedWidthBiggerThanSourceException:
+            logging.warning("Requested width is bigger than source - downloading full size")
+            with metrics.timer('http'):
+                opened, output_file_name = open_full_size_file(
+                    image_name, transport=transport, headers=headers)
+        if width_in_name:
+            output_file_name = make_rendition_name(output_file_name, width)
+        offset = 0
     output_file_path = os.path.join(output_path, output_file_name)
     try:
-        with open(output_file_path, 'wb') as f:
-            logging.debug("Writing as %s", output_file_path)
-            f.write(contents)
-        return output_file_path
+        return write_response_to_file(opened, output_file_path,
+                                      buffer_size=buffer_size, offset=offset,
+                                      state_path=state_path, metrics=metrics,
+                                      writer=writer)
+    except DownloadException:
+        raise
     except IOError, e:
         msg = 'Could not write file %s on disk to %s: %s' % \
               (image_name, output_path, e.message)
@@ -141,3 +528,8 @@ def download_file(image_name, output_path, width=DEFAULT_WIDTH):
         msg = 'An unexpected error occured when downloading %s to %s: %s' % \
               (image_name, output_path, e.message)
         raise DownloadException(msg)
+
+
+def download_file(image_name, output_path, width=DEFAULT_WIDTH, **options):
+    """Download a given Wikimedia Commons file, and return its path."""
+    return fetch_file(image_name, output_path, width=width, **options).path
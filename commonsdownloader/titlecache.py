@@ -0,0 +1,121 @@
+# -=- encoding: latin-1 -=-
+
+"""A persistent cache of the files resolved through the imageinfo API."""
+
+import json
+import time
+import sqlite3
+import logging
+import threading
+from imageinfo import FileInfo
+
+
+DAY = 24 * 3600
+
+DEFAULT_TTL = 30 * DAY
+
+DEFAULT_NEGATIVE_TTL = 7 * DAY
+
+DEFAULT_MAX_ENTRIES = 5000000
+
+USED_FLUSH_SIZE = 10000
+
+
+class TitleCache(object):
+
+    """A cache mapping file titles to their FileInfo, stored in SQLite.
+
+    Titles are the normalized `File:` titles requested, and their FileInfo
+    is the one of the page they resolve to, after redirects. Missing files
+    are cached as well, for negative_ttl seconds rather than ttl, as they
+    may be uploaded since. Once closed, the cache is trimmed down to its
+    max_entries most recently used titles.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        """Open the cache at the given path, creating it if needed."""
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self._used = []
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30,
+                                           check_same_thread=False)
+        self._connection.text_factory = str
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS titles ('
+                'title TEXT PRIMARY KEY, '
+                'info TEXT, '
+                'expires REAL NOT NULL, '
+                'used REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS titles_used ON titles (used)')
+
+    def get_many(self, titles):
+        """Return a dictionary of the cached FileInfo of the titles.
+
+        Titles of missing files map to None, and titles which are not in
+        cache, or expired, are left out.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT title, info FROM titles WHERE expires >= ? AND title IN (%s)'
+                % ', '.join('?' * len(titles)), [now] + list(titles)).fetchall()
+            self._used.extend(title for (title, _) in rows)
+            self.hits += len(rows)
+            self.misses += len(titles) - len(rows)
+            if len(self._used) >= USED_FLUSH_SIZE:
+                with self._connection:
+                    self._flush_used(now)
+        return dict((title, FileInfo(*json.loads(info)) if info else None)
+                    for (title, info) in rows)
+
+    def put_many(self, files_info):
+        """Cache the FileInfo, or None, of each title of the dictionary."""
+        now = time.time()
+        rows = []
+        for (title, info) in files_info.items():
+            if info is None:
+                rows.append((title, None, now + self.negative_ttl, now))
+            else:
+                rows.append((title, json.dumps(list(info)), now + self.ttl, now))
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO titles (title, info, expires, used) '
+                'VALUES (?, ?, ?, ?)', rows)
+            self._flush_used(now)
+
+    def _flush_used(self, now):
+        """Record the time of use of the titles read since the last flush."""
+        (used, self._used) = (self._used, [])
+        self._connection.executemany('UPDATE titles SET used = ? WHERE title = ?',
+                                     ((now, title) for title in used))
+
+    def trim(self):
+        """Remove the least recently used titles beyond max_entries."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM titles WHERE title IN '
+                '(SELECT title FROM titles ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,))
+
+    def __len__(self):
+        """Return the number of titles in cache."""
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM titles').fetchone()[0]
+
+    def close(self):
+        """Record the titles used, trim the cache and close it."""
+        with self._lock, self._connection:
+            self._flush_used(time.time())
+        self.trim()
+        logging.info('Resolved %s titles from cache, %s through the API',
+                     self.hits, self.misses)
+        with self._lock:
+            self._connection.close()
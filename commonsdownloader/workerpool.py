@@ -0,0 +1,170 @@
+# -=- encoding: latin-1 -=-
+
+"""Run tasks concurrently on a bounded pool of worker threads."""
+
+import time
+import heapq
+import logging
+import threading
+import Queue
+
+
+DEFAULT_JOBS = 1
+
+DEFAULT_PREFETCH_SIZE = 1000
+
+
+def run_in_worker_pool(function, arguments_iterator, jobs=DEFAULT_JOBS):
+    """Call function on each tuple of arguments, using a pool of threads.
+
+    The iterator is consumed lazily: at most twice as many tasks as there
+    are workers are pulled from it ahead of time.
+    """
+    if jobs <= 1:
+        for arguments in arguments_iterator:
+            _call_safely(function, arguments)
+        return
+    tasks = Queue.Queue(maxsize=jobs * 2)
+
+    def worker():
+        while True:
+            arguments = tasks.get()
+            if arguments is None:
+                return
+            _call_safely(function, arguments)
+
+    threads = [threading.Thread(target=worker) for _ in range(jobs)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        for arguments in arguments_iterator:
+            tasks.put(arguments)
+    finally:
+        for _ in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+
+
+class RetryQueue(object):
+
+    """Tasks to run again once their delay has passed.
+
+    iterate() yields the initial tasks, then the tasks put back for retry,
+    until no task is left to retry and none is still running.
+    """
+
+    def __init__(self):
+        """Initialise an empty queue."""
+        self._condition = threading.Condition()
+        self._retries = []
+        self._count = 0
+        self._running = 0
+
+    def put(self, task, delay):
+        """Schedule the task to run again after delay seconds."""
+        with self._condition:
+            self._count += 1
+            heapq.heappush(self._retries, (time.time() + delay, self._count, task))
+            self._condition.notify_all()
+
+    def task_done(self):
+        """Record the end of a task yielded by iterate()."""
+        with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
+
+    def iterate(self, tasks):
+        """Yield the given tasks, then the retries as they become due."""
+        for task in tasks:
+            with self._condition:
+                self._running += 1
+            yield task
+        while True:
+            with self._condition:
+                while True:
+                    now = time.time()
+                    if self._retries and self._retries[0][0] <= now:
+                        (_, _, task) = heapq.heappop(self._retries)
+                        self._running += 1
+                        break
+                    if not self._retries and not self._running:
+                        return
+                    timeout = self._retries[0][0] - now if self._retries else None
+                    self._condition.wait(timeout)
+            yield task
+
+
+def run_with_retries(function, arguments_iterator, get_retry_delay,
+                     jobs=DEFAULT_JOBS, max_attempts=1, give_up=None):
+    """Call function on each tuple of arguments, retrying failed calls.
+
+    get_retry_delay(exception, attempt) returns the delay before retrying
+    a call which raised the exception, or None if it should not be
+    retried. Retried calls are put back at the end of the job, so that
+    they do not hold the other tasks back. give_up(arguments, exception),
+    if given, is called for the calls which finally failed.
+    """
+    retries = RetryQueue()
+
+    def run_task(attempt, arguments):
+        try:
+            function(*arguments)
+        except Exception, e:
+            delay = get_retry_delay(e, attempt)
+            if delay is None:
+                if give_up:
+                    give_up(arguments, e)
+                raise
+            if attempt + 1 >= max_attempts:
+                logging.error("Giving up after %s attempts: %s", attempt + 1, e)
+                if give_up:
+                    give_up(arguments, e)
+                return
+            logging.warning("Retrying in %.1f seconds: %s", delay, e)
+            retries.put((attempt + 1, arguments), delay)
+        finally:
+            retries.task_done()
+
+    tasks = retries.iterate((0, arguments) for arguments in arguments_iterator)
+    run_in_worker_pool(run_task, tasks, jobs=jobs)
+
+
+def _call_safely(function, arguments):
+    """Call function with the given arguments, logging any exception."""
+    try:
+        function(*arguments)
+    except Exception, e:
+        logging.exception("Unexpected error in worker: %s", e)
+
+
+def prefetch(iterable, size=DEFAULT_PREFETCH_SIZE):
+    """Yield the items of iterable, pulled ahead by a background thread.
+
+    Up to `size` items are fetched in advance, so that producing them
+    overlaps with consuming them. Exceptions raised by the iterable are
+    raised again in the consumer.
+    """
+    items = Queue.Queue(maxsize=size)
+    end = object()
+
+    def producer():
+        try:
+            for item in iterable:
+                items.put((item, None))
+        except Exception, e:
+            items.put((end, e))
+        else:
+            items.put((end, None))
+
+    thread = threading.Thread(target=producer)
+    thread.daemon = True
+    thread.start()
+    while True:
+        (item, error) = items.get()
+        if item is end:
+            if error is not None:
+                raise error
+            return
+        yield item
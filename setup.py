@@ -26,6 +26,10 @@ classifiers = [
 ]
 packages = ['commonsdownloader']
 requires = ['argparse', 'mwclient', 'six']
+extras = {
+    'thumbnails': ['Pillow'],
+    'svg': ['cairosvg'],
+}
 entry_points = {
         'console_scripts': [
             'download_from_Wikimedia_Commons = commonsdownloader.commonsdownloader:main',
@@ -44,5 +48,6 @@ setup(
       packages=packages,
       entry_points=entry_points,
       install_requires=requires,
+      extras_require=extras,
       classifiers=classifiers
 )
@@ -0,0 +1,65 @@
+# -*- coding: latin-1 -*-
+
+"""A fake transport answering from memory, for tests."""
+
+import httplib
+import urllib2
+from StringIO import StringIO
+from commonsdownloader import httpclient
+
+
+class FakeResponse(StringIO):
+
+    """A fake HTTP response, with its headers."""
+
+    def __init__(self, contents, content_type='image/jpeg', etag=None,
+                 status=200, url=None):
+        """Initialise the response."""
+        StringIO.__init__(self, contents)
+        self.status = status
+        self.url = url
+        header_lines = 'Content-Type: %s\r\n' % content_type
+        if etag:
+            header_lines += 'ETag: %s\r\n' % etag
+        self.headers = httplib.HTTPMessage(StringIO(header_lines + '\r\n'))
+
+    def geturl(self):
+        """Return the URL of the response."""
+        return self.url
+
+
+class FakeTransport(httpclient.Transport):
+
+    """A fake transport, answering any URL with the same contents.
+
+    URLs of `missing` files are answered with a 404 error, and the first
+    `failures` requests with a 503 error. With an ETag, requests matching
+    it are answered with a 304.
+    """
+
+    def __init__(self, contents='contents', failures=0, etag=None, missing=()):
+        """Initialise the transport."""
+        self.contents = contents
+        self.failures = failures
+        self.etag = etag
+        self.missing = missing
+        self.urls = []
+        self.closed = False
+
+    def urlopen(self, url, headers=None):
+        """Return a response to the given URL."""
+        self.urls.append(url)
+        if len(self.urls) <= self.failures:
+            headers = httplib.HTTPMessage(StringIO('Retry-After: 0\r\n\r\n'))
+            raise urllib2.HTTPError(url, 503, 'Service Unavailable', headers,
+                                    StringIO('Service Unavailable'))
+        if any(name in url for name in self.missing):
+            raise urllib2.HTTPError(url, 404, 'Not Found', None,
+                                    StringIO('Not Found'))
+        if self.etag and (headers or {}).get('If-None-Match') == self.etag:
+            return FakeResponse('', etag=self.etag, status=304, url=url)
+        return FakeResponse(self.contents, etag=self.etag, url=url)
+
+    def close(self):
+        """Record that the transport was closed."""
+        self.closed = True
@@ -0,0 +1,76 @@
+# -*- coding: latin-1 -*-
+
+"""A local stub HTTP server, for tests."""
+
+import threading
+import BaseHTTPServer
+import SocketServer
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """Answer requests from the routes of the server, with keep-alive."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        """Count the new connection."""
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        """Answer with the route matching the path, or a 404."""
+        with self.server.lock:
+            self.server.requests.append((self.path, dict(self.headers)))
+        route = self.server.routes.get(self.path)
+        if route is None:
+            route = (404, {}, 'Not found')
+        if callable(route):
+            route = route(self)
+        (status, headers, body) = route
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Do not log anything."""
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """A threaded HTTP server answering from a dictionary of routes.
+
+    Routes map a path (with its query string) to a tuple
+    (status, headers, body), or to a callable returning one.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, routes=None):
+        """Initialise the server on a free local port."""
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.routes = routes or {}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+
+    @property
+    def base_url(self):
+        """Return the URL of the server."""
+        return 'http://127.0.0.1:%s' % self.server_address[1]
+
+    def start(self):
+        """Serve requests in a background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop serving requests."""
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import unittest
+from commonsdownloader import category
+
+
+class FakeSite(object):
+
+    """A fake mwclient Site, answering categorymembers queries."""
+
+    def __init__(self, categories, page_size=2):
+        """Initialise the site with the members of each category."""
+        self.categories = categories
+        self.page_size = page_size
+        self.queries = []
+
+    def api(self, action, **kwargs):
+        """Return a page of members, with a continuation if needed."""
+        self.queries.append(kwargs)
+        category_name = kwargs['cmtitle'].split(':', 1)[1]
+        members = self.categories.get(category_name, [])
+        start = int(kwargs.get('cmcontinue', 0))
+        end = start + self.page_size
+        result = {'query': {'categorymembers': [
+            {'ns': 14 if title.startswith('Category:') else 6, 'title': title}
+            for title in members[start:end]]}}
+        if end < len(members):
+            result['continue'] = {'cmcontinue': str(end), 'continue': '-||'}
+        return result
+
+
+class TestCategory(unittest.TestCase):
+
+    """Testing methods from category."""
+
+    def setUp(self):
+        """Set up a fake site with nested categories."""
+        self.site = FakeSite({
+            'Top': [u'File:A.jpg', u'Category:Sub 1', u'File:B.jpg',
+                    u'Category:Sub 2'],
+            'Sub 1': [u'File:C.jpg', u'File:A.jpg', u'Category:Subsub'],
+            'Sub 2': [u'File:C.jpg', u'Category:Top'],
+            'Subsub': [u'File:D \xe9.jpg'],
+        })
+
+    def test_get_page_name(self):
+        """Test get_page_name."""
+        self.assertEqual(category.get_page_name(u'File:D \xe9.jpg'),
+                         'D \xc3\xa9.jpg')
+
+    def test_list_category_members(self):
+        """Test list_category_members follows the continuations."""
+        output = list(category.list_category_members(self.site, 'Top'))
+        self.assertEqual(len(output), 4)
+        self.assertEqual(output[0], (6, u'File:A.jpg'))
+        self.assertEqual(len(self.site.queries), 2)
+
+    def test_crawl_category(self):
+        """Test crawl_category without subcategories."""
+        output = list(category.crawl_category(self.site, 'Top'))
+        self.assertEqual(output, ['A.jpg', 'B.jpg'])
+
+    def test_crawl_category_with_depth(self):
+        """Test crawl_category deduplicates files across subcategories."""
+        output = list(category.crawl_category(self.site, 'Top', depth=1))
+        self.assertEqual(output, ['A.jpg', 'B.jpg', 'C.jpg'])
+        output = list(category.crawl_category(self.site, 'Top', depth=5))
+        self.assertEqual(output, ['A.jpg', 'B.jpg', 'C.jpg', 'D \xc3\xa9.jpg'])
+
+    def test_crawl_category_with_cycle(self):
+        """Test crawl_category lists each category only once."""
+        list(category.crawl_category(self.site, 'Top', depth=5))
+        listed = [query['cmtitle'] for query in self.site.queries
+                  if 'cmcontinue' not in query]
+        self.assertEqual(sorted(listed), ['Category:Sub 1', 'Category:Sub 2',
+                                          'Category:Subsub', 'Category:Top'])
+
+    def test_walk_category_resumes(self):
+        """Test walk_category resumes after each of its positions."""
+        import json
+        output = list(category.walk_category(self.site, 'Top', depth=5))
+        names = [name for (name, _) in output]
+        self.assertEqual(names, ['A.jpg', 'B.jpg', 'C.jpg', 'D \xc3\xa9.jpg'])
+        for (index, (_, position)) in enumerate(output):
+            position = json.loads(json.dumps(position))
+            resumed = [name for (name, _) in
+                       category.walk_category(self.site, 'Top', depth=5,
+                                              position=position)]
+            done = names[:index + 1]
+            self.assertEqual([name for name in resumed if name not in done],
+                             names[index + 1:])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,10 +3,18 @@
 
 """Unit tests."""
 
-from os.path import dirname, join
+import os
+import sys
+import subprocess
+from os.path import dirname, join, exists
 from StringIO import StringIO
+import argparse
+import tempfile
 import unittest
-from commonsdownloader import commonsdownloader
+from commonsdownloader import (commonsdownloader, objectstore, localthumbnail,
+                               manifest, metrics, journal, scheduler,
+                               thumbnaildownload)
+from fakes import FakeTransport
 
 
 class TestCommonsDownloaderExecutable(unittest.TestCase):
@@ -25,6 +33,45 @@ class TestCommonsDownloaderExecutable(unittest.TestCase):
                           ('Example rotated 90 left.jpg', None)]
         self.assertEqual(output, expected_value)
 
+    def test_get_files_from_textfile_with_several_widths(self):
+        """Test get_files_from_textfile with several widths per line."""
+        lines = ['Example.jpg,120,320\n', 'Example, with comma.jpg,50\n',
+                 'Other.jpg\n']
+        output = list(commonsdownloader.get_files_from_textfile(lines))
+        self.assertEqual(output, [('Example.jpg', 120), ('Example.jpg', 320),
+                                  ('Example, with comma.jpg', 50),
+                                  ('Other.jpg', None)])
+        self.assertTrue(isinstance(output[0][1], thumbnaildownload.NamedWidth))
+        self.assertFalse(isinstance(output[2][1], thumbnaildownload.NamedWidth))
+        output = list(commonsdownloader.get_files_from_textfile(
+            lines[2:], default_widths=[120, 320]))
+        self.assertEqual(output, [('Other.jpg', 120), ('Other.jpg', 320)])
+
+    def test_count_files_in_textfile(self):
+        """Test count_files_in_textfile counts the renditions, and rewinds."""
+        list_path = join(tempfile.mkdtemp(), 'list.txt')
+        with open(list_path, 'w') as f:
+            f.write('Example.jpg\nOther.jpg,120,320\n')
+        with open(list_path) as f:
+            self.assertEqual(commonsdownloader.count_files_in_textfile(
+                f, default_widths=[100, 200, 300]), 5)
+            self.assertEqual(f.readline(), 'Example.jpg\n')
+        self.assertEqual(commonsdownloader.count_files_in_textfile(
+            StringIO('Example.jpg\n')), None)
+
+    def test_parse_widths(self):
+        """Test parse_widths."""
+        self.assertEqual(commonsdownloader.parse_widths('120,320,800'),
+                         [120, 320, 800])
+        with self.assertRaises(argparse.ArgumentTypeError):
+            commonsdownloader.parse_widths('120,big')
+
+    def test_get_renditions(self):
+        """Test get_renditions keeps the renditions of a file together."""
+        output = list(commonsdownloader.get_renditions(['A', 'B'], [120, 320]))
+        expected_value = [('A', 120), ('A', 320), ('B', 120), ('B', 320)]
+        self.assertEqual(output, expected_value)
+
     def test_get_files_from_arguments(self):
         """Test get_files_from_arguments."""
         files_input = ['A', 'B', 'C']
@@ -45,5 +92,267 @@ class TestCommonsDownloaderExecutable(unittest.TestCase):
         expected_value = 'Example.jpg,100\n'
         self.assertEqual(output, expected_value)
 
+    def test_get_files_not_in_manifest(self):
+        """Test get_files_not_in_manifest."""
+        manifest = set([('A', 100), ('B', 50)])
+        files_input = iter([('A', 100), ('B', 100), ('C', 100)])
+        output = list(commonsdownloader.get_files_not_in_manifest(files_input,
+                                                                  manifest))
+        expected_value = [('B', 100), ('C', 100)]
+        self.assertEqual(output, expected_value)
+
+    def test_lazy_imports(self):
+        """Test the optional dependencies are not imported at startup."""
+        code = ('import sys; import commonsdownloader.commonsdownloader; '
+                'print " ".join(name for name in sys.modules '
+                'if sys.modules[name] is not None)')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=join(dirname(__file__), '..'))
+        modules = set(output.split())
+        for name in ['multiprocessing', 'PIL', 'cairosvg', 'gzip', 'bz2',
+                     'email.utils', 'mwclient', 'commonsdownloader.localthumbnail',
+                     'commonsdownloader.objectstore', 'commonsdownloader.journal']:
+            self.assertNotIn(name, modules)
+
+
+class TestDownloadFilesIfNotInManifest(unittest.TestCase):
+
+    """Testing download_files_if_not_in_manifest with a fake transport."""
+
+    def setUp(self):
+        """Set up a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def test_download_files_if_not_in_manifest(self):
+        """Test files are downloaded once, and recorded in manifest."""
+        files = [('A.jpg', 100), ('B.jpg', 100), ('A.jpg', 50)]
+        for jobs in (1, 2):
+            transport = FakeTransport()
+            commonsdownloader.download_files_if_not_in_manifest(
+                iter(files), self.tmpdir, jobs=jobs, transport=transport)
+        self.assertEqual(len(transport.urls), 0)
+        self.assertTrue(exists(join(self.tmpdir, 'A.jpg')))
+        self.assertTrue(exists(join(self.tmpdir, '.manifest.sqlite')))
+
+    def test_download_files_if_not_in_manifest_retries(self):
+        """Test files failing with a transient error are retried."""
+        transport = FakeTransport(failures=1)
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter([('A.jpg', 100), ('B.jpg', 100)]), self.tmpdir,
+            transport=transport)
+        self.assertEqual(len(transport.urls), 3)
+        self.assertTrue(exists(join(self.tmpdir, 'A.jpg')))
+        self.assertTrue(exists(join(self.tmpdir, 'B.jpg')))
+
+    def test_download_files_if_not_in_manifest_with_scheduler(self):
+        """Test files of higher priority are downloaded first, and retried."""
+        transport = FakeTransport(failures=1)
+        files_scheduler = scheduler.Scheduler(priorities={'B.jpg': 1})
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter([('A.jpg', 100), ('B.jpg', 100), ('C.jpg', 100)]), self.tmpdir,
+            jobs=2, transport=transport, scheduler=files_scheduler)
+        self.assertEqual(len(transport.urls), 4)
+        self.assertIn('B.jpg', transport.urls[0])
+        for name in ['A.jpg', 'B.jpg', 'C.jpg']:
+            self.assertTrue(exists(join(self.tmpdir, name)))
+        self.assertEqual(files_scheduler.get_bytes_in_flight(), 0)
+
+    def test_download_leased_files(self):
+        """Test the leased batches are downloaded, skipping files in manifest."""
+        transport = FakeTransport()
+        files = [('A.jpg', 100), ('B.jpg', 100), ('C.jpg', 100)]
+        for index in range(2):
+            store_path = join(tempfile.mkdtemp(), 'leases.sqlite')
+            commonsdownloader.split_job(store_path, iter(files), batch_size=1)
+            commonsdownloader.download_leased_files(store_path, self.tmpdir,
+                                                    transport=transport)
+            self.assertEqual(len(transport.urls), 3)
+        for (name, _) in files:
+            self.assertTrue(exists(join(self.tmpdir, name)))
+
+    def test_download_files_if_not_in_manifest_with_store(self):
+        """Test files in the store are linked rather than downloaded."""
+        store = objectstore.ObjectStore(tempfile.mkdtemp())
+        transport = FakeTransport()
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter([('A.jpg', 100)]), self.tmpdir, store=store,
+            transport=transport)
+        other_folder = tempfile.mkdtemp()
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter([('A.jpg', 100)]), other_folder, store=store,
+            transport=transport)
+        store.close()
+        self.assertEqual(len(transport.urls), 1)
+        self.assertEqual(open(join(other_folder, 'A.jpg')).read(), 'contents')
+
+    def test_download_files_if_not_in_manifest_with_refresh(self):
+        """Test refreshing rewrites only the files which changed."""
+        files = [('A.jpg', 100), ('B.jpg', 100)]
+        transport = FakeTransport(etag='"v1"')
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter(files), self.tmpdir, transport=transport)
+        transport = FakeTransport('new contents', etag='"v2"')
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter(files[:1]), self.tmpdir, transport=transport, refresh=True)
+        transport = FakeTransport('newer contents', etag='"v2"')
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter(files), self.tmpdir, transport=transport, refresh=True)
+        self.assertEqual(len(transport.urls), 2)
+        self.assertEqual(open(join(self.tmpdir, 'A.jpg')).read(), 'new contents')
+        self.assertEqual(open(join(self.tmpdir, 'B.jpg')).read(), 'newer contents')
+
+    def test_download_files_if_not_in_manifest_with_width_in_name(self):
+        """Test the renditions of a file are written side by side."""
+        files = [('A.jpg', 120), ('A.jpg', 320), ('A.jpg', None)]
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter(files), self.tmpdir, jobs=2, transport=FakeTransport(),
+            width_in_name=True)
+        for file_name in ('120px-A.jpg', '320px-A.jpg', 'A.jpg'):
+            self.assertTrue(exists(join(self.tmpdir, file_name)))
+
+    def test_get_files_not_downloaded(self):
+        """Test files past the threshold are reconciled with the output folder."""
+        files = [('A.jpg', 100), ('B.jpg', 100)]
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter(files[:1]), self.tmpdir, transport=FakeTransport())
+        os.remove(join(self.tmpdir, 'A.jpg'))
+        with open(join(self.tmpdir, 'B.jpg'), 'w') as f:
+            f.write('contents')
+        local_manifest = manifest.open_manifest(self.tmpdir)
+        self.assertEqual(list(commonsdownloader.get_files_not_downloaded(
+            iter(files), local_manifest, self.tmpdir, threshold=0)),
+            [('A.jpg', 100)])
+        self.assertEqual(local_manifest.get('B.jpg', 100)[:2], ('B.jpg', 8))
+        self.assertEqual(list(commonsdownloader.get_files_not_downloaded(
+            iter(files), local_manifest, self.tmpdir)), [])
+        local_manifest.close()
+
+    def test_download_files_if_not_in_manifest_with_hashed_layout(self):
+        """Test files are written to their hashed folder, and recorded so."""
+        transport = FakeTransport()
+        for _ in range(2):
+            commonsdownloader.download_files_if_not_in_manifest(
+                iter([('Example.jpg', 100)]), self.tmpdir, transport=transport,
+                layout='hashed')
+        self.assertEqual(len(transport.urls), 1)
+        self.assertTrue(exists(join(self.tmpdir, 'a', 'a9', 'Example.jpg')))
+        local_manifest = manifest.open_manifest(self.tmpdir)
+        self.assertEqual(local_manifest.get('Example.jpg', 100)[0],
+                         join('a', 'a9', 'Example.jpg'))
+        local_manifest.close()
+
+    def test_download_files_if_not_in_manifest_with_metrics(self):
+        """Test the files processed and the stages are recorded in metrics."""
+        files = [('A.jpg', 100), ('B.jpg', 100)]
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter(files[:1]), self.tmpdir, transport=FakeTransport())
+        recorded = metrics.Metrics()
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter(files), self.tmpdir, transport=FakeTransport(failures=1),
+            metrics=recorded)
+        snapshot = recorded.snapshot()
+        self.assertEqual(snapshot['counters']['skipped'], 1)
+        self.assertEqual(snapshot['counters']['retried'], 1)
+        self.assertEqual(snapshot['counters']['downloaded'], 1)
+        self.assertEqual(snapshot['counters']['bytes'], len('contents'))
+        for stage in ('http', 'transfer', 'write', 'manifest'):
+            self.assertTrue(snapshot['stages'][stage]['count'] > 0)
+
+    def test_download_from_file_list_resumes(self):
+        """Test a list is resumed from the journal, after the files done."""
+        list_path = join(self.tmpdir, 'list.txt')
+        with open(list_path, 'w') as f:
+            f.write('A.jpg,100\nB.jpg,100,200\nC.jpg,100\n')
+        path = journal.get_journal_path(self.tmpdir)
+        job = journal.Journal(path, {'list': list_path})
+        with open(list_path) as f:
+            positioned = commonsdownloader.get_positioned_files_from_textfile(f)
+            tracked = job.track(journal.expand_positions(positioned))
+            for (file_name, width) in list(tracked)[:2]:
+                job.complete(file_name, width)
+        job.checkpoint()
+        job.close()
+        transport = FakeTransport()
+        job = journal.Journal(path, {'list': list_path}, resume=True)
+        with open(list_path) as f:
+            commonsdownloader.download_from_file_list(
+                f, self.tmpdir, journal=job, transport=transport)
+        self.assertTrue(job.finished)
+        job.close()
+        self.assertEqual(len(transport.urls), 2)
+        self.assertTrue('file=B.jpg&width=200' in transport.urls[0])
+        self.assertTrue(exists(join(self.tmpdir, 'C.jpg')))
+
+    def test_download_from_file_list_resumes_failures(self):
+        """Test the files which failed are downloaded when the list is resumed."""
+        list_path = join(self.tmpdir, 'list.txt')
+        with open(list_path, 'w') as f:
+            f.write('A.jpg,100\nB.jpg,100\n')
+        path = journal.get_journal_path(self.tmpdir)
+        job = journal.Journal(path, {'list': list_path})
+        with open(list_path) as f:
+            commonsdownloader.download_from_file_list(
+                f, self.tmpdir, journal=job, max_attempts=1,
+                transport=FakeTransport(failures=100))
+        self.assertFalse(job.finished)
+        job.close()
+        transport = FakeTransport()
+        job = journal.Journal(path, {'list': list_path}, resume=True)
+        self.assertFalse(job.finished)
+        with open(list_path) as f:
+            commonsdownloader.download_from_file_list(
+                f, self.tmpdir, journal=job, transport=transport)
+        self.assertTrue(job.finished)
+        job.close()
+        self.assertEqual(len(transport.urls), 2)
+        self.assertTrue(exists(join(self.tmpdir, 'A.jpg')))
+
+    def test_download_from_file_list_with_several_widths(self):
+        """Test the renditions of a line with several widths are told apart."""
+        transport = FakeTransport()
+        commonsdownloader.download_from_file_list(
+            StringIO('A.jpg,120,320\nB.jpg\nC.jpg,50\n'), self.tmpdir,
+            transport=transport)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['.manifest.sqlite', '120px-A.jpg', '320px-A.jpg',
+                          'B.jpg', 'C.jpg'])
+        commonsdownloader.download_from_file_list(
+            StringIO('A.jpg,120,320\nB.jpg\nC.jpg,50\n'), self.tmpdir,
+            transport=transport)
+        self.assertEqual(len(transport.urls), 4)
+
+    @unittest.skipIf(localthumbnail.Image is None, 'Pillow is not installed')
+    def test_download_files_if_not_in_manifest_rendering_locally(self):
+        """Test thumbnails of full size files are rendered locally."""
+        image = StringIO()
+        localthumbnail.Image.new('RGB', (400, 200)).save(image, 'JPEG')
+        transport = FakeTransport(image.getvalue())
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter([('A.jpg', None)]), self.tmpdir, transport=transport)
+        thumbnailer = localthumbnail.LocalThumbnailer(processes=2)
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter([('A.jpg', 120), ('A.jpg', 320)]), self.tmpdir,
+            transport=transport, thumbnailer=thumbnailer, width_in_name=True)
+        thumbnailer.close()
+        self.assertEqual(len(transport.urls), 1)
+        self.assertEqual(localthumbnail.Image.open(join(self.tmpdir, '120px-A.jpg')).size,
+                         (120, 60))
+
+    @unittest.skipIf(localthumbnail.Image is None, 'Pillow is not installed')
+    def test_download_files_if_not_in_manifest_rendering_failing(self):
+        """Test thumbnails which cannot be rendered are reported as failed."""
+        transport = FakeTransport('not an image')
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter([('A.jpg', None)]), self.tmpdir, transport=transport)
+        thumbnailer = localthumbnail.LocalThumbnailer(processes=2)
+        results = []
+        commonsdownloader.download_files_if_not_in_manifest(
+            iter([('A.jpg', 120)]), self.tmpdir, transport=transport,
+            thumbnailer=thumbnailer, width_in_name=True,
+            on_result=lambda *result: results.append(result[:3]))
+        thumbnailer.close()
+        self.assertEqual(results, [('A.jpg', 120, 'failed')])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import time
+import tempfile
+import unittest
+import threading
+import multiprocessing
+from os.path import join
+from commonsdownloader import coordinator
+from commonsdownloader.thumbnaildownload import NamedWidth
+
+
+def run_worker(store_path, output_path, owner):
+    """Run a worker recording the files it is given, for several processes."""
+    store = coordinator.LeaseStore(store_path)
+
+    def download_batch(files):
+        with open(output_path, 'a') as f:
+            for (file_name, width) in files:
+                f.write('%s,%s\n' % (file_name, width))
+                time.sleep(0.001)
+    coordinator.work(store, download_batch, owner=owner, poll_interval=0.01)
+    store.close()
+
+
+class TestLeaseStore(unittest.TestCase):
+
+    """Testing the LeaseStore."""
+
+    def setUp(self):
+        """Open a store in a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = join(self.tmpdir, 'leases.sqlite')
+        self.store = coordinator.LeaseStore(self.path)
+        self.files = [('File %s.jpg' % index, 100) for index in range(10)]
+
+    def tearDown(self):
+        """Close the store."""
+        self.store.close()
+
+    def test_add_batches(self):
+        """Test the files are split into batches, and the store marked complete."""
+        self.assertTrue(self.store.is_empty())
+        self.assertEqual(self.store.add_batches(iter(self.files), batch_size=4), 3)
+        self.assertFalse(self.store.is_empty())
+        self.assertEqual(self.store.get_progress(),
+                         {'pending': 3, 'leased': 0, 'done': 0})
+
+    def test_lease_and_complete(self):
+        """Test each batch is leased once, until the job is finished."""
+        self.store.add_batches(iter(self.files), batch_size=5)
+        (first_id, first) = self.store.lease('a')
+        (second_id, second) = self.store.lease('b')
+        self.assertEqual(first + second, self.files)
+        self.assertEqual(self.store.lease('c'), None)
+        self.assertTrue(self.store.complete(first_id, 'a'))
+        self.assertFalse(self.store.complete(second_id, 'a'))
+        self.assertFalse(self.store.is_finished())
+        self.assertTrue(self.store.complete(second_id, 'b'))
+        self.assertTrue(self.store.is_finished())
+
+    def test_lease_named_widths(self):
+        """Test the widths files are named after are leased as such."""
+        self.store.add_batches(iter([('A.jpg', NamedWidth(120)), ('A.jpg', None),
+                                     ('B.jpg', 50)]))
+        (_, files) = self.store.lease('a')
+        self.assertEqual(files, [('A.jpg', 120), ('A.jpg', None), ('B.jpg', 50)])
+        self.assertEqual([isinstance(width, NamedWidth) for (_, width) in files],
+                         [True, False, False])
+
+    def test_expired_lease(self):
+        """Test expired leases are taken over, and lost by their owner."""
+        self.store.add_batches(iter(self.files), batch_size=10)
+        (batch_id, _) = self.store.lease('a', duration=-1)
+        self.assertEqual(self.store.lease('b')[0], batch_id)
+        self.assertFalse(self.store.renew(batch_id, 'a'))
+        self.assertFalse(self.store.complete(batch_id, 'a'))
+        self.assertTrue(self.store.renew(batch_id, 'b'))
+        self.assertTrue(self.store.complete(batch_id, 'b'))
+
+    def test_release(self):
+        """Test released batches can be leased again right away."""
+        self.store.add_batches(iter(self.files), batch_size=10)
+        (batch_id, _) = self.store.lease('a')
+        self.store.release(batch_id, 'a')
+        self.assertEqual(self.store.lease('b')[0], batch_id)
+
+
+class TestWork(unittest.TestCase):
+
+    """Testing work."""
+
+    def setUp(self):
+        """Split a job into a store in a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = join(self.tmpdir, 'leases.sqlite')
+        self.files = [('File %s.jpg' % index, 100) for index in range(200)]
+        store = coordinator.LeaseStore(self.path)
+        store.add_batches(iter(self.files), batch_size=7)
+        store.close()
+
+    def test_work_in_threads(self):
+        """Test workers share the job, without any file done twice."""
+        done = []
+
+        def run(owner):
+            store = coordinator.LeaseStore(self.path)
+            coordinator.work(store, lambda files: done.extend(files),
+                             owner=owner, poll_interval=0.01)
+            store.close()
+        threads = [threading.Thread(target=run, args=('worker %s' % index,))
+                   for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(done), sorted(self.files))
+
+    def test_work_in_processes(self):
+        """Test workers in several processes share the job."""
+        outputs = [join(self.tmpdir, 'worker%s.txt' % index) for index in range(3)]
+        processes = [multiprocessing.Process(target=run_worker,
+                                             args=(self.path, output, output))
+                     for output in outputs]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        done = []
+        for output in outputs:
+            with open(output) as f:
+                done.extend(tuple(line.strip().rsplit(',', 1)) for line in f)
+        self.assertEqual(sorted(done),
+                         sorted((name, str(width)) for (name, width) in self.files))
+
+    def test_work_releases_failed_batches(self):
+        """Test a batch whose download raised is given back."""
+        store = coordinator.LeaseStore(self.path)
+
+        def fail(files):
+            raise IOError('Disk full')
+        self.assertRaises(IOError, coordinator.work, store, fail, owner='a')
+        self.assertEqual(store.get_progress()['leased'], 0)
+        store.close()
+
+    def test_guard_stops_when_lost(self):
+        """Test the files of a lost lease are no longer yielded."""
+        renewer = coordinator.LeaseRenewer(None, 1, 'a')
+        files = renewer.guard(iter(self.files))
+        next(files)
+        renewer.lost.set()
+        self.assertEqual(list(files), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
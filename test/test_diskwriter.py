@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import os
+import tempfile
+import unittest
+from os.path import join
+from commonsdownloader import diskwriter
+
+
+class DiskWriterTestMixin(object):
+
+    """Tests common to the DirectFile and the DiskWriter."""
+
+    def setUp(self):
+        """Set up a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = join(self.tmpdir, '.Example.jpg.part')
+        self.output_file = join(self.tmpdir, 'Example.jpg')
+
+    def test_write(self):
+        """Test the chunks are written in order, and the file renamed."""
+        f = self.open_file(self.path)
+        for chunk in ('a', 'b', 'c'):
+            f.write(chunk)
+        f.close(rename_to=self.output_file)
+        self.assertEqual(open(self.output_file).read(), 'abc')
+        self.assertEqual(os.listdir(self.tmpdir), ['Example.jpg'])
+
+    def test_append(self):
+        """Test the chunks are appended to an existing file."""
+        with open(self.path, 'w') as f:
+            f.write('abc')
+        f = self.open_file(self.path, append=True)
+        f.write('def')
+        f.close()
+        self.assertEqual(open(self.path).read(), 'abcdef')
+
+    def test_call(self):
+        """Test calls are made once the previous chunks are written."""
+        sizes = []
+        f = self.open_file(self.path)
+        f.write('abc')
+        f.call(lambda: sizes.append(os.path.getsize(self.path)))
+        f.write('def')
+        f.abort()
+        self.assertEqual(sizes, [3])
+        self.assertEqual(open(self.path).read(), 'abcdef')
+
+
+class TestDirectFile(DiskWriterTestMixin, unittest.TestCase):
+
+    """Testing the DirectFile."""
+
+    def open_file(self, path, append=False):
+        """Return a DirectFile."""
+        return diskwriter.open_output_file(path, append=append)
+
+
+class TestDiskWriter(DiskWriterTestMixin, unittest.TestCase):
+
+    """Testing the DiskWriter."""
+
+    def setUp(self):
+        """Start a writer."""
+        DiskWriterTestMixin.setUp(self)
+        self.writer = diskwriter.DiskWriter(threads=2, queue_size=2,
+                                            fsync='batch', fsync_batch=2)
+
+    def tearDown(self):
+        """Stop the writer."""
+        self.writer.close()
+
+    def open_file(self, path, append=False):
+        """Return a WriterFile."""
+        return diskwriter.open_output_file(path, append=append,
+                                           writer=self.writer)
+
+    def test_error(self):
+        """Test an error on the writer thread is raised again."""
+        f = self.open_file(join(self.tmpdir, 'missing', 'Example.jpg'))
+        with self.assertRaises(IOError):
+            for _ in range(10):
+                f.write('abc')
+            f.close(rename_to=self.output_file)
+        f.abort()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_several_files(self):
+        """Test several files are written at the same time."""
+        files = [self.open_file(join(self.tmpdir, '.%s.part' % index))
+                 for index in range(5)]
+        for _ in range(10):
+            for f in files:
+                f.write('abc')
+        for (index, f) in enumerate(files):
+            f.close(rename_to=join(self.tmpdir, str(index)))
+        for index in range(5):
+            self.assertEqual(open(join(self.tmpdir, str(index))).read(), 'abc' * 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
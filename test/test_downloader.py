@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import os
+from os.path import join, exists
+import tempfile
+import unittest
+from commonsdownloader import downloader, httpclient
+from fakes import FakeTransport
+
+
+class TestDownloader(unittest.TestCase):
+
+    """Testing the Downloader session."""
+
+    def setUp(self):
+        """Create an output folder."""
+        self.output_path = tempfile.mkdtemp()
+
+    def test_download_many(self):
+        """Test download_many, with names and (name, width) tuples."""
+        transport = FakeTransport(missing=['Missing.jpg'])
+        with downloader.Downloader(transport=transport, width=120) as session:
+            results = list(session.download_many(
+                ['Example.jpg', ('Other.jpg', 240), 'Missing.jpg'],
+                self.output_path))
+        by_name = dict((result.file_name, result) for result in results)
+        self.assertEqual(sorted(by_name), ['Example.jpg', 'Missing.jpg', 'Other.jpg'])
+        self.assertEqual(by_name['Example.jpg'].status, 'downloaded')
+        self.assertEqual(by_name['Example.jpg'].width, 120)
+        self.assertEqual(by_name['Other.jpg'].width, 240)
+        self.assertTrue(exists(by_name['Other.jpg'].downloaded.path))
+        self.assertEqual(by_name['Missing.jpg'].status, 'failed')
+        self.assertTrue(by_name['Missing.jpg'].error)
+        self.assertFalse(transport.closed)
+
+    def test_download_skips_files_in_manifest(self):
+        """Test that a session downloads each file once across calls."""
+        transport = FakeTransport()
+        session = downloader.Downloader(transport=transport)
+        first = session.download('Example.jpg', self.output_path)
+        second = session.download('Example.jpg', self.output_path)
+        self.assertEqual(first.status, 'downloaded')
+        self.assertEqual(os.path.basename(first.downloaded.path), 'Example.jpg')
+        self.assertEqual(second.status, 'skipped')
+        self.assertEqual(len(transport.urls), 1)
+        self.assertEqual(session.metrics.snapshot()['counters']['skipped'], 1)
+
+    def test_download_many_raises_errors(self):
+        """Test that errors stopping the downloads are raised."""
+        session = downloader.Downloader(transport=FakeTransport())
+        results = session.download_many(['Example.jpg'],
+                                        join(self.output_path, 'missing', 'folder'))
+        self.assertRaises(Exception, list, results)
+
+    def test_close_owned_transport(self):
+        """Test that the session closes the transport it created."""
+        session = downloader.Downloader()
+        self.assertTrue(isinstance(session.transport, httpclient.ConnectionPool))
+        session.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import bz2
+import gzip
+import tempfile
+import unittest
+from os.path import join
+from commonsdownloader import filelist
+
+
+class TestFileList(unittest.TestCase):
+
+    """Testing methods from filelist."""
+
+    contents = 'Example.jpg,100\nOther.jpg\n'
+
+    def setUp(self):
+        """Set up a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def test_open_file_list(self):
+        """Test open_file_list reads plain and compressed lists."""
+        path = join(self.tmpdir, 'list.txt')
+        with open(path, 'w') as f:
+            f.write(self.contents)
+        with gzip.open(path + '.gz', 'wb') as f:
+            f.write(self.contents)
+        with open(path + '.bz2', 'wb') as f:
+            f.write(bz2.compress(self.contents))
+        for file_path in (path, path + '.gz', path + '.bz2'):
+            self.assertEqual(list(filelist.open_file_list(file_path)),
+                             ['Example.jpg,100\n', 'Other.jpg\n'])
+
+    def test_parse_shard(self):
+        """Test parse_shard."""
+        self.assertEqual(filelist.parse_shard('2/8'), (2, 8))
+        for value in ('0/8', '9/8', '2', 'a/b'):
+            with self.assertRaises(ValueError):
+                filelist.parse_shard(value)
+
+    def test_get_shard(self):
+        """Test get_shard is stable and ignores spaces and underscores."""
+        self.assertEqual(filelist.get_shard('My Example.jpg', 8),
+                         filelist.get_shard('My_Example.jpg', 8))
+        self.assertEqual(filelist.get_shard(u'My Example.jpg', 8),
+                         filelist.get_shard('My_Example.jpg', 8))
+        self.assertEqual(filelist.get_shard('Example.jpg', 8), 8)
+
+    def test_filter_shard(self):
+        """Test the shards split the files with no overlap."""
+        files = [('File %s.jpg' % i, width) for i in range(100) for width in (120, 320)]
+        shards = [list(filelist.filter_shard(iter(files), (index, 4)))
+                  for index in range(1, 5)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(files))
+        for files_in_shard in shards:
+            self.assertTrue(files_in_shard)
+            self.assertEqual(len(files_in_shard) % 2, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import time
+import urllib2
+import threading
+import unittest
+from stubserver import StubServer
+from commonsdownloader import httpclient
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    """Testing the ConnectionPool against a local stub server."""
+
+    def setUp(self):
+        """Start a stub server."""
+        def slow(handler):
+            time.sleep(0.2)
+            return (200, {}, 'Slow')
+
+        routes = {
+            '/file': (200, {'Content-Type': 'image/jpeg'}, 'Contents'),
+            '/redirect': (302, {'Location': '/file'}, ''),
+            '/missing': (404, {}, 'The source file does not exist'),
+            '/slow': slow,
+        }
+        self.server = StubServer(routes)
+        self.server.start()
+        self.pool = httpclient.ConnectionPool(max_per_host=2)
+
+    def tearDown(self):
+        """Stop the stub server."""
+        self.pool.close()
+        self.server.stop()
+
+    def test_urlopen(self):
+        """Test urlopen returns the body and headers."""
+        response = self.pool.urlopen(self.server.base_url + '/file')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers.subtype, 'jpeg')
+        self.assertEqual(response.read(), 'Contents')
+
+    def test_urlopen_reuses_connection(self):
+        """Test urlopen keeps the connection alive across requests."""
+        for _ in range(5):
+            self.pool.urlopen(self.server.base_url + '/file').read()
+        self.assertEqual(self.server.connections, 1)
+
+    def test_urlopen_follows_redirections(self):
+        """Test urlopen follows redirections on the same connection."""
+        response = self.pool.urlopen(self.server.base_url + '/redirect')
+        self.assertEqual(response.read(), 'Contents')
+        self.assertEqual(response.geturl(), self.server.base_url + '/file')
+        self.assertEqual(self.server.connections, 1)
+
+    def test_urlopen_with_error(self):
+        """Test urlopen raises HTTPError with the body of the error."""
+        with self.assertRaises(urllib2.HTTPError) as context:
+            self.pool.urlopen(self.server.base_url + '/missing')
+        self.assertEqual(context.exception.code, 404)
+        self.assertEqual(context.exception.fp.read(),
+                         'The source file does not exist')
+
+    def test_urlopen_caps_requests_per_host(self):
+        """Test urlopen has at most max_per_host requests in flight."""
+        def fetch():
+            self.pool.urlopen(self.server.base_url + '/slow').read()
+
+        threads = [threading.Thread(target=fetch) for _ in range(4)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.time() - start, 0.4)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_urlopen_with_unreachable_host(self):
+        """Test urlopen raises URLError when the host cannot be reached."""
+        self.server.stop()
+        with self.assertRaises(urllib2.URLError):
+            self.pool.urlopen(self.server.base_url + '/file')
+        self.server = StubServer()
+        self.server.start()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import json
+import tempfile
+import urlparse
+import unittest
+from os.path import join
+from StringIO import StringIO
+from commonsdownloader import imageinfo, titlecache
+from commonsdownloader.thumbnaildownload import DownloadException
+
+
+def make_api_response(titles, width=None):
+    """Return an imageinfo API response for the given titles."""
+    pages = {}
+    normalized = []
+    for (index, title) in enumerate(titles):
+        page_title = title.replace('_', ' ')
+        if page_title != title:
+            normalized.append({'from': title, 'to': page_title})
+        if 'Missing' in title:
+            pages[str(-index - 1)] = {'title': page_title, 'missing': ''}
+            continue
+        info = {'url': 'https://upload.example/%s' % title,
+                'mime': 'image/jpeg', 'width': 800, 'height': 600,
+                'size': 1234, 'sha1': 'abc'}
+        if width is not None:
+            info.update({'thumburl': 'https://upload.example/%spx-%s' % (width, title),
+                         'thumbmime': 'image/jpeg'})
+        pages[str(index + 1)] = {'title': page_title, 'imageinfo': [info]}
+    return {'query': {'normalized': normalized, 'pages': pages}}
+
+
+class FakeAPITransport(object):
+
+    """A fake transport answering imageinfo queries."""
+
+    def __init__(self):
+        """Initialise the transport."""
+        self.queries = []
+
+    def urlopen(self, url, headers=None):
+        """Return an API response to the given URL."""
+        params = urlparse.parse_qs(urlparse.urlsplit(url).query)
+        titles = params['titles'][0].split('|')
+        width = params.get('iiurlwidth', [None])[0]
+        self.queries.append((titles, width))
+        return StringIO(json.dumps(make_api_response(titles, width)))
+
+
+class TestFileInfo(unittest.TestCase):
+
+    """Testing the FileInfo."""
+
+    def setUp(self):
+        """Set up a FileInfo."""
+        self.file_info = imageinfo.FileInfo(
+            title='File:Example.jpg', url='full', mime='image/jpeg',
+            width=800, height=600, size=1234, sha1='abc',
+            thumb_url='thumb', thumb_mime='image/png')
+
+    def test_get_url_and_mime(self):
+        """Test get_url_and_mime."""
+        values = [(100, ('thumb', 'image/png')),
+                  (800, ('full', 'image/jpeg')),
+                  (1000, ('full', 'image/jpeg')),
+                  (None, ('full', 'image/jpeg'))]
+        for (input_value, expected_value) in values:
+            self.assertEqual(self.file_info.get_url_and_mime(input_value),
+                             expected_value)
+
+    def test_get_thumb_url(self):
+        """Test get_thumb_url derives the URL of other widths."""
+        values = [('https://upload/thumb/a/ab/Example.jpg/120px-Example.jpg',
+                   'https://upload/thumb/a/ab/Example.jpg/800px-Example.jpg'),
+                  ('https://upload/thumb/a/ab/Example.tif/lossy-page1-120px-Example.tif.jpg',
+                   'https://upload/thumb/a/ab/Example.tif/lossy-page1-800px-Example.tif.jpg'),
+                  ('thumb', 'thumb')]
+        for (thumb_url, expected_value) in values:
+            file_info = self.file_info._replace(thumb_url=thumb_url)
+            self.assertEqual(file_info.get_thumb_url(800), expected_value)
+
+    def test_get_url_and_mime_of_vector_file(self):
+        """Test get_url_and_mime with a width bigger than a SVG source."""
+        file_info = self.file_info._replace(mime='image/svg+xml')
+        self.assertEqual(file_info.get_url_and_mime(1000),
+                         ('thumb', 'image/png'))
+
+
+class TestImageInfo(unittest.TestCase):
+
+    """Testing methods from imageinfo."""
+
+    def test_make_file_title(self):
+        """Test make_file_title."""
+        self.assertEqual(imageinfo.make_file_title(' My Example.jpg'),
+                         'File:My_Example.jpg')
+
+    def test_make_imageinfo_url(self):
+        """Test make_imageinfo_url."""
+        output = imageinfo.make_imageinfo_url(['File:A.jpg', 'File:B&C.jpg'], 100)
+        params = urlparse.parse_qs(urlparse.urlsplit(output).query)
+        self.assertEqual(params['titles'], ['File:A.jpg|File:B&C.jpg'])
+        self.assertEqual(params['iiurlwidth'], ['100'])
+        self.assertEqual(params['prop'], ['imageinfo'])
+
+    def test_parse_imageinfo_response(self):
+        """Test parse_imageinfo_response."""
+        data = make_api_response(['File:My_Example.jpg', 'File:Missing.jpg'], 100)
+        (files_info, title_mapping) = imageinfo.parse_imageinfo_response(data)
+        self.assertEqual(title_mapping,
+                         {'File:My_Example.jpg': 'File:My Example.jpg'})
+        self.assertIsNone(files_info['File:Missing.jpg'])
+        info = files_info['File:My Example.jpg']
+        self.assertEqual(info.thumb_url,
+                         'https://upload.example/100px-File:My_Example.jpg')
+        self.assertEqual(info.width, 800)
+        self.assertIsInstance(info.url, str)
+
+    def test_parse_imageinfo_response_with_error(self):
+        """Test parse_imageinfo_response with an API error."""
+        data = {'error': {'code': 'toomanyvalues', 'info': 'Too many values'}}
+        with self.assertRaises(DownloadException):
+            imageinfo.parse_imageinfo_response(data)
+
+    def test_resolve_title(self):
+        """Test resolve_title follows normalizations and redirects."""
+        title_mapping = {'File:A_b.jpg': 'File:A b.jpg', 'File:A b.jpg': 'File:C.jpg'}
+        self.assertEqual(imageinfo.resolve_title('File:A_b.jpg', title_mapping),
+                         'File:C.jpg')
+
+    def test_iterate_batches(self):
+        """Test iterate_batches counts the widths of a file as one title."""
+        files = [('A.jpg', 100), ('A.jpg', 200), ('B.jpg', 100), ('C.jpg', 100)]
+        self.assertEqual(list(imageinfo.iterate_batches(files, batch_size=2)),
+                         [files[:3], files[3:]])
+
+    def test_resolve_files(self):
+        """Test resolve_files batches the titles."""
+        transport = FakeAPITransport()
+        files = [('File %s.jpg' % i, 100) for i in range(120)]
+        files.append(('Missing.jpg', 100))
+        files.append(('Other.jpg', 50))
+        output = list(imageinfo.resolve_files(files, transport=transport))
+        self.assertEqual([(name, width) for (name, width, _) in output], files)
+        self.assertEqual(output[0][2].get_url_and_mime(100)[0],
+                         'https://upload.example/100px-File:File_0.jpg')
+        self.assertIsNone(output[120][2])
+        self.assertEqual([(len(titles), width) for (titles, width) in transport.queries],
+                         [(50, '100'), (50, '100'), (22, '50')])
+
+    def test_resolve_files_with_several_widths(self):
+        """Test resolve_files resolves each title once for all its widths."""
+        transport = FakeAPITransport()
+        files = [('Example.jpg', width) for width in (320, 120, 800, None)]
+        output = list(imageinfo.resolve_files(files, transport=transport))
+        self.assertEqual(transport.queries, [(['File:Example.jpg'], '120')])
+        self.assertEqual([info.get_url_and_mime(width)[0]
+                          for (_, width, info) in output],
+                         ['https://upload.example/320px-File:Example.jpg',
+                          'https://upload.example/120px-File:Example.jpg',
+                          'https://upload.example/File:Example.jpg',
+                          'https://upload.example/File:Example.jpg'])
+
+    def test_resolve_files_with_cache(self):
+        """Test resolve_files only queries the titles which are not in cache."""
+        cache = titlecache.TitleCache(join(tempfile.mkdtemp(), 'titles.sqlite'))
+        files = [('Example.jpg', None), ('Missing.jpg', None)]
+        list(imageinfo.resolve_files(files, transport=FakeAPITransport(),
+                                     cache=cache))
+        transport = FakeAPITransport()
+        files.append(('Other.jpg', None))
+        output = list(imageinfo.resolve_files(files, transport=transport,
+                                              cache=cache))
+        self.assertEqual(transport.queries, [(['File:Other.jpg'], None)])
+        self.assertEqual(output[0][2].url, 'https://upload.example/File:Example.jpg')
+        self.assertIsNone(output[1][2])
+        transport = FakeAPITransport()
+        list(imageinfo.resolve_files([('Example.jpg', 100)], transport=transport,
+                                     cache=cache))
+        self.assertEqual(transport.queries, [(['File:Example.jpg'], '100')])
+        cache.close()
+
+    def test_resolve_files_is_lazy(self):
+        """Test resolve_files only queries the API when needed."""
+        transport = FakeAPITransport()
+        files = ((('File %s.jpg' % i, 100) for i in range(120)))
+        output = imageinfo.resolve_files(files, transport=transport)
+        next(output)
+        self.assertEqual(len(transport.queries), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
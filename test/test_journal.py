@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import sqlite3
+import tempfile
+import unittest
+from os.path import join
+from commonsdownloader import journal
+
+
+class TestExpandPositions(unittest.TestCase):
+
+    """Testing expand_positions."""
+
+    def setUp(self):
+        """Set up records of a source."""
+        self.records = [('A.jpg', [100, 200], 10), ('B.jpg', [], 20)]
+
+    def test_expand_positions(self):
+        """Test the cursors after each width of the records."""
+        output = list(journal.expand_positions(self.records, default_widths=[50]))
+        self.assertEqual(output, [('A.jpg', 100, (None, 1)),
+                                  ('A.jpg', 200, (10, 0)),
+                                  ('B.jpg', 50, (20, 0))])
+
+    def test_expand_positions_from_cursor(self):
+        """Test that the widths done of the first record are skipped."""
+        output = list(journal.expand_positions(self.records, cursor=(0, 1)))
+        self.assertEqual(output, [('A.jpg', 200, (10, 0)),
+                                  ('B.jpg', None, (20, 0))])
+
+
+class TestJournal(unittest.TestCase):
+
+    """Testing the Journal."""
+
+    def setUp(self):
+        """Set up the path of a journal."""
+        self.path = join(tempfile.mkdtemp(), '.journal.sqlite')
+        self.description = {'list': '/tmp/list.txt', 'widths': [100]}
+        self.files = [('A.jpg', 100, (1, 0)), ('B.jpg', 100, (2, 0)),
+                      ('C.jpg', 100, (3, 0)), ('D.jpg', 100, (4, 0))]
+
+    def test_get_journal_path(self):
+        """Test get_journal_path, with and without shard."""
+        self.assertEqual(journal.get_journal_path('/tmp'), '/tmp/.journal.sqlite')
+        self.assertEqual(journal.get_journal_path('/tmp', (2, 4)),
+                         '/tmp/.journal.2-of-4.sqlite')
+
+    def test_track_out_of_order(self):
+        """Test the cursor only moves past files done in order."""
+        job = journal.Journal(self.path, self.description)
+        output = list(job.track(iter(self.files)))
+        self.assertEqual(output, [(name, width) for (name, width, _) in self.files])
+        job.complete('B.jpg', 100)
+        self.assertEqual(job.cursor, None)
+        job.complete('A.jpg', 100)
+        self.assertEqual(job.cursor, (2, 0))
+        job.complete('D.jpg', 100)
+        job.checkpoint()
+        self.assertFalse(job.finished)
+        job.close()
+
+        resumed = journal.Journal(self.path, self.description, resume=True)
+        self.assertEqual(resumed.cursor, [2, 0])
+        self.assertEqual(resumed.position, 2)
+        output = list(resumed.track(iter(self.files[2:])))
+        self.assertEqual(output, [('C.jpg', 100)])
+        resumed.complete('C.jpg', 100)
+        resumed.checkpoint()
+        self.assertTrue(resumed.finished)
+        resumed.close()
+
+    def test_checkpoint_incremental(self):
+        """Test only the files done beyond the cursor are kept in the journal."""
+        job = journal.Journal(self.path, self.description)
+        list(job.track(iter(self.files)))
+        job.complete('B.jpg', 100)
+        job.complete('D.jpg', 100)
+        job.checkpoint()
+        self.assertEqual(self.get_done(), [('B.jpg', 100), ('D.jpg', 100)])
+        job.complete('A.jpg', 100)
+        job.checkpoint()
+        self.assertEqual(self.get_done(), [('D.jpg', 100)])
+        job.close()
+
+        resumed = journal.Journal(self.path, self.description, resume=True)
+        self.assertEqual(resumed.cursor, [2, 0])
+        output = list(resumed.track(iter(self.files[2:])))
+        self.assertEqual(output, [('C.jpg', 100)])
+        resumed.checkpoint()
+        self.assertEqual(self.get_done(), [('D.jpg', 100)])
+        resumed.complete('C.jpg', 100)
+        resumed.checkpoint()
+        self.assertEqual(self.get_done(), [])
+        self.assertTrue(resumed.finished)
+        resumed.close()
+
+    def get_done(self):
+        """Return the files recorded as done in the journal."""
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(
+                'SELECT file_name, width FROM done ORDER BY file_name').fetchall()
+        finally:
+            connection.close()
+
+    def test_track_shard(self):
+        """Test the files of other shards are done right away."""
+        job = journal.Journal(self.path, self.description)
+        output = list(job.track(iter(self.files), shard=(1, 2)))
+        for (name, width) in output:
+            job.complete(name, width)
+        job.checkpoint()
+        self.assertTrue(job.finished)
+        self.assertTrue(0 < len(output) < len(self.files))
+        job.close()
+
+    def test_checkpoint_syncs(self):
+        """Test the files recorded are flushed before each checkpoint."""
+        synced = []
+        job = journal.Journal(self.path, self.description)
+        list(job.track(iter(self.files), sync=lambda: synced.append(True)))
+        job.checkpoint()
+        self.assertEqual(synced, [True])
+        job.close()
+
+    def test_resume_other_job(self):
+        """Test that resuming the journal of another job is refused."""
+        journal.Journal(self.path, self.description).close()
+        self.assertRaises(ValueError, journal.Journal, self.path,
+                          {'category': 'Other'}, resume=True)
+
+    def test_restart(self):
+        """Test that the journal is reset unless resuming."""
+        job = journal.Journal(self.path, self.description)
+        list(job.track(iter(self.files)))
+        job.complete('A.jpg', 100)
+        job.checkpoint()
+        job.close()
+        restarted = journal.Journal(self.path, self.description)
+        self.assertEqual(restarted.cursor, None)
+        restarted.close()
+        resumed = journal.Journal(self.path, self.description, resume=True)
+        self.assertEqual(resumed.cursor, None)
+        resumed.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import os
+import tempfile
+import unittest
+from os.path import join, exists
+from commonsdownloader import layout, manifest
+
+
+class TestLayoutFunctions(unittest.TestCase):
+
+    """Testing functions from layout."""
+
+    def setUp(self):
+        """Set up a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def test_get_hash_path(self):
+        """Test get_hash_path follows the upload paths of Commons."""
+        self.assertEqual(layout.get_hash_path('Example.jpg'), join('a', 'a9'))
+        self.assertEqual(layout.get_hash_path('Example .jpg'),
+                         layout.get_hash_path('Example_.jpg'))
+
+    def test_get_output_directory(self):
+        """Test get_output_directory creates the hashed folders."""
+        self.assertEqual(layout.get_output_directory(self.tmpdir, 'Example.jpg'),
+                         self.tmpdir)
+        directory = layout.get_output_directory(self.tmpdir, 'Example.jpg', 'hashed')
+        self.assertEqual(directory, join(self.tmpdir, 'a', 'a9'))
+        self.assertTrue(os.path.isdir(directory))
+        self.assertEqual(layout.get_output_directory(self.tmpdir, 'Example.jpg',
+                                                     'hashed'), directory)
+
+    def test_get_candidate_names(self):
+        """Test get_candidate_names."""
+        values = [(('My Example.jpg', 100), ['My_Example.jpg']),
+                  (('Example.svg', 100), ['Example.svg', 'Example.png']),
+                  (('Example.svg', None), ['Example.svg'])]
+        for (input_value, expected_value) in values:
+            self.assertEqual(list(layout.get_candidate_names(*input_value)),
+                             expected_value)
+        self.assertEqual(list(layout.get_candidate_names('Example.tif', 100,
+                                                         width_in_name=True)),
+                         ['100px-Example.tif', '100px-Example.jpg'])
+
+    def test_get_candidate_paths(self):
+        """Test get_candidate_paths."""
+        self.assertEqual(list(layout.get_candidate_paths('Example.jpg', 100,
+                                                         layout='hashed')),
+                         [join('a', 'a9', 'Example.jpg')])
+
+    def test_list_output_files(self):
+        """Test list_output_files lists the folders of the layout only."""
+        for name in ('Example.jpg', '.manifest.sqlite', '.Other.jpg.part'):
+            open(join(self.tmpdir, name), 'w').close()
+        self.assertEqual(list(layout.list_output_files(self.tmpdir)),
+                         ['Example.jpg'])
+        directory = layout.get_output_directory(self.tmpdir, 'Example.jpg', 'hashed')
+        open(join(directory, 'Example.jpg'), 'w').close()
+        self.assertEqual(list(layout.list_output_files(self.tmpdir, 'hashed')),
+                         [join('a', 'a9', 'Example.jpg')])
+
+
+class TestMigrateLayout(unittest.TestCase):
+
+    """Testing migrate_layout."""
+
+    def setUp(self):
+        """Set up a flat folder with its manifest."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.manifest = manifest.SQLiteManifest(self.tmpdir)
+        for name in ('Example.jpg', '100px-Example.png', 'Migrated.jpg', 'Unknown.jpg'):
+            open(join(self.tmpdir, name), 'w').close()
+        self.manifest.add('Example.jpg', None, path='Example.jpg')
+        self.manifest.add('Example.jpg', 100, path='100px-Example.png')
+        self.manifest.add('Migrated.jpg', None)
+        self.manifest.add('Missing.jpg', None, path='Missing.jpg')
+
+    def tearDown(self):
+        """Close the manifest."""
+        self.manifest.close()
+
+    def test_migrate_layout(self):
+        """Test files are moved back and forth, and their paths recorded."""
+        self.assertEqual(layout.migrate_layout(self.manifest, self.tmpdir, 'hashed'), 3)
+        hashed_path = join('a', 'a9', 'Example.jpg')
+        self.assertTrue(exists(join(self.tmpdir, hashed_path)))
+        self.assertTrue(exists(join(self.tmpdir, 'a', 'a9', '100px-Example.png')))
+        self.assertTrue(exists(join(self.tmpdir, 'Unknown.jpg')))
+        self.assertEqual(self.manifest.get('Example.jpg', None)[0], hashed_path)
+        self.assertEqual(self.manifest.get('Missing.jpg', None)[0], 'Missing.jpg')
+        self.assertEqual(layout.migrate_layout(self.manifest, self.tmpdir, 'hashed'), 0)
+        self.assertEqual(layout.migrate_layout(self.manifest, self.tmpdir, 'flat'), 3)
+        self.assertEqual(self.manifest.get('Migrated.jpg', None)[0], 'Migrated.jpg')
+        self.assertTrue(exists(join(self.tmpdir, 'Example.jpg')))
+
+
+if __name__ == "__main__":
+    unittest.main()
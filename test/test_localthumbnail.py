@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import os
+import tempfile
+import unittest
+from os.path import join
+from commonsdownloader import localthumbnail
+
+
+class TestLocalThumbnail(unittest.TestCase):
+
+    """Testing methods from localthumbnail."""
+
+    def setUp(self):
+        """Set up a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def test_make_local_thumbnail_name(self):
+        """Test make_local_thumbnail_name."""
+        values = [(('My Example.jpeg', 'a/My_Example.jpeg', 120), 'My_Example.jpg'),
+                  (('Example.svg', 'a/Example.svg', 120), 'Example.png'),
+                  (('Example.tif', 'a/Example.TIF', 120), 'Example.jpg')]
+        for (input_value, expected_value) in values:
+            self.assertEqual(localthumbnail.make_local_thumbnail_name(*input_value),
+                             expected_value)
+        self.assertEqual(localthumbnail.make_local_thumbnail_name(
+            'Example.svg', 'a/Example.svg', 120, width_in_name=True),
+            '120px-Example.png')
+
+    def test_can_render(self):
+        """Test can_render depends on the format and the libraries."""
+        self.assertFalse(localthumbnail.can_render('Example.pdf'))
+        self.assertEqual(localthumbnail.can_render('Example.jpg'),
+                         localthumbnail.Image is not None)
+        self.assertEqual(localthumbnail.can_render('Example.svg'),
+                         localthumbnail.cairosvg is not None)
+
+    def test_render_thumbnail_failure(self):
+        """Test render_thumbnail returns an error and leaves no file."""
+        output_file_path = join(self.tmpdir, 'Example.jpg')
+        result = localthumbnail.render_thumbnail(join(self.tmpdir, 'Missing.jpg'),
+                                                 output_file_path, 120)
+        self.assertIsInstance(result, str)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    @unittest.skipIf(localthumbnail.Image is None, 'Pillow is not installed')
+    def test_render_thumbnail(self):
+        """Test render_thumbnail resizes a raster image."""
+        Image = localthumbnail.Image
+        source_path = join(self.tmpdir, 'Source.png')
+        Image.new('RGB', (400, 200)).save(source_path)
+        output_file_path = join(self.tmpdir, 'Example.png')
+        result = localthumbnail.render_thumbnail(source_path, output_file_path, 100)
+        self.assertEqual(result.path, output_file_path)
+        self.assertEqual(Image.open(output_file_path).size, (100, 50))
+
+
+class TestLocalThumbnailer(unittest.TestCase):
+
+    """Testing the LocalThumbnailer."""
+
+    def setUp(self):
+        """Start a thumbnailer."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.thumbnailer = localthumbnail.LocalThumbnailer(processes=2)
+        self.results = []
+
+    def tearDown(self):
+        """Stop the thumbnailer."""
+        self.thumbnailer.close()
+
+    def test_submit_failure(self):
+        """Test failed renderings are waited for, calling back with the error."""
+        errors = []
+        for _ in range(5):
+            self.thumbnailer.submit('Example.jpg', 120,
+                                    join(self.tmpdir, 'Missing.jpg'),
+                                    self.tmpdir, self.results.append,
+                                    error_callback=errors.append)
+        self.thumbnailer.wait()
+        self.assertEqual(self.results, [])
+        self.assertEqual(len(errors), 5)
+        self.assertTrue(errors[0].startswith('Could not render'))
+
+    @unittest.skipIf(localthumbnail.Image is None, 'Pillow is not installed')
+    def test_submit(self):
+        """Test submit renders the thumbnail and calls back."""
+        source_path = join(self.tmpdir, 'Source.jpg')
+        localthumbnail.Image.new('RGB', (400, 200)).save(source_path)
+        for width in (100, 200):
+            self.thumbnailer.submit('Example.jpg', width, source_path,
+                                    self.tmpdir, self.results.append,
+                                    width_in_name=True)
+        self.thumbnailer.wait()
+        self.assertEqual(sorted(os.path.basename(result.path)
+                                for result in self.results),
+                         ['100px-Example.jpg', '200px-Example.jpg'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import sqlite3
+import tempfile
+import unittest
+from os.path import join, exists
+from commonsdownloader import manifest
+
+
+class TestManifestFunctions(unittest.TestCase):
+
+    """Testing functions from manifest."""
+
+    def test_parse_manifest_line(self):
+        """Test parse_manifest_line."""
+        values = [('Example.jpg,100\n', ('Example.jpg', 100)),
+                  ('Example, with comma.jpg,50\n', ('Example, with comma.jpg', 50)),
+                  ('Example.jpg,None\n', ('Example.jpg', None)),
+                  ('Example.jpg\n', ('Example.jpg', None))]
+        for (input_value, expected_value) in values:
+            self.assertEqual(manifest.parse_manifest_line(input_value),
+                             expected_value)
+
+    def test_open_manifest(self):
+        """Test open_manifest returns the chosen backend."""
+        tmpdir = tempfile.mkdtemp()
+        for (backend, expected_class) in [('text', manifest.TextManifest),
+                                          ('sqlite', manifest.SQLiteManifest)]:
+            local_manifest = manifest.open_manifest(tmpdir, backend=backend)
+            self.assertIsInstance(local_manifest, expected_class)
+            local_manifest.close()
+
+
+class ManifestTestMixin(object):
+
+    """Tests common to all the manifest backends."""
+
+    def setUp(self):
+        """Open a manifest in a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.manifest = self.backend(self.tmpdir)
+
+    def tearDown(self):
+        """Close the manifest."""
+        self.manifest.close()
+
+    def test_add(self):
+        """Test add records the file in its width only."""
+        self.manifest.add('Example.jpg', 100)
+        self.assertIn(('Example.jpg', 100), self.manifest)
+        self.assertNotIn(('Example.jpg', 50), self.manifest)
+        self.assertNotIn(('Other.jpg', 100), self.manifest)
+
+    def test_add_several_widths(self):
+        """Test add keeps several widths of the same file."""
+        self.manifest.add('Example.jpg', 100)
+        self.manifest.add('Example.jpg', None)
+        self.assertIn(('Example.jpg', 100), self.manifest)
+        self.assertIn(('Example.jpg', None), self.manifest)
+
+    def test_iter(self):
+        """Test iterating yields the file names and widths of the entries."""
+        self.manifest.add('Example.jpg', 100, path='Example.jpg')
+        self.manifest.add('Example.jpg', None, path='Example.jpg')
+        self.assertEqual(sorted((file_name, width)
+                                for (file_name, width, _) in self.manifest),
+                         [('Example.jpg', None), ('Example.jpg', 100)])
+
+    def test_add_many(self):
+        """Test add_many records all the entries."""
+        self.manifest.add_many([('Example.jpg', 100, 'Example.jpg', 42),
+                                ('Other.jpg', None, 'Other.jpg', 42)])
+        self.assertIn(('Example.jpg', 100), self.manifest)
+        self.assertIn(('Other.jpg', None), self.manifest)
+
+    def test_sync(self):
+        """Test the entries are there after a sync, without closing."""
+        self.manifest.add('Example.jpg', 100)
+        self.manifest.sync()
+        other = self.backend(self.tmpdir)
+        self.assertIn(('Example.jpg', 100), other)
+        other.close()
+
+    def test_persistence(self):
+        """Test the entries are there when reopening the manifest."""
+        self.manifest.add('Example.jpg', 100)
+        self.manifest.close()
+        self.manifest = self.backend(self.tmpdir)
+        self.assertIn(('Example.jpg', 100), self.manifest)
+
+
+class TestTextManifest(ManifestTestMixin, unittest.TestCase):
+
+    """Testing the TextManifest."""
+
+    backend = manifest.TextManifest
+
+    def test_text_format(self):
+        """Test the manifest is written as text lines."""
+        self.manifest.add('Example.jpg', 100)
+        with open(join(self.tmpdir, '.manifest')) as f:
+            self.assertEqual(f.read(), 'Example.jpg,100\n')
+
+
+class TestSQLiteManifest(ManifestTestMixin, unittest.TestCase):
+
+    """Testing the SQLiteManifest."""
+
+    backend = manifest.SQLiteManifest
+
+    def test_get(self):
+        """Test get returns the details of the entry."""
+        self.manifest.add('Example.jpg', 100, path='Example.jpg', size=42,
+                          checksum='abc')
+        (path, size, checksum, timestamp) = self.manifest.get('Example.jpg', 100)
+        self.assertEqual((path, size, checksum), ('Example.jpg', 42, 'abc'))
+        self.assertIsNotNone(timestamp)
+        self.assertIsNone(self.manifest.get('Example.jpg', 50))
+
+    def test_get_validators(self):
+        """Test get_validators returns the validators of files on disk."""
+        with open(join(self.tmpdir, 'Example.jpg'), 'w') as f:
+            f.write('contents')
+        self.manifest.add('Example.jpg', 100, path='Example.jpg', etag='"v1"',
+                          last_modified='Mon, 01 Jan 2024 00:00:00 GMT')
+        self.manifest.add('Missing.jpg', 100, path='Missing.jpg', etag='"v1"')
+        self.manifest.add('Other.jpg', 100, path='Example.jpg')
+        self.assertEqual(self.manifest.get_validators('Example.jpg', 100),
+                         ('"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT'))
+        self.assertIsNone(self.manifest.get_validators('Missing.jpg', 100))
+        self.assertIsNone(self.manifest.get_validators('Other.jpg', 100))
+        self.assertIsNone(self.manifest.get_validators('Example.jpg', 50))
+
+    def test_get_path(self):
+        """Test get_path returns the path of files still on disk."""
+        with open(join(self.tmpdir, 'Example.jpg'), 'w') as f:
+            f.write('contents')
+        self.manifest.add('Example.jpg', None, path='Example.jpg')
+        self.manifest.add('Missing.jpg', None, path='Missing.jpg')
+        self.assertEqual(self.manifest.get_path('Example.jpg', None),
+                         join(self.tmpdir, 'Example.jpg'))
+        self.assertIsNone(self.manifest.get_path('Missing.jpg', None))
+        self.assertIsNone(self.manifest.get_path('Example.jpg', 100))
+
+    def test_add_missing_columns(self):
+        """Test a manifest created without validator columns is upgraded."""
+        self.manifest.close()
+        tmpdir = tempfile.mkdtemp()
+        connection = sqlite3.connect(join(tmpdir, '.manifest.sqlite'))
+        connection.execute('CREATE TABLE files (file_name TEXT NOT NULL, '
+                           'width INTEGER NOT NULL, path TEXT, size INTEGER, '
+                           'checksum TEXT, timestamp REAL, '
+                           'PRIMARY KEY (file_name, width))')
+        connection.execute("INSERT INTO files (file_name, width) "
+                           "VALUES ('Example.jpg', 100)")
+        connection.commit()
+        connection.close()
+        self.manifest = manifest.SQLiteManifest(tmpdir)
+        self.assertIn(('Example.jpg', 100), self.manifest)
+        self.manifest.add('Other.jpg', 100, etag='"v1"')
+        self.assertEqual(len(self.manifest), 2)
+
+    def test_migrate_text_manifest(self):
+        """Test an existing text manifest is migrated when opening."""
+        self.manifest.close()
+        tmpdir = tempfile.mkdtemp()
+        text_manifest_path = join(tmpdir, '.manifest')
+        with open(text_manifest_path, 'w') as f:
+            f.write('Example.jpg,100\nExample.jpg,50\nOther.jpg,None\n')
+        self.manifest = manifest.SQLiteManifest(tmpdir)
+        self.assertEqual(len(self.manifest), 3)
+        self.assertIn(('Example.jpg', 50), self.manifest)
+        self.assertIn(('Other.jpg', None), self.manifest)
+        self.assertFalse(exists(text_manifest_path))
+        self.assertTrue(exists(text_manifest_path + '.migrated'))
+
+
+if __name__ == "__main__":
+    unittest.main()
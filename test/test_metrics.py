@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import json
+import tempfile
+import unittest
+from os.path import join
+from StringIO import StringIO
+from commonsdownloader import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    """Testing the Metrics and their formatting."""
+
+    def setUp(self):
+        """Record a few operations."""
+        self.metrics = metrics.Metrics()
+        self.metrics.increment('downloaded', 3)
+        self.metrics.increment('failed')
+        self.metrics.increment('bytes', 2000)
+        self.metrics.add_time('http', 0.5, count=2)
+        with self.metrics.timer('write'):
+            pass
+
+    def make_snapshot(self, elapsed):
+        """Return a snapshot as if taken after elapsed seconds."""
+        snapshot = self.metrics.snapshot()
+        snapshot['elapsed'] = elapsed
+        return snapshot
+
+    def test_snapshot(self):
+        """Test the snapshot holds the counters and timers."""
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['counters']['downloaded'], 3)
+        self.assertEqual(snapshot['counters']['skipped'], 0)
+        self.assertEqual(snapshot['stages']['http'],
+                         {'count': 2, 'seconds': 0.5, 'max': 0.25})
+        self.assertEqual(snapshot['stages']['write']['count'], 1)
+
+    def test_format_progress(self):
+        """Test format_progress shows the throughput and ETA."""
+        snapshot = self.make_snapshot(2.0)
+        self.assertEqual(metrics.format_progress(snapshot, total=10),
+                         '4/10 files (40.0%), 2.0 files/s, 1.0 kB/s'
+                         ' - 0 skipped, 1 failed, 0 retried - ETA 0:00:03')
+        self.assertEqual(metrics.format_progress(snapshot),
+                         '4 files, 2.0 files/s, 1.0 kB/s'
+                         ' - 0 skipped, 1 failed, 0 retried')
+
+    def test_format_stages(self):
+        """Test format_stages shows the mean time of the stages used."""
+        snapshot = self.make_snapshot(2.0)
+        snapshot['stages']['write']['seconds'] = 0.002
+        self.assertEqual(metrics.format_stages(snapshot),
+                         'http 250.0 ms, write 2.0 ms')
+
+    def test_format_prometheus(self):
+        """Test format_prometheus outputs a sample per counter and stage."""
+        lines = metrics.format_prometheus(self.make_snapshot(2.0)).splitlines()
+        self.assertIn('commonsdownloader_files_total{status="failed"} 1', lines)
+        self.assertIn('commonsdownloader_bytes_total 2000', lines)
+        self.assertIn('commonsdownloader_stage_operations_total{stage="http"} 2', lines)
+        self.assertIn('commonsdownloader_elapsed_seconds 2.0', lines)
+
+    def test_export_metrics(self):
+        """Test export_metrics appends JSON lines, and replaces the textfile."""
+        tmpdir = tempfile.mkdtemp()
+        snapshot = self.make_snapshot(2.0)
+        for _ in range(2):
+            metrics.export_metrics(snapshot, join(tmpdir, 'metrics.json'), 'json')
+            metrics.export_metrics(snapshot, join(tmpdir, 'metrics.prom'), 'prometheus')
+        lines = open(join(tmpdir, 'metrics.json')).readlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])['counters']['downloaded'], 3)
+        self.assertEqual(open(join(tmpdir, 'metrics.prom')).read(),
+                         metrics.format_prometheus(snapshot))
+
+    def test_reporter(self):
+        """Test the reporter makes a last report when stopped."""
+        stream = StringIO()
+        reporter = metrics.MetricsReporter(self.metrics, interval=60,
+                                           total=4, stream=stream)
+        reporter.start()
+        reporter.stop()
+        self.assertTrue(stream.getvalue().startswith('4/4 files (100.0%)'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import os
+import hashlib
+import tempfile
+import unittest
+from os.path import join
+from commonsdownloader import objectstore, imageinfo
+from commonsdownloader.thumbnaildownload import DownloadedFile
+
+
+class TestObjectStore(unittest.TestCase):
+
+    """Testing the ObjectStore."""
+
+    contents = 'contents'
+
+    def setUp(self):
+        """Set up a store, and a file downloaded in a folder."""
+        self.store = objectstore.ObjectStore(tempfile.mkdtemp())
+        self.folder1 = tempfile.mkdtemp()
+        self.folder2 = tempfile.mkdtemp()
+        self.sha1 = hashlib.sha1(self.contents).hexdigest()
+        self.downloaded = self.write_file(self.folder1, 'Example.jpg')
+
+    def tearDown(self):
+        """Close the store."""
+        self.store.close()
+
+    def write_file(self, folder, file_name):
+        """Write the contents in the folder, as a downloaded file."""
+        path = join(folder, file_name)
+        with open(path, 'wb') as f:
+            f.write(self.contents)
+        return DownloadedFile(path, len(self.contents), self.sha1)
+
+    def test_get_object_path(self):
+        """Test get_object_path."""
+        self.assertEqual(self.store.get_object_path('abcdef'),
+                         join(self.store.root, 'objects', 'ab', 'abcdef'))
+
+    def test_add(self):
+        """Test add stores the file and indexes it."""
+        self.store.add('Example.jpg', 100, self.downloaded)
+        object_path = self.store.get_object_path(self.sha1)
+        self.assertEqual(open(object_path, 'rb').read(), self.contents)
+        self.assertEqual(self.store.lookup('Example.jpg', 100),
+                         (self.sha1, 'Example.jpg', len(self.contents)))
+        self.assertIsNone(self.store.lookup('Example.jpg', 50))
+
+    def test_add_deduplicates_contents(self):
+        """Test add links identical contents to the same object."""
+        self.store.add('Example.jpg', 100, self.downloaded)
+        other = self.write_file(self.folder2, 'Other.jpg')
+        self.store.add('Other.jpg', 100, other)
+        self.assertEqual(os.stat(self.downloaded.path).st_ino,
+                         os.stat(other.path).st_ino)
+
+    def test_link_file(self):
+        """Test link_file links a stored file into another folder."""
+        self.store.add('Example.jpg', 100, self.downloaded)
+        output = self.store.link_file('Example.jpg', 100, self.folder2)
+        expected_path = join(self.folder2, 'Example.jpg')
+        self.assertEqual((output.path, output.size, output.sha1),
+                         (expected_path, len(self.contents), self.sha1))
+        self.assertEqual(os.stat(expected_path).st_ino,
+                         os.stat(self.downloaded.path).st_ino)
+
+    def test_link_file_with_width_in_name(self):
+        """Test link_file names the file after its width."""
+        downloaded = self.write_file(self.folder1, '100px-Example.jpg')
+        self.store.add('Example.jpg', 100, downloaded, width_in_name=True)
+        self.assertEqual(self.store.lookup('Example.jpg', 100)[1], 'Example.jpg')
+        output = self.store.link_file('Example.jpg', 100, self.folder2,
+                                      width_in_name=True)
+        self.assertEqual(output.path, join(self.folder2, '100px-Example.jpg'))
+
+    def test_link_file_not_in_store(self):
+        """Test link_file with a file not in the store."""
+        self.assertIsNone(self.store.link_file('Example.jpg', 100, self.folder2))
+
+    def test_link_file_by_sha1(self):
+        """Test link_file finds full size files by their prefetched SHA-1."""
+        self.store.add('Example.jpg', 100, self.downloaded)
+        file_info = imageinfo.FileInfo(
+            title='File:Copy.jpg', url='full', mime='image/jpeg', width=800,
+            height=600, size=len(self.contents), sha1=self.sha1,
+            thumb_url='thumb', thumb_mime='image/jpeg')
+        output = self.store.link_file('Copy.jpg', None, self.folder2,
+                                      file_info=file_info)
+        self.assertEqual(output.path, join(self.folder2, 'Copy.jpg'))
+        self.assertIsNone(self.store.link_file('Copy.jpg', 100, self.folder2,
+                                               file_info=file_info))
+
+    def test_link_file_changed(self):
+        """Test link_file does not link a full size file stored before a new upload."""
+        self.store.add('Example.jpg', None, self.downloaded)
+        file_info = imageinfo.FileInfo(
+            title='File:Example.jpg', url='full', mime='image/jpeg', width=800,
+            height=600, size=20, sha1='0' * 40,
+            thumb_url='thumb', thumb_mime='image/jpeg')
+        self.assertIsNone(self.store.link_file('Example.jpg', None, self.folder2,
+                                               file_info=file_info))
+        file_info = file_info._replace(sha1=self.sha1)
+        output = self.store.link_file('Example.jpg', None, self.folder2,
+                                      file_info=file_info)
+        self.assertEqual(output.path, join(self.folder2, 'Example.jpg'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import tempfile
+import unittest
+from os.path import join, exists
+from commonsdownloader import partialfile
+
+
+class TestPartialFile(unittest.TestCase):
+
+    """Testing methods from partialfile."""
+
+    def setUp(self):
+        """Set up a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+
+    def test_get_state_path(self):
+        """Test get_state_path."""
+        values = [(('output', 'Example.jpg', 100), 'output/.Example.jpg.100.download'),
+                  (('output', 'Example.jpg', None), 'output/.Example.jpg.full.download')]
+        for (input_value, expected_value) in values:
+            self.assertEqual(partialfile.get_state_path(*input_value),
+                             expected_value)
+
+    def test_replace_file(self):
+        """Test replace_file overwrites the destination."""
+        source = join(self.tmpdir, 'source')
+        destination = join(self.tmpdir, 'destination')
+        for (path, contents) in [(source, 'new'), (destination, 'old')]:
+            with open(path, 'w') as f:
+                f.write(contents)
+        partialfile.replace_file(source, destination)
+        self.assertFalse(exists(source))
+        self.assertEqual(open(destination).read(), 'new')
+
+    def test_save_and_load_state(self):
+        """Test a saved state can be loaded back."""
+        state_path = join(self.tmpdir, '.Example.jpg.full.download')
+        state = {'url': 'http://upload/Example.jpg', 'validator': '"abc"',
+                 'output_file_name': 'Example.jpg', 'bytes': 42}
+        partialfile.save_state(state_path, state)
+        self.assertEqual(partialfile.load_state(state_path), state)
+
+    def test_load_missing_state(self):
+        """Test load_state without any state."""
+        self.assertIsNone(partialfile.load_state(join(self.tmpdir, 'missing')))
+
+    def test_load_corrupted_state(self):
+        """Test load_state discards a corrupted state."""
+        state_path = join(self.tmpdir, '.Example.jpg.full.download')
+        with open(state_path, 'w') as f:
+            f.write('{"url": ')
+        self.assertIsNone(partialfile.load_state(state_path))
+        self.assertFalse(exists(state_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import os
+import tempfile
+import unittest
+from os.path import join
+from commonsdownloader import prescan, manifest
+
+
+class TestPreScanFunctions(unittest.TestCase):
+
+    """Testing functions from prescan."""
+
+    def test_key_set(self):
+        """Test the KeySet holds its keys only."""
+        keys = [('Example_%s.jpg' % index, 100) for index in range(1000)]
+        key_set = prescan.KeySet(keys)
+        self.assertEqual(len(key_set), 1000)
+        for key in keys:
+            self.assertIn(key, key_set)
+        self.assertNotIn(('Example_1.jpg', 50), key_set)
+        self.assertNotIn(('Other.jpg', 100), key_set)
+        self.assertNotIn('Example.jpg', prescan.KeySet())
+
+
+class TestPreScan(unittest.TestCase):
+
+    """Testing the PreScan."""
+
+    def setUp(self):
+        """Set up a folder with a manifest and a few files."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.manifest = manifest.SQLiteManifest(self.tmpdir)
+        for name in ('Example.jpg', 'Found.png'):
+            with open(join(self.tmpdir, name), 'w') as f:
+                f.write('contents')
+        os.mkdir(join(self.tmpdir, 'a'))
+        open(join(self.tmpdir, 'a', 'Nested.jpg'), 'w').close()
+        self.manifest.add('Example.jpg', 100, path='Example.jpg')
+        self.manifest.add('Nested.jpg', 100, path=join('a', 'Nested.jpg'))
+        self.manifest.add('Missing.jpg', 100, path='Missing.jpg')
+        self.manifest.add('Migrated.jpg', 100)
+
+    def tearDown(self):
+        """Close the manifest."""
+        self.manifest.close()
+
+    def test_filter(self):
+        """Test filter yields the files neither in manifest nor on disk."""
+        files = [('Example.jpg', 100), ('Nested.jpg', 100), ('Missing.jpg', 100),
+                 ('Migrated.jpg', 100), ('Found.svg', 100), ('New.jpg', 100)]
+        scan = prescan.PreScan(self.manifest, self.tmpdir)
+        self.assertEqual(list(scan.filter(iter(files))),
+                         [('Missing.jpg', 100), ('New.jpg', 100)])
+        self.assertEqual(self.manifest.get('Found.svg', 100)[:2], ('Found.png', 8))
+
+    def test_filter_at_another_width(self):
+        """Test files in manifest at another width are not found on disk."""
+        with open(join(self.tmpdir, 'Migrated.jpg'), 'w') as f:
+            f.write('contents')
+        files = [('Example.jpg', 800), ('Migrated.jpg', 200), ('Found.png', 800)]
+        scan = prescan.PreScan(self.manifest, self.tmpdir)
+        self.assertEqual(list(scan.filter(iter(files))),
+                         [('Example.jpg', 800), ('Migrated.jpg', 200)])
+        self.assertEqual(self.manifest.get('Example.jpg', 800), None)
+
+    def test_filter_confirms_hits(self):
+        """Test files found by the scan are confirmed, against collisions."""
+        scan = prescan.PreScan(self.manifest, self.tmpdir)
+        scan.downloaded = prescan.KeySet([('New.jpg', 100)])
+        scan.on_disk = prescan.KeySet(['Other.jpg'])
+        self.assertEqual(list(scan.filter(iter([('New.jpg', 100),
+                                                ('Other.jpg', 100)]))),
+                         [('New.jpg', 100), ('Other.jpg', 100)])
+
+    def test_filter_with_width_in_name(self):
+        """Test files on disk are only found under the name of their width."""
+        scan = prescan.PreScan(self.manifest, self.tmpdir, width_in_name=True)
+        self.assertEqual(list(scan.filter(iter([('Found.png', 100),
+                                                ('Found.png', None)]))),
+                         [('Found.png', 100)])
+
+
+if __name__ == "__main__":
+    unittest.main()
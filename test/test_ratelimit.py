@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import time
+import threading
+import unittest
+from email.utils import formatdate
+from commonsdownloader import ratelimit
+
+
+class TestRateLimitFunctions(unittest.TestCase):
+
+    """Testing functions from ratelimit."""
+
+    def test_parse_retry_after(self):
+        """Test parse_retry_after with seconds or invalid values."""
+        values = [('120', 120.0), (' 5 ', 5.0), ('', None), (None, None),
+                  ('soon', None)]
+        for (input_value, expected_value) in values:
+            self.assertEqual(ratelimit.parse_retry_after(input_value),
+                             expected_value)
+
+    def test_parse_retry_after_with_date(self):
+        """Test parse_retry_after with an HTTP date."""
+        value = formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(ratelimit.parse_retry_after(value), 60, delta=2)
+
+    def test_backoff_delay(self):
+        """Test backoff_delay grows exponentially, up to its maximum."""
+        for attempt in range(5):
+            delay = ratelimit.backoff_delay(attempt)
+            self.assertGreaterEqual(delay, 2 ** attempt * 0.5)
+            self.assertLessEqual(delay, 2 ** attempt)
+        self.assertLessEqual(ratelimit.backoff_delay(20), ratelimit.MAX_DELAY)
+
+    def test_backoff_delay_with_retry_after(self):
+        """Test backoff_delay honours the Retry-After delay."""
+        self.assertEqual(ratelimit.backoff_delay(0, retry_after=30), 30)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    """Testing the TokenBucket."""
+
+    def test_acquire(self):
+        """Test acquire waits for the tokens to refill."""
+        bucket = ratelimit.TokenBucket(20, capacity=1)
+        start = time.time()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.19)
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+
+    """Testing the AdaptiveConcurrency."""
+
+    def test_release_adapts_limit(self):
+        """Test the limit is halved when throttled, and grows back."""
+        concurrency = ratelimit.AdaptiveConcurrency(8)
+        concurrency.acquire()
+        concurrency.release(throttled=True)
+        self.assertEqual(concurrency.limit, 4)
+        for _ in range(4):
+            concurrency.acquire()
+            concurrency.release()
+        self.assertAlmostEqual(concurrency.limit, 5, delta=0.1)
+
+    def test_release_decreases_once_per_interval(self):
+        """Test simultaneous throttles only halve the limit once."""
+        concurrency = ratelimit.AdaptiveConcurrency(8)
+        for _ in range(3):
+            concurrency.acquire()
+        for _ in range(3):
+            concurrency.release(throttled=True)
+        self.assertEqual(concurrency.limit, 4)
+
+    def test_acquire_caps_concurrency(self):
+        """Test acquire blocks when the limit is reached."""
+        concurrency = ratelimit.AdaptiveConcurrency(1)
+        concurrency.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            concurrency.acquire()
+            acquired.set()
+
+        threading.Thread(target=acquire).start()
+        self.assertFalse(acquired.wait(0.1))
+        concurrency.release()
+        self.assertTrue(acquired.wait(1))
+
+    def test_acquire_waits_for_retry_after(self):
+        """Test acquire waits for the delay asked by the server."""
+        concurrency = ratelimit.AdaptiveConcurrency(4)
+        concurrency.acquire()
+        concurrency.release(throttled=True, retry_after=0.2)
+        start = time.time()
+        concurrency.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.15)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import time
+import unittest
+import threading
+from StringIO import StringIO
+from commonsdownloader import scheduler
+from commonsdownloader.imageinfo import FileInfo
+
+
+def make_info(size, width=1000):
+    """Return the FileInfo of a JPEG file of the given size and width."""
+    return FileInfo('File:Example.jpg', 'http://example.org/Example.jpg',
+                    'image/jpeg', width, width, size, None, None, None)
+
+
+class TestScheduler(unittest.TestCase):
+
+    """Testing the Scheduler."""
+
+    def test_parse_size(self):
+        """Test sizes are parsed in bytes, with a unit."""
+        self.assertEqual(scheduler.parse_size('1024'), 1024)
+        self.assertEqual(scheduler.parse_size('2k'), 2048)
+        self.assertEqual(scheduler.parse_size('1.5M'), 3 * 512 * 1024)
+        for value in ['', 'M', 'big', '-1G', '0']:
+            self.assertRaises(ValueError, scheduler.parse_size, value)
+
+    def test_estimate_size(self):
+        """Test thumbnails are estimated from their pixels, full sizes from the file."""
+        info = make_info(1000000)
+        self.assertEqual(scheduler.estimate_size(None, info), 1000000)
+        self.assertEqual(scheduler.estimate_size(2000, info), 1000000)
+        self.assertEqual(scheduler.estimate_size(100, info), 10000)
+        self.assertEqual(scheduler.estimate_size(100, None), None)
+
+    def test_read_priorities(self):
+        """Test priorities are read by file name."""
+        priorities = scheduler.read_priorities(StringIO('A b.jpg,5\n\nC, d.jpg,-1\n'))
+        self.assertEqual(priorities, {'A_b.jpg': 5, 'C,_d.jpg': -1})
+        self.assertRaises(ValueError, scheduler.read_priorities, StringIO('A.jpg\n'))
+
+    def test_schedule_by_priority_and_size(self):
+        """Test files of higher priority start first, then the smallest."""
+        files = [('Large.jpg', None, make_info(5000)),
+                 ('Small.jpg', None, make_info(10)),
+                 ('Unknown.jpg', None, None),
+                 ('Urgent.jpg', None, make_info(9000))]
+        files_scheduler = scheduler.Scheduler(priorities={'Urgent.jpg': 1})
+        output = []
+        for item in files_scheduler.schedule(files):
+            output.append(item[0])
+            files_scheduler.done(*item[:2])
+        self.assertEqual(output, ['Urgent.jpg', 'Unknown.jpg', 'Small.jpg',
+                                  'Large.jpg'])
+
+    def test_schedule_by_window(self):
+        """Test files are not held back by more than a window of files."""
+        files = [('File %s.jpg' % index, None, make_info(10 - index))
+                 for index in range(10)]
+        files_scheduler = scheduler.Scheduler(window=5)
+        output = [item[0] for item in files_scheduler.schedule(files)]
+        self.assertEqual(output, ['File %s.jpg' % index
+                                  for index in [4, 3, 2, 1, 0, 9, 8, 7, 6, 5]])
+
+    def test_max_bytes(self):
+        """Test files wait for the bytes in flight to go under the cap."""
+        files = [('File %s.jpg' % index, None, make_info(40)) for index in range(20)]
+        files_scheduler = scheduler.Scheduler(max_bytes=100)
+        peaks = []
+
+        def download(item):
+            peaks.append(files_scheduler.get_bytes_in_flight())
+            time.sleep(0.01)
+            files_scheduler.done(*item[:2])
+        threads = []
+        for item in files_scheduler.schedule(files):
+            thread = threading.Thread(target=download, args=(item,))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(peaks), 20)
+        self.assertTrue(max(peaks) <= 100)
+        self.assertEqual(files_scheduler.get_bytes_in_flight(), 0)
+
+    def test_large_lane(self):
+        """Test large files start one at a time, without holding small ones back."""
+        files = [('Large 1.jpg', None, make_info(1000)),
+                 ('Large 2.jpg', None, make_info(1000)),
+                 ('Small.jpg', None, make_info(10))]
+        files_scheduler = scheduler.Scheduler(large_size=1000, window=1)
+        scheduled = files_scheduler.schedule(files)
+        self.assertEqual(next(scheduled)[0], 'Large 1.jpg')
+        started = []
+        thread = threading.Thread(target=lambda: started.extend(
+            item[0] for item in scheduled))
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(started, [])
+        files_scheduler.done('Large 1.jpg', None)
+        thread.join()
+        self.assertEqual(started, ['Large 2.jpg', 'Small.jpg'])
+        files_scheduler = scheduler.Scheduler(large_size=1000)
+        scheduled = files_scheduler.schedule(files[:2] + files[2:] * 2)
+        self.assertEqual([next(scheduled)[0] for _ in range(3)],
+                         ['Small.jpg', 'Small.jpg', 'Large 1.jpg'])
+
+
+if __name__ == "__main__":
+    unittest.main()
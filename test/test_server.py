@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import os
+import json
+import time
+import tempfile
+import unittest
+import threading
+from os.path import join, exists
+from commonsdownloader import server, downloader
+from fakes import FakeTransport
+
+
+class TestJob(unittest.TestCase):
+
+    """Testing Job."""
+
+    def test_from_json(self):
+        """Test the files of a job are expanded to each width."""
+        job = server.Job.from_json(json.dumps(
+            {'output': '/tmp', 'files': ['A.jpg', ['B.jpg', None]],
+             'widths': [100, 200], 'priority': 3}))
+        self.assertEqual(job.files, [('A.jpg', 100), ('A.jpg', 200), ('B.jpg', None)])
+        self.assertEqual(job.priority, 3)
+        self.assertEqual(job.output_path, '/tmp')
+        self.assertTrue(job.width_in_name)
+        self.assertFalse(server.Job('/tmp', files=['A.jpg', 'B.jpg']).width_in_name)
+        self.assertTrue(server.Job('/tmp', files=['A.jpg', ('A.jpg', 320)]).width_in_name)
+
+    def test_from_json_invalid(self):
+        """Test invalid jobs raise ValueError."""
+        for data in ['[]', '{"files": []}', '{"output": "/tmp"}', 'not json',
+                     '{"output": "/tmp", "files": [1]}',
+                     '{"output": "/tmp", "files": [["A.jpg"]]}',
+                     '{"output": "/tmp", "files": [["A.jpg", "big"]]}',
+                     '{"output": "/tmp", "files": [], "priority": null}',
+                     '{"output": "/tmp", "files": [], "widths": 100}',
+                     '{"output": 1, "files": []}']:
+            self.assertRaises(ValueError, server.Job.from_json, data)
+
+
+class TestDownloadServer(unittest.TestCase):
+
+    """Testing the DownloadServer."""
+
+    def setUp(self):
+        """Start a server on a session with a fake transport."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.transport = FakeTransport()
+        self.session = downloader.Downloader(transport=self.transport)
+        self.server = server.DownloadServer(self.session, concurrent_jobs=2)
+
+    def tearDown(self):
+        """Stop the server."""
+        self.server.close()
+        self.session.close()
+
+    def test_run_job(self):
+        """Test a job reports its results and its summary."""
+        results = []
+        summaries = []
+        job = server.Job(self.tmpdir, files=['A.jpg', 'B.jpg'],
+                         on_result=results.append, on_finish=summaries.append)
+        self.server.run_job(job)
+        self.assertEqual(sorted(result['file'] for result in results),
+                         ['A.jpg', 'B.jpg'])
+        self.assertEqual(summaries[0]['counts'], {'downloaded': 2})
+        self.server.run_job(job)
+        self.assertEqual(summaries[1]['counts'], {'skipped': 2})
+        self.assertEqual(len(self.transport.urls), 2)
+
+    def test_run_job_several_widths(self):
+        """Test the renditions of a job at several widths are told apart."""
+        results = []
+        job = server.Job.from_json(json.dumps({'output': self.tmpdir,
+                                               'files': ['Example.jpg'],
+                                               'widths': [120, 320]}),
+                                   on_result=results.append)
+        self.server.run_job(job)
+        self.assertEqual(sorted(result['path'] for result in results),
+                         [join(self.tmpdir, '120px-Example.jpg'),
+                          join(self.tmpdir, '320px-Example.jpg')])
+        self.assertTrue(exists(join(self.tmpdir, '120px-Example.jpg')))
+        self.assertTrue(exists(join(self.tmpdir, '320px-Example.jpg')))
+
+    def test_run_job_list(self):
+        """Test a list job names after their width the lines at several widths."""
+        list_path = join(self.tmpdir, 'list.txt')
+        with open(list_path, 'w') as f:
+            f.write('A.jpg,120,320\nB.jpg,50\n')
+        summaries = []
+        self.server.run_job(server.Job(self.tmpdir, list_path=list_path,
+                                       on_finish=summaries.append))
+        self.assertEqual(summaries[0]['counts'], {'downloaded': 3})
+        self.assertEqual(sorted(name for name in os.listdir(self.tmpdir)
+                                if name.endswith('.jpg')),
+                         ['120px-A.jpg', '320px-A.jpg', 'B.jpg'])
+
+    def test_run_job_failing(self):
+        """Test a job which cannot run reports its error."""
+        summaries = []
+        job = server.Job(join(self.tmpdir, 'missing'), files=['A.jpg'],
+                         on_finish=summaries.append)
+        self.server.run_job(job)
+        self.assertTrue(summaries[0]['error'])
+
+    def test_serve_socket(self):
+        """Test jobs sent on the socket are answered with their results."""
+        path = join(self.tmpdir, 'socket')
+        self.server.serve_socket(path)
+        messages = list(server.submit(path, {'output': self.tmpdir,
+                                             'files': ['A.jpg']}))
+        self.assertEqual(messages[0]['status'], 'downloaded')
+        self.assertEqual(messages[-1]['counts'], {'downloaded': 1})
+        self.assertTrue(exists(join(self.tmpdir, 'A.jpg')))
+        messages = list(server.submit(path, {'output': self.tmpdir,
+                                             'files': [['A.jpg']]}))
+        self.assertTrue(messages[0]['error'])
+
+    def test_serve_spool(self):
+        """Test the jobs dropped in the spool folder are run."""
+        spool = join(self.tmpdir, 'spool')
+        os.mkdir(spool)
+        with open(join(spool, 'job.json'), 'w') as f:
+            json.dump({'output': self.tmpdir, 'files': ['A.jpg']}, f)
+        self.server.serve_spool(spool, interval=0.01)
+        result_path = join(spool, 'job.json.result')
+        for _ in range(500):
+            if exists(result_path):
+                break
+            time.sleep(0.01)
+        with open(result_path) as f:
+            result = json.load(f)
+        self.assertEqual(result['counts'], {'downloaded': 1})
+        self.assertEqual(result['results'][0]['file'], 'A.jpg')
+        self.assertEqual(os.listdir(spool), ['job.json.result'])
+
+    def test_serve_spool_invalid_job(self):
+        """Test an invalid job is answered with its error, and the spool goes on."""
+        spool = join(self.tmpdir, 'spool')
+        os.mkdir(spool)
+        with open(join(spool, 'a.json'), 'w') as f:
+            json.dump({'output': self.tmpdir, 'files': [1]}, f)
+        with open(join(spool, 'b.json'), 'w') as f:
+            json.dump({'output': self.tmpdir, 'files': ['B.jpg']}, f)
+        self.server.serve_spool(spool, interval=0.01)
+        for _ in range(500):
+            if exists(join(spool, 'b.json.result')):
+                break
+            time.sleep(0.01)
+        with open(join(spool, 'a.json.result')) as f:
+            self.assertTrue(json.load(f)['error'])
+        with open(join(spool, 'b.json.result')) as f:
+            self.assertEqual(json.load(f)['counts'], {'downloaded': 1})
+        self.assertEqual(sorted(os.listdir(spool)),
+                         ['a.json.result', 'b.json.result'])
+
+    def test_priority(self):
+        """Test queued jobs of higher priority are run first."""
+        blocked = threading.Event()
+        started = []
+        original_run_job = self.server.run_job
+
+        def run_job(job):
+            started.append(job.id)
+            blocked.wait()
+            original_run_job(job)
+        self.server.run_job = run_job
+        done = threading.Semaphore(0)
+        for (job_id, priority) in [('first', 0), ('second', 0), ('low', 0),
+                                   ('high', 5)]:
+            self.server.submit(server.Job(self.tmpdir, files=[], job_id=job_id,
+                                          priority=priority,
+                                          on_finish=lambda _: done.release()))
+            time.sleep(0.05)
+        blocked.set()
+        for _ in range(4):
+            done.acquire()
+        self.assertEqual(started, ['first', 'second', 'high', 'low'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,10 +3,42 @@
 
 """Unit tests."""
 
+import os
+import socket
+import hashlib
+import httplib
+import urllib2
 from os.path import dirname, join, exists
+from StringIO import StringIO
 import unittest
 import tempfile
-from commonsdownloader import thumbnaildownload
+from stubserver import StubServer
+from fakes import FakeTransport
+from commonsdownloader import (thumbnaildownload, imageinfo, httpclient,
+                               partialfile, diskwriter)
+
+
+class ChunkedResponse(object):
+
+    """A fake response, recording the size of the chunks read."""
+
+    def __init__(self, contents, fail_after=None):
+        """Initialise the response with its contents."""
+        self.fp = StringIO(contents)
+        self.chunk_sizes = []
+        self.fail_after = fail_after
+        self.closed = False
+
+    def read(self, amt=None):
+        """Read up to amt bytes."""
+        if self.fail_after is not None and len(self.chunk_sizes) >= self.fail_after:
+            raise socket.error('Connection reset by peer')
+        self.chunk_sizes.append(amt)
+        return self.fp.read(amt)
+
+    def close(self):
+        """Close the response."""
+        self.closed = True
 
 
 class TestCommonsDownloaderOffline(unittest.TestCase):
@@ -44,6 +76,14 @@ class TestCommonsDownloaderOffline(unittest.TestCase):
         output = thumbnaildownload.make_full_size_url(input_value)
         self.assertEqual(output, expected_value)
 
+    def test_make_rendition_name(self):
+        """Test make_rendition_name."""
+        values = [(('Example.jpg', 120), '120px-Example.jpg'),
+                  (('Example.jpg', None), 'Example.jpg')]
+        for (input_value, expected_value) in values:
+            self.assertEqual(thumbnaildownload.make_rendition_name(*input_value),
+                             expected_value)
+
     def test_clean_extension(self):
         """Test clean_extension."""
         values = [('jpg', 'jpg'),
@@ -60,6 +100,287 @@ class TestCommonsDownloaderOffline(unittest.TestCase):
         output = thumbnaildownload.make_thumbnail_name(*input_value)
         self.assertEqual(output, expected_value)
 
+    def test_get_exception_based_on_url_error(self):
+        """Test get_exception_based_on_url_error."""
+        headers = httplib.HTTPMessage(StringIO('Retry-After: 30\r\n\r\n'))
+        values = [((503, 'Service Unavailable'),
+                   thumbnaildownload.TransientDownloadException),
+                  ((404, 'The source file Example.jpg does not exist'),
+                   thumbnaildownload.FileDoesNotExistException),
+                  ((500, 'Error generating thumbnail'),
+                   thumbnaildownload.TransientDownloadException),
+                  ((403, 'Forbidden'), thumbnaildownload.DownloadException)]
+        for ((code, message), expected_class) in values:
+            error = urllib2.HTTPError('http://url', code, 'Error', headers,
+                                      StringIO(message))
+            output = thumbnaildownload.get_exception_based_on_url_error(error)
+            self.assertIs(type(output), expected_class)
+        error = urllib2.HTTPError('http://url', 429, 'Error', headers, StringIO(''))
+        output = thumbnaildownload.get_exception_based_on_url_error(error)
+        self.assertEqual(output.retry_after, 30)
+
+    def test_get_exception_based_on_url_error_with_network_error(self):
+        """Test get_exception_based_on_url_error with a network error."""
+        error = urllib2.URLError(socket.error('Connection refused'))
+        output = thumbnaildownload.get_exception_based_on_url_error(error)
+        self.assertIsInstance(output, thumbnaildownload.TransientDownloadException)
+
+    def test_get_partial_file_path(self):
+        """Test get_partial_file_path."""
+        output = thumbnaildownload.get_partial_file_path('output/Example.jpg')
+        expected_value = 'output/.Example.jpg.part'
+        self.assertEqual(output, expected_value)
+
+
+class TestCommonsDownloaderWriting(unittest.TestCase):
+
+    """Testing the streaming of responses to disk."""
+
+    def setUp(self):
+        """Set up a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.output_file = join(self.tmpdir, 'Example.jpg')
+
+    def test_write_response_to_file(self):
+        """Test write_response_to_file writes the contents in chunks."""
+        response = ChunkedResponse('x' * 10)
+        output = thumbnaildownload.write_response_to_file(
+            response, self.output_file, buffer_size=4)
+        expected_value = (self.output_file, 10,
+                          'ff9ee043d85595eb255c05dfe32ece02a53efbb2', None, None)
+        self.assertEqual(output, expected_value)
+        self.assertEqual(open(self.output_file, 'rb').read(), 'x' * 10)
+        self.assertEqual(response.chunk_sizes, [4, 4, 4, 4])
+        self.assertEqual(os.listdir(self.tmpdir), ['Example.jpg'])
+
+    def test_write_response_to_file_overwrites(self):
+        """Test write_response_to_file replaces an existing file."""
+        with open(self.output_file, 'wb') as f:
+            f.write('old')
+        thumbnaildownload.write_response_to_file(ChunkedResponse('new'),
+                                                 self.output_file)
+        self.assertEqual(open(self.output_file, 'rb').read(), 'new')
+
+    def test_write_response_to_file_with_lost_connection(self):
+        """Test write_response_to_file leaves nothing behind on failure."""
+        response = ChunkedResponse('x' * 10, fail_after=1)
+        with self.assertRaises(thumbnaildownload.DownloadException):
+            thumbnaildownload.write_response_to_file(response, self.output_file,
+                                                     buffer_size=4)
+        self.assertTrue(response.closed)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_write_response_to_file_with_writer(self):
+        """Test write_response_to_file writes through a DiskWriter."""
+        writer = diskwriter.DiskWriter(fsync='file')
+        for (contents, fail_after) in (('x' * 10, None), ('y' * 10, 1)):
+            try:
+                thumbnaildownload.write_response_to_file(
+                    ChunkedResponse(contents, fail_after=fail_after),
+                    self.output_file, buffer_size=4, writer=writer)
+            except thumbnaildownload.DownloadException:
+                pass
+        writer.close()
+        self.assertEqual(open(self.output_file, 'rb').read(), 'x' * 10)
+        self.assertEqual(os.listdir(self.tmpdir), ['Example.jpg'])
+
+
+class TestCommonsDownloaderResolved(unittest.TestCase):
+
+    """Testing the download of files resolved beforehand."""
+
+    def setUp(self):
+        """Set up a temporary directory and a file info."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.file_info = imageinfo.FileInfo(
+            title='File:Example.svg', url='http://full', mime='image/svg+xml',
+            width=800, height=600, size=1234, sha1='abc',
+            thumb_url='http://thumb', thumb_mime='image/png')
+
+    def test_download_resolved_file(self):
+        """Test download_resolved_file fetches the thumbnail URL directly."""
+        transport = FakeTransport('contents')
+        output = thumbnaildownload.download_resolved_file(
+            'Example.svg', self.file_info, self.tmpdir, width=100,
+            transport=transport)
+        self.assertEqual(output, join(self.tmpdir, 'Example.png'))
+        self.assertEqual(open(output, 'rb').read(), 'contents')
+        self.assertEqual(transport.urls, ['http://thumb'])
+
+    def test_download_resolved_file_at_full_size(self):
+        """Test download_resolved_file with no width."""
+        transport = FakeTransport('contents')
+        thumbnaildownload.download_resolved_file(
+            'Example.svg', self.file_info, self.tmpdir, width=None,
+            transport=transport)
+        self.assertEqual(transport.urls, ['http://full'])
+
+    def test_download_resolved_file_with_non_existing_file(self):
+        """Test download_resolved_file with a non-existing file."""
+        with self.assertRaises(thumbnaildownload.FileDoesNotExistException):
+            thumbnaildownload.download_resolved_file(
+                'UnexistingExample.jpg', None, self.tmpdir,
+                transport=FakeTransport(''))
+
+
+class ResumableResponse(ChunkedResponse):
+
+    """A fake response, with a validator."""
+
+    def __init__(self, contents, fail_after=None):
+        """Initialise the response with its contents and ETag."""
+        ChunkedResponse.__init__(self, contents, fail_after=fail_after)
+        self.headers = httplib.HTTPMessage(StringIO('ETag: "v1"\r\n\r\n'))
+
+    def geturl(self):
+        """Return the URL of the response."""
+        return 'http://upload/Big.jpg'
+
+
+class TestCommonsDownloaderResume(unittest.TestCase):
+
+    """Testing the resumption of interrupted downloads."""
+
+    contents = 'x' * 100 + 'y' * 100
+
+    def setUp(self):
+        """Start a stub server supporting ranges."""
+        def big(handler):
+            range_header = handler.headers.getheader('Range')
+            if range_header and handler.headers.getheader('If-Range') == '"v1"':
+                start = int(range_header[len('bytes='):-1])
+                content_range = 'bytes %s-%s/%s' % (start, len(self.contents) - 1,
+                                                    len(self.contents))
+                return (206, {'ETag': '"v1"', 'Content-Range': content_range},
+                        self.contents[start:])
+            return (200, {'ETag': '"v1"'}, self.contents)
+
+        self.server = StubServer({'/Big.jpg': big})
+        self.server.start()
+        self.transport = httpclient.ConnectionPool()
+        self.tmpdir = tempfile.mkdtemp()
+        self.output_file = join(self.tmpdir, 'Big.jpg')
+        self.state_path = partialfile.get_state_path(self.tmpdir, 'Big.jpg', None)
+        self.file_info = imageinfo.FileInfo(
+            title='File:Big.jpg', url=self.server.base_url + '/Big.jpg',
+            mime='image/jpeg', width=800, height=600, size=200, sha1='abc',
+            thumb_url=None, thumb_mime=None)
+
+    def tearDown(self):
+        """Stop the stub server."""
+        self.transport.close()
+        self.server.stop()
+
+    def make_interrupted_download(self, validator):
+        """Leave a partial file and its state, as an interrupted download."""
+        with open(partialfile.get_partial_file_path(self.output_file), 'wb') as f:
+            f.write(self.contents[:120])
+        partialfile.save_state(self.state_path,
+                               {'url': self.file_info.url,
+                                'validator': validator,
+                                'output_file_name': 'Big.jpg',
+                                'bytes': 100})
+
+    def test_write_response_to_file_keeps_partial_file(self):
+        """Test write_response_to_file saves the state when interrupted."""
+        response = ResumableResponse(self.contents, fail_after=3)
+        with self.assertRaises(thumbnaildownload.DownloadException):
+            thumbnaildownload.write_response_to_file(
+                response, self.output_file, buffer_size=40,
+                state_path=self.state_path, state_interval=50)
+        state = partialfile.load_state(self.state_path)
+        self.assertEqual(state, {'url': 'http://upload/Big.jpg',
+                                 'validator': '"v1"',
+                                 'output_file_name': 'Big.jpg',
+                                 'bytes': 80})
+        partial_file_path = partialfile.get_partial_file_path(self.output_file)
+        self.assertEqual(os.path.getsize(partial_file_path), 120)
+
+    def test_fetch_resolved_file_resumes_download(self):
+        """Test fetch_resolved_file resumes with a Range request."""
+        self.make_interrupted_download('"v1"')
+        output = thumbnaildownload.fetch_resolved_file(
+            'Big.jpg', self.file_info, self.tmpdir, width=None,
+            transport=self.transport)
+        self.assertEqual(open(self.output_file, 'rb').read(), self.contents)
+        self.assertEqual(output.size, 200)
+        self.assertEqual(output.sha1, hashlib.sha1(self.contents).hexdigest())
+        self.assertEqual(self.server.requests[0][1]['range'], 'bytes=100-')
+        self.assertEqual(os.listdir(self.tmpdir), ['Big.jpg'])
+
+    def test_fetch_resolved_file_with_range_ignored(self):
+        """Test fetch_resolved_file refetches when the range is ignored."""
+        self.make_interrupted_download('"v0"')
+        output = thumbnaildownload.fetch_resolved_file(
+            'Big.jpg', self.file_info, self.tmpdir, width=None,
+            transport=self.transport)
+        self.assertEqual(open(self.output_file, 'rb').read(), self.contents)
+        self.assertEqual(output.size, 200)
+        self.assertEqual(os.listdir(self.tmpdir), ['Big.jpg'])
+
+
+class TestCommonsDownloaderRevalidation(unittest.TestCase):
+
+    """Testing conditional requests for files downloaded before."""
+
+    contents = 'contents'
+
+    def setUp(self):
+        """Start a stub server supporting conditional requests."""
+        def example(handler):
+            if handler.headers.getheader('If-None-Match') == '"v1"':
+                return (304, {'ETag': '"v1"'}, '')
+            return (200, {'ETag': '"v1"', 'Content-Type': 'image/jpeg',
+                          'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'},
+                    self.contents)
+
+        self.server = StubServer({'/Example.jpg': example})
+        self.server.start()
+        self.transport = httpclient.ConnectionPool()
+        self.tmpdir = tempfile.mkdtemp()
+        self.file_info = imageinfo.FileInfo(
+            title='File:Example.jpg', url=self.server.base_url + '/Example.jpg',
+            mime='image/jpeg', width=800, height=600, size=8, sha1='abc',
+            thumb_url=None, thumb_mime=None)
+
+    def tearDown(self):
+        """Stop the stub server."""
+        self.transport.close()
+        self.server.stop()
+
+    def test_make_conditional_headers(self):
+        """Test make_conditional_headers."""
+        values = [(None, {}),
+                  (('"v1"', None), {'If-None-Match': '"v1"'}),
+                  ((None, 'date'), {'If-Modified-Since': 'date'})]
+        for (input_value, expected_value) in values:
+            self.assertEqual(thumbnaildownload.make_conditional_headers(input_value),
+                             expected_value)
+
+    def test_fetch_resolved_file_records_validators(self):
+        """Test fetch_resolved_file returns the validators of the response."""
+        output = thumbnaildownload.fetch_resolved_file(
+            'Example.jpg', self.file_info, self.tmpdir, width=None,
+            transport=self.transport)
+        self.assertEqual((output.etag, output.last_modified),
+                         ('"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT'))
+
+    def test_fetch_resolved_file_not_modified(self):
+        """Test fetch_resolved_file with the validators of the current file."""
+        with self.assertRaises(thumbnaildownload.FileNotModifiedException):
+            thumbnaildownload.fetch_resolved_file(
+                'Example.jpg', self.file_info, self.tmpdir, width=None,
+                transport=self.transport, validators=('"v1"', None))
+        self.assertEqual(self.server.requests[0][1]['if-none-match'], '"v1"')
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_fetch_resolved_file_modified(self):
+        """Test fetch_resolved_file with outdated validators."""
+        output = thumbnaildownload.fetch_resolved_file(
+            'Example.jpg', self.file_info, self.tmpdir, width=None,
+            transport=self.transport, validators=('"v0"', None))
+        self.assertEqual(open(output.path, 'rb').read(), self.contents)
+
 
 class TestCommonsDownloaderOnline(unittest.TestCase):
 
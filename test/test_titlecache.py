@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import time
+import tempfile
+import unittest
+from os.path import join
+from commonsdownloader import titlecache
+from commonsdownloader.imageinfo import FileInfo
+
+
+class TestTitleCache(unittest.TestCase):
+
+    """Testing the TitleCache."""
+
+    def setUp(self):
+        """Open a cache in a temporary directory."""
+        self.path = join(tempfile.mkdtemp(), 'titles.sqlite')
+        self.cache = titlecache.TitleCache(self.path)
+        self.info = FileInfo('File:Example.jpg', 'https://upload.example/Example.jpg',
+                             'image/jpeg', 800, 600, 1234, 'abc', None, None)
+
+    def tearDown(self):
+        """Close the cache."""
+        self.cache.close()
+
+    def test_put_many(self):
+        """Test the FileInfo and missing files are cached, and persisted."""
+        self.cache.put_many({'File:Example.jpg': self.info, 'File:Missing.jpg': None})
+        self.cache.close()
+        self.cache = titlecache.TitleCache(self.path)
+        self.assertEqual(self.cache.get_many(['File:Example.jpg', 'File:Missing.jpg',
+                                              'File:Other.jpg']),
+                         {'File:Example.jpg': self.info, 'File:Missing.jpg': None})
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_expiry(self):
+        """Test missing files expire after negative_ttl seconds."""
+        self.cache.negative_ttl = -1
+        self.cache.put_many({'File:Example.jpg': self.info, 'File:Missing.jpg': None})
+        self.assertEqual(self.cache.get_many(['File:Example.jpg', 'File:Missing.jpg']),
+                         {'File:Example.jpg': self.info})
+
+    def test_trim(self):
+        """Test the least recently used titles are dropped beyond max_entries."""
+        self.cache.max_entries = 2
+        for title in ('File:A.jpg', 'File:B.jpg', 'File:C.jpg'):
+            self.cache.put_many({title: None})
+            time.sleep(0.01)
+        self.cache.get_many(['File:A.jpg'])
+        self.cache.close()
+        self.cache = titlecache.TitleCache(self.path)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(sorted(self.cache.get_many(['File:A.jpg', 'File:B.jpg',
+                                                     'File:C.jpg'])),
+                         ['File:A.jpg', 'File:C.jpg'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: latin-1 -*-
+
+"""Unit tests."""
+
+import threading
+import time
+import unittest
+from commonsdownloader import workerpool
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    """Testing methods from workerpool."""
+
+    def test_run_in_worker_pool_calls_every_task(self):
+        """Test run_in_worker_pool calls the function once per task."""
+        results = []
+        lock = threading.Lock()
+
+        def function(a, b):
+            with lock:
+                results.append(a + b)
+
+        arguments = [(i, 1) for i in range(20)]
+        workerpool.run_in_worker_pool(function, iter(arguments), jobs=4)
+        self.assertEqual(sorted(results), range(1, 21))
+
+    def test_run_in_worker_pool_serially(self):
+        """Test run_in_worker_pool keeps the input order with one job."""
+        results = []
+        workerpool.run_in_worker_pool(results.append, [(i,) for i in range(5)])
+        self.assertEqual(results, range(5))
+
+    def test_run_in_worker_pool_is_concurrent(self):
+        """Test run_in_worker_pool runs tasks at the same time."""
+        start = time.time()
+        workerpool.run_in_worker_pool(time.sleep, [(0.2,)] * 4, jobs=4)
+        self.assertLess(time.time() - start, 0.6)
+
+    def test_run_in_worker_pool_consumes_lazily(self):
+        """Test run_in_worker_pool does not exhaust the iterator upfront."""
+        pulled = []
+        release = threading.Event()
+
+        def generator():
+            for i in range(100):
+                pulled.append(i)
+                yield (i,)
+
+        def function(_):
+            release.wait()
+
+        thread = threading.Thread(target=workerpool.run_in_worker_pool,
+                                  args=(function, generator()),
+                                  kwargs={'jobs': 2})
+        thread.start()
+        time.sleep(0.2)
+        self.assertLessEqual(len(pulled), 2 + 2 * 2 + 1)
+        release.set()
+        thread.join()
+        self.assertEqual(len(pulled), 100)
+
+    def test_run_in_worker_pool_survives_errors(self):
+        """Test run_in_worker_pool goes on when a task raises."""
+        results = []
+
+        def function(i):
+            if i == 2:
+                raise ValueError("Boom")
+            results.append(i)
+
+        workerpool.run_in_worker_pool(function, [(i,) for i in range(5)],
+                                      jobs=2)
+        self.assertEqual(sorted(results), [0, 1, 3, 4])
+
+    def test_prefetch(self):
+        """Test prefetch yields all the items in order."""
+        output = list(workerpool.prefetch(iter(range(50)), size=10))
+        self.assertEqual(output, range(50))
+
+    def test_prefetch_runs_ahead(self):
+        """Test prefetch pulls items while the consumer is busy."""
+        pulled = []
+
+        def generator():
+            for i in range(10):
+                pulled.append(i)
+                yield i
+
+        output = workerpool.prefetch(generator(), size=5)
+        next(output)
+        time.sleep(0.1)
+        self.assertEqual(len(pulled), 7)
+
+    def test_prefetch_with_error(self):
+        """Test prefetch raises the errors of the iterable."""
+        def generator():
+            yield 1
+            raise ValueError("Boom")
+
+        output = workerpool.prefetch(generator())
+        self.assertEqual(next(output), 1)
+        with self.assertRaises(ValueError):
+            next(output)
+
+
+class TestRunWithRetries(unittest.TestCase):
+
+    """Testing run_with_retries."""
+
+    def setUp(self):
+        """Set up a function failing on its first calls."""
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def make_function(self, failures):
+        """Return a function failing the given number of times per item."""
+        def function(item):
+            with self.lock:
+                self.calls.append(item)
+                if self.calls.count(item) <= failures.get(item, 0):
+                    raise IOError("Unavailable")
+        return function
+
+    @staticmethod
+    def get_retry_delay(exception, attempt):
+        """Retry IOErrors right away."""
+        if isinstance(exception, IOError):
+            return 0
+        return None
+
+    def test_run_with_retries(self):
+        """Test failed calls are retried at the end of the job."""
+        function = self.make_function({1: 2})
+        workerpool.run_with_retries(function, [(i,) for i in range(4)],
+                                    self.get_retry_delay, max_attempts=5)
+        self.assertEqual(self.calls, [0, 1, 2, 3, 1, 1])
+
+    def test_run_with_retries_gives_up(self):
+        """Test calls are not retried beyond max_attempts."""
+        function = self.make_function({1: 10})
+        workerpool.run_with_retries(function, [(i,) for i in range(4)],
+                                    self.get_retry_delay, jobs=2,
+                                    max_attempts=3)
+        self.assertEqual(self.calls.count(1), 3)
+        self.assertEqual(len(self.calls), 6)
+
+    def test_run_with_retries_waits_for_delay(self):
+        """Test calls are retried after their delay."""
+        function = self.make_function({0: 1})
+        start = time.time()
+        workerpool.run_with_retries(function, [(0,)],
+                                    lambda exception, attempt: 0.2,
+                                    jobs=2, max_attempts=2)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertEqual(self.calls, [0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()